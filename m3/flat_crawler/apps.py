@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class FlatCrawlerConfig(AppConfig):
     name = 'flat_crawler'
+
+    def ready(self):
+        from flat_crawler.utils.db_writer import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection)
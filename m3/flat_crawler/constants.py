@@ -4,6 +4,8 @@ from django.conf import settings
 
 THUMBNAIL_SIZE = (150, 100)
 MINATURE_SIZE = (4, 2)
+# Position of post thumbnail among its images, photos are numbered from 0
+THUMBNAIL_IMG_POS = -1
 
 CITY_WARSAW = 'Warsaw'
 
@@ -34,6 +36,23 @@ SELECTED_DISTRICTS = settings.SELECTED_DISTRICTS
 IGNORED_DISTRICTS = settings.IGNORED_DISTRICTS
 MIN_PRICE = settings.DEFAULT_MIN_PRICE
 MAX_PRICE = settings.DEFAULT_MAX_PRICE
+IMAGE_ATLAS_DIR = settings.IMAGE_ATLAS_DIR
+SQLITE_CONCURRENT_MODE = settings.SQLITE_CONCURRENT_MODE
+DB_WRITER_BATCH_SIZE = settings.DB_WRITER_BATCH_SIZE
+POST_HASH_BLOOM_DIR = settings.POST_HASH_BLOOM_DIR
+POST_ARCHIVE_PATH = settings.POST_ARCHIVE_PATH
+IMAGE_HASH_RADIUS = settings.IMAGE_HASH_RADIUS
+IMAGE_DATA_CACHE_MB = settings.IMAGE_DATA_CACHE_MB
+IMAGE_MATCHING_WORKERS = settings.IMAGE_MATCHING_WORKERS
+HISTOGRAM_INDEX_DIR = settings.HISTOGRAM_INDEX_DIR
+HISTOGRAM_INDEX_TOP_K = settings.HISTOGRAM_INDEX_TOP_K
+HISTOGRAM_INDEX_MIN_SIMILARITY = settings.HISTOGRAM_INDEX_MIN_SIMILARITY
+IMAGE_FEATURES_JIT = settings.IMAGE_FEATURES_JIT
+IMAGE_COMPARERS_BACKEND = settings.IMAGE_COMPARERS_BACKEND
+IMAGE_MATCHING_EXHAUSTIVE = settings.IMAGE_MATCHING_EXHAUSTIVE
+CONSOLIDATION_MIN_IMAGE_SCORE = settings.CONSOLIDATION_MIN_IMAGE_SCORE
+CONSOLIDATION_MIN_IMAGE_MATCHES = settings.CONSOLIDATION_MIN_IMAGE_MATCHES
+MATCHING_BLOCKING_INDEX = settings.MATCHING_BLOCKING_INDEX
 
 
 # Units to seconds
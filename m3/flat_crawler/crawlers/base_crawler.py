@@ -11,9 +11,13 @@ from PIL import Image
 from bs4 import BeautifulSoup
 
 from flat_crawler.constants import THUMBNAIL_SIZE, CITY_WARSAW
-from flat_crawler.models import FlatPost, PostHash, CrawlingLog
+from flat_crawler.models import FlatPost, CrawlingLog
 from flat_crawler.crawlers.helpers import get_soup_from_url
 from flat_crawler.utils.img_utils import get_img_bytes_from_url, img_urls_to_bytes
+from flat_crawler.utils.img_atlas import get_image_atlas
+from flat_crawler.utils.img_fingerprints import add_image_fingerprints
+from flat_crawler.utils.db_writer import get_db_writer
+from flat_crawler.utils.post_hashes import get_post_hash_index
 from flat_crawler.utils.text_utils import deduce_size_from_text
 from flat_crawler import exceptions
 
@@ -60,16 +64,24 @@ class BaseCrawler(ABC):
         page_start=1,
         page_stop=DEFAULT_PAGE_STOP,
         city=CITY_WARSAW,
+        age_out_post_hashes=False,
         **kwargs,
     ):
+        """
+        Args:
+            age_out_post_hashes: If True, posts seen more than lookback_days ago
+                are treated as new.
+        """
         self._fetch_posts_since_date = datetime.date.today() - timedelta(days=lookback_days)
         self._post_filter = post_filter if post_filter is not None else NoopFilter()
         self._allow_pages_without_new_posts = allow_pages_without_new_posts
         self._page_start = page_start
         self._page_stop = page_stop
         self._city = city
-        self._post_hashes = set(
-            PostHash.objects.filter(source=self.SOURCE).values_list('post_hash', flat=True) # pylint: disable=no-member
+        self._image_atlas = get_image_atlas()
+        self._db_writer = get_db_writer()
+        self._post_hashes = get_post_hash_index(
+            source=self.SOURCE, max_age_days=lookback_days if age_out_post_hashes else None
         )
 
         self._field_getters_dict = {
@@ -87,10 +99,8 @@ class BaseCrawler(ABC):
         }
 
         # Those fields will be extracted after initial verification
-        # (only if post hasn't been skipped)
-        self._postprocessing_field_getters_dict = {
-            'photos_bytes': self._get_photos_bytes,
-        }
+        # (only if post hasn't been skipped). Photos are added by _add_photos.
+        self._postprocessing_field_getters_dict = {}
 
     def fetch_new_posts(self):
         crawl_from_date = self._get_date_to_crawl_from()
@@ -118,6 +128,8 @@ class BaseCrawler(ABC):
             if oldest_dt.date() < crawl_from_date:
                 logger.info(f"Stop crawling, fetched all posts since {oldest_dt}")
                 break
+        self._post_hashes.flush()
+        self._db_writer.flush()
 
     def _get_crawl_id(self) -> str:
         return ""
@@ -126,13 +138,18 @@ class BaseCrawler(ABC):
         crawl_id = self._get_crawl_id()
         date_crawled = oldest_crawled_dt.date() + timedelta(days=1)
         while date_crawled < newest_crawled_dt.date():
-            _, new_date = CrawlingLog.objects.get_or_create(
-                source=self.SOURCE, crawl_id=crawl_id, date_fully_crawled=date_crawled
+            self._db_writer.run(
+                self._log_date_fully_crawled, crawl_id=crawl_id, date_crawled=date_crawled
             )
-            if new_date:
-                logger.info(f"Crawled all posts from {date_crawled} on {self.SOURCE}")
             date_crawled += timedelta(days=1)
 
+    def _log_date_fully_crawled(self, crawl_id: str, date_crawled: datetime.date):
+        _, new_date = CrawlingLog.objects.get_or_create(
+            source=self.SOURCE, crawl_id=crawl_id, date_fully_crawled=date_crawled
+        )
+        if new_date:
+            logger.info(f"Crawled all posts from {date_crawled} on {self.SOURCE}")
+
     def _get_date_to_crawl_from(self):
         crawl_id = self._get_crawl_id()
         dates_crawled = set(CrawlingLog.objects.filter(
@@ -204,6 +221,8 @@ class BaseCrawler(ABC):
             field_val = field_getter(soup=soup_info)
             if field_val is not None:
                 setattr(post, field, field_val)
+        if postprocessing and post.photos_bytes is None:
+            self._add_photos(post=post, soup=soup_info)
         return post
 
     def _process_post_sketch(self, post_sketch: FlatPost, base_soup: BeautifulSoup) -> None:
@@ -239,17 +258,19 @@ class BaseCrawler(ABC):
         post_hash = hashlib.md5(post_bytes).hexdigest()
         existing = post_hash in self._post_hashes
         if not existing:
-            PostHash(source=self.SOURCE, post_hash=post_hash).save()
             self._post_hashes.add(post_hash)
         return post_hash, existing
 
     def _save_post(self, post: FlatPost) -> None:
         logger.info(f"Saving FlatPost: {post}")
         try:
-            post.save()
+            # In concurrent mode raises DBWriteFailed for failed writes scheduled before
+            self._db_writer.save(post)
         except Exception as exc:
             logger.error(f"{post} Failed to be saved")
             raise exceptions.PostFailedToSave(exc)
+        if self._image_atlas is not None:
+            self._image_atlas.add_post(post)
 
     def _extract_posts_from_page_soup(
         self, page_soup: BeautifulSoup
@@ -302,10 +323,14 @@ class BaseCrawler(ABC):
     def _get_desc(self, soup: SoupInfo) -> Optional[str]:
         return None
 
-    def _get_photos_bytes(self, soup: SoupInfo) -> Optional[bytes]:
+    def _add_photos(self, post: FlatPost, soup: SoupInfo) -> None:
+        """ Adds photos_bytes, and fingerprints of the stored photos while they are decoded. """
         img_urls = self._get_img_urls(soup=soup)
-        if img_urls is not None:
-            return img_urls_to_bytes(img_urls=img_urls)
+        if img_urls is None:
+            return
+        images = []
+        post.photos_bytes = img_urls_to_bytes(img_urls=img_urls, images=images)
+        add_image_fingerprints(post=post, images=images)
 
     def _get_img_urls(self, soup: SoupInfo) -> Optional[List[str]]:
         return None
@@ -27,4 +27,13 @@ class NotRecognizedDistrict(Exception):
 
 
 class InvalidTimedeltaStr(CrawlingException):
-    pass
\ No newline at end of file
+    pass
+
+class DBWriteFailed(Exception):
+    """ Writes executed by QueuedDBWriter in the background failed, see DBWriter.flush. """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(
+            f"{len(failures)} writes failed: " + '; '.join(f"{func}: {exc!r}" for func, exc in failures)
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flat_crawler.utils.post_archive import PostArchive
+from flat_crawler.models import FlatPost
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-rows', action='store_true',
+            help='Delete archived posts from the database, unless they are original posts of flats',
+        )
+        parser.add_argument(
+            '--restore', nargs='+', type=str, default=None, help='Ids of posts to restore',
+        )
+        parser.add_argument(
+            '--restore-all', action='store_true', help='Restore all archived posts',
+        )
+        parser.add_argument('--limit', nargs='?', type=int, default=None)
+
+    def handle(self, *args, **options):
+        archive = PostArchive()
+        if options.get('restore_all'):
+            self._restore_posts(archive, post_ids=archive.get_archived_ids())
+        elif options.get('restore'):
+            self._restore_posts(archive, post_ids=options['restore'])
+        else:
+            self._archive_posts(
+                archive, delete_rows=options.get('delete_rows'), limit=options.get('limit')
+            )
+        archive.close()
+
+    def _archive_posts(self, archive: PostArchive, delete_rows: bool, limit=None):
+        posts = FlatPost.objects.filter(is_broken=True, archived=False)
+        if limit:
+            posts = posts[:limit]
+        num_archived = 0
+        for post in posts.iterator():
+            archive.archive_post(post, delete_row=delete_rows)
+            num_archived += 1
+        print(f"Archived {num_archived} posts, {len(archive)} posts in the archive.")
+
+    def _restore_posts(self, archive: PostArchive, post_ids):
+        num_restored = 0
+        for post_id in post_ids:
+            if archive.restore_post(post_id) is not None:
+                num_restored += 1
+        print(f"Restored {num_restored} / {len(post_ids)} posts.")
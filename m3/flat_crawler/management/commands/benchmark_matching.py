@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flat_crawler.constants import IMAGE_COMPARERS_BACKEND
+from flat_crawler.utils.compute_backends import BACKENDS
+from flat_crawler.utils.matching_benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures speed, precision and recall of image matching on a synthetic corpus.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variants', type=int, default=2,
+            help='Number of crops, logo overlays and brightness shifts of each test image',
+        )
+        parser.add_argument(
+            '--img-size', nargs=2, type=int, default=None, metavar=('WIDTH', 'HEIGHT'),
+            help='Size of corpus images, THUMBNAIL_SIZE by default',
+        )
+        parser.add_argument('--photos-per-post', type=int, default=2)
+        parser.add_argument('--workers', type=int, default=None, help='Process pool size of the engine')
+        parser.add_argument('--no-cascade', action='store_true')
+        parser.add_argument('--no-pyramid', action='store_true', help='Score pairs at full resolution only')
+        parser.add_argument(
+            '--exhaustive', action='store_true', help='Compare all pairs of gallery images of candidates',
+        )
+        parser.add_argument(
+            '--backend', choices=sorted(BACKENDS), default=IMAGE_COMPARERS_BACKEND,
+            help='Compute backend of the engine, all backends are compared anyway',
+        )
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        if options['img_size']:
+            kwargs['img_size'] = tuple(options['img_size'])
+        results = run_benchmark(
+            num_variants=options['variants'],
+            photos_per_post=options['photos_per_post'],
+            exhaustive=options['exhaustive'],
+            engine_kwargs={
+                'stop_early': True,
+                'cascade': not options['no_cascade'],
+                'pyramid': not options['no_pyramid'],
+                'num_workers': options['workers'],
+                'backend': options['backend'],
+            },
+            **kwargs,
+        )
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.histogram_index import get_histogram_index
+
+
+class Command(BaseCommand):
+    help = 'Adds images of all matched posts to the histogram index (HISTOGRAM_INDEX_DIR).'
+
+    def handle(self, *args, **options):
+        index = get_histogram_index()
+        if index is None:
+            raise CommandError('HISTOGRAM_INDEX_DIR is not set')
+        posts = FlatPost.objects.filter(flat__isnull=False, photos_bytes__isnull=False)
+        num_posts = posts.count()
+        for num, post in enumerate(posts.iterator()):
+            index.add_post(post)
+            if num % 100 == 0:
+                print(f"Indexed {num} / {num_posts} posts")
+        index.save()
+        print(f"Histogram index has {len(index)} images")
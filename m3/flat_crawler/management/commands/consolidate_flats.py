@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flat_crawler.constants import CONSOLIDATION_MIN_IMAGE_MATCHES, CONSOLIDATION_MIN_IMAGE_SCORE
+from flat_crawler.utils.flat_consolidation import consolidate_flats
+
+
+class Command(BaseCommand):
+    help = 'Merges flats of posts connected by image matches or base info, in a single transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-score', type=float, default=CONSOLIDATION_MIN_IMAGE_SCORE,
+            help='Min avg_score of image matches connecting posts',
+        )
+        parser.add_argument(
+            '--min-matches', type=int, default=CONSOLIDATION_MIN_IMAGE_MATCHES,
+            help='Min number of image matches connecting posts',
+        )
+        parser.add_argument('--dry', action='store_true', help='Only report what would be merged')
+
+    def handle(self, *args, **options):
+        stats = consolidate_flats(
+            min_image_score=options['min_score'],
+            min_image_matches=options['min_matches'],
+            dry=options['dry'],
+        )
+        print(
+            f"Merged {stats['flats_merged']} flats in {stats['components_merged']} components, "
+            f"{stats['posts_moved']} posts moved, in {stats['seconds']}s "
+            f"({stats['num_posts']} posts, {stats['num_edges']} edges)"
+        )
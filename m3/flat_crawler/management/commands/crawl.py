@@ -15,6 +15,10 @@ class Command(BaseCommand):
         parser.add_argument('--page-start', nargs='?', type=int)
         parser.add_argument('--page-stop', nargs='?', type=int)
         parser.add_argument('--otodom', action='store_true')
+        parser.add_argument(
+            '--age-out-hashes', action='store_true',
+            help='Treat posts seen before lookback days as new',
+        )
 
     def handle(self, *args, **options):
         # for district in [SRODMIESCIE, MOKOTOW, ZOLIBORZ, OCHOTA, BIELANY]:
@@ -26,6 +30,8 @@ class Command(BaseCommand):
         for key in ['page_start', 'page_stop', 'lookback_days']:
             if key in options and options[key] is not None:
                 crawler_params[key] = options[key]
+        if options.get('age_out_hashes'):
+            crawler_params['age_out_post_hashes'] = True
 
         if options.get('otodom'):
             OtodomCrawler(
@@ -8,7 +8,7 @@ from django.db.models import Count
 from flat_crawler.utils.location import extract_locations_from_text, fetch_location_geo, get_geoapi_key, get_locations_from_selected_districts, get_location_phrases_dict, get_posts_in_search_area
 from flat_crawler.utils.extract_info import extract_keys_from_text
 from flat_crawler.utils.text_utils import get_colored_text, TextColor, simplify_text
-from flat_crawler.models import FlatPost, Location, SearchArea
+from flat_crawler.models import FlatPost, FlatSummary, Location, SearchArea
 from flat_crawler.constants import SELECTED_DISTRICTS
 
 SEARCH_AREAS_FILENAME = '../various/maps/maps_polygons.txt'
@@ -129,6 +129,7 @@ class Command(BaseCommand):
                 all_keys.update(keys)
                 fp.keywords = ','.join(keys)
                 fp.save()
+                FlatSummary.refresh_for_post(fp)
 
         print(f"Total posts: {num_posts}")
         for key, num_matched in all_keys.items():
@@ -168,6 +169,8 @@ class Command(BaseCommand):
                 print(get_colored_text(text, colored_ranges=[(0, len(text))], color=TextColor.BLUE))
             fp.tried_to_extract_locations = True
             fp.save()
+            if locs:
+                FlatSummary.refresh_for_post(fp)
             print(f"{num_matched} / {num + 1}")
 
     def _attach_areas_to_posts(self, posts):
@@ -184,6 +187,7 @@ class Command(BaseCommand):
                 area_scores = post.area_scores or []
                 post.area_scores = area_scores + [(area.name, score)]
                 post.save()
+                FlatSummary.refresh_for_post(post)
                 area_cnt[area.name] += 1
         print(area_cnt.items())
 
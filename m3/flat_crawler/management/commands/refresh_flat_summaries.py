@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flat_crawler.models import Flat, FlatSummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds FlatSummary of every flat, e.g. after summaries got out of sync with flats.'
+
+    def handle(self, *args, **options):
+        flats = Flat.objects.select_related('original_post')
+        num_flats = flats.count()
+        for num, flat in enumerate(flats.iterator()):
+            FlatSummary.refresh_for_flat(flat)
+            if num % 100 == 0:
+                print(f"Refreshed {num} / {num_flats}")
+        print(f"Refreshed summaries of all {num_flats} flats")
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0053_auto_20210304_0935'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageFeatures',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('img_pos', models.IntegerField(null=True)),
+                ('comparer_key', models.CharField(max_length=100)),
+                ('features', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_features', to='flat_crawler.flatpost')),
+            ],
+            options={
+                'unique_together': {('post', 'img_pos', 'comparer_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:21
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicated_image_matches(apps, schema_editor):
+    """ Keeps the oldest ImageMatch of each image pair, so unique constraint can be added. """
+    ImageMatch = apps.get_model('flat_crawler', 'ImageMatch')
+    pair_fields = ['post_1', 'img_pos_1', 'post_2', 'img_pos_2']
+    duplicated = ImageMatch.objects.values(*pair_fields).annotate(
+        num_matches=Count('id'), min_id=Min('id')
+    ).filter(num_matches__gt=1)
+    for pair in duplicated:
+        ImageMatch.objects.filter(
+            **{field: pair[field] for field in pair_fields}
+        ).exclude(id=pair['min_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0054_imagefeatures'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flatpost',
+            index=models.Index(condition=models.Q(is_original_post=True), fields=['size_m2', 'price'], name='flatpost_candidates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatpost',
+            index=models.Index(fields=['flat', 'is_broken'], name='flatpost_unmatched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatpost',
+            index=models.Index(fields=['district', 'tried_to_extract_locations'], name='flatpost_district_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatpost',
+            index=models.Index(fields=['dt_posted'], name='flatpost_dt_posted_idx'),
+        ),
+        migrations.RunPython(remove_duplicated_image_matches, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='imagematch',
+            constraint=models.UniqueConstraint(fields=('post_1', 'img_pos_1', 'post_2', 'img_pos_2'), name='unique_image_match'),
+        ),
+    ]
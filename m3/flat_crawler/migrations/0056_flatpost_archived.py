@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0055_flat_post_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatpost',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
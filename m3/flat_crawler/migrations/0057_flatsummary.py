@@ -0,0 +1,110 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:24
+
+import base64
+from urllib import parse
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+AREA_STARY_MOKOTOW = 'stary-mokotow'
+SOURCE_TO_NAME = {'GT': 'gumtree'}
+
+
+def _get_location_color(post, location_score):
+    if location_score == 0:
+        return "red"
+    elif location_score < 0.001:
+        return "orange"
+    if post.areas.filter(name=AREA_STARY_MOKOTOW).exists():
+        return "green"
+    return "black"
+
+
+def create_flat_summaries(apps, schema_editor):
+    """ Summaries of existing flats, computed as by FlatSummary.refresh_for_flat and Flat properties. """
+    Flat = apps.get_model('flat_crawler', 'Flat')
+    FlatPost = apps.get_model('flat_crawler', 'FlatPost')
+    FlatSummary = apps.get_model('flat_crawler', 'FlatSummary')
+    flats = Flat.objects.select_related('original_post').defer(
+        'original_post__photos_bytes', 'original_post__post_soup', 'original_post__post_detailed_soup'
+    )
+    summaries = []
+    for flat in flats.iterator():
+        post = flat.original_post
+        last_post = FlatPost.objects.filter(
+            flat=flat, is_broken=False, expired=False
+        ).order_by('dt_posted').only('url', 'price').last() or post
+        location_names = [location.short_name for location in post.locations.all()]
+        if location_names:
+            location_score = sum(x[1] for x in post.area_scores or []) / len(location_names)
+        else:
+            location_score = 0.00001
+        summaries.append(FlatSummary(
+            flat=flat,
+            created=flat.created,
+            min_price=flat.min_price,
+            rejected=flat.rejected,
+            starred=flat.starred,
+            hearted=flat.hearted,
+            url=last_post.url,
+            price=last_post.price,
+            dt_posted=post.dt_posted,
+            date_added=str(post.dt_posted.date()) if post.dt_posted else None,
+            size_m2=post.size_m2,
+            district=post.district,
+            heading=post.heading,
+            title_q=parse.quote(f'{SOURCE_TO_NAME.get(post.source, "")} "{post.heading}"'),
+            desc=post.desc,
+            keywords=', '.join(post.keywords.split(',')) if post.keywords is not None else '',
+            thumbnail_image=base64.b64encode(post.thumbnail).decode('utf-8') if post.thumbnail is not None else None,
+            location_names=', '.join(location_names),
+            location_score=location_score,
+            location_color=_get_location_color(post=post, location_score=location_score),
+            outside_search_areas=bool(location_names) and not post.areas.exists(),
+        ))
+    FlatSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0056_flatpost_archived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlatSummary',
+            fields=[
+                ('flat', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='flat_crawler.flat')),
+                ('created', models.DateTimeField()),
+                ('min_price', models.IntegerField(null=True)),
+                ('rejected', models.BooleanField(default=False)),
+                ('starred', models.BooleanField(default=False)),
+                ('hearted', models.BooleanField(default=False)),
+                ('url', models.URLField(max_length=300, null=True)),
+                ('price', models.IntegerField(null=True)),
+                ('dt_posted', models.DateTimeField(null=True)),
+                ('date_added', models.CharField(max_length=10, null=True)),
+                ('size_m2', models.FloatField(null=True)),
+                ('district', models.CharField(max_length=50, null=True)),
+                ('heading', models.CharField(max_length=200, null=True)),
+                ('title_q', models.TextField(null=True)),
+                ('desc', models.TextField(null=True)),
+                ('keywords', models.TextField(null=True)),
+                ('thumbnail_image', models.TextField(null=True)),
+                ('location_names', models.TextField(null=True)),
+                ('location_score', models.FloatField(null=True)),
+                ('location_color', models.CharField(max_length=10, null=True)),
+                ('outside_search_areas', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='flatsummary',
+            index=models.Index(fields=['district', 'dt_posted'], name='flatsummary_dt_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flatsummary',
+            index=models.Index(fields=['district', 'min_price'], name='flatsummary_min_price_idx'),
+        ),
+        migrations.RunPython(create_flat_summaries, migrations.RunPython.noop),
+    ]
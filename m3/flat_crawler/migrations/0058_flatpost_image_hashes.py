@@ -0,0 +1,19 @@
+# Generated by Django 3.1.5 on 2026-10-19 08:29
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0057_flatsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatpost',
+            name='image_hashes',
+            field=jsonfield.fields.JSONField(null=True),
+        ),
+    ]
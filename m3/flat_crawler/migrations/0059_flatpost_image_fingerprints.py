@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0058_flatpost_image_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatpost',
+            name='image_fingerprints',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:25
+
+from django.db import migrations, models
+from django.db.models import Q
+
+# flat_crawler.constants.THUMBNAIL_IMG_POS, thumbnails were stored with NULL position
+THUMBNAIL_IMG_POS = -1
+DELETE_BATCH_SIZE = 500
+
+
+def _set_thumbnail_positions(model, key_fields, pos_fields):
+    """ Replaces NULL positions with THUMBNAIL_IMG_POS, keeping the oldest row of each key. """
+    thumbnail = Q()
+    for field in pos_fields:
+        thumbnail |= Q(**{f'{field}__isnull': True}) | Q(**{field: THUMBNAIL_IMG_POS})
+    seen, duplicated_ids = set(), []
+    for row in model.objects.filter(thumbnail).order_by('id').values('id', *key_fields).iterator():
+        key = tuple(
+            THUMBNAIL_IMG_POS if field in pos_fields and row[field] is None else row[field]
+            for field in key_fields
+        )
+        if key in seen:
+            duplicated_ids.append(row['id'])
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicated_ids), DELETE_BATCH_SIZE):
+        model.objects.filter(id__in=duplicated_ids[start:start + DELETE_BATCH_SIZE]).delete()
+    for field in pos_fields:
+        model.objects.filter(**{f'{field}__isnull': True}).update(**{field: THUMBNAIL_IMG_POS})
+
+
+def set_thumbnail_positions(apps, schema_editor):
+    _set_thumbnail_positions(
+        model=apps.get_model('flat_crawler', 'ImageMatch'),
+        key_fields=['post_1', 'img_pos_1', 'post_2', 'img_pos_2'],
+        pos_fields=['img_pos_1', 'img_pos_2'],
+    )
+    _set_thumbnail_positions(
+        model=apps.get_model('flat_crawler', 'ImageFeatures'),
+        key_fields=['post', 'img_pos', 'comparer_key'],
+        pos_fields=['img_pos'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0059_flatpost_image_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_thumbnail_positions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='imagematch',
+            name='img_pos_1',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='imagematch',
+            name='img_pos_2',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='imagefeatures',
+            name='img_pos',
+            field=models.IntegerField(),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:40
+
+from django.db import migrations
+from django.db.models import Q
+
+# Features of these comparer versions included pixel arrays, which are now recomputed instead
+PIXEL_FEATURE_KEY_PREFIXES = [
+    f'{comparer_id}:v{version}:'
+    for comparer_id in ['SsimComparer', 'CrossCorrComparer']
+    for version in range(1, 4)
+]
+
+
+def delete_pixel_features(apps, schema_editor):
+    ImageFeatures = apps.get_model('flat_crawler', 'ImageFeatures')
+    pixel_features = Q()
+    for prefix in PIXEL_FEATURE_KEY_PREFIXES:
+        pixel_features |= Q(comparer_key__startswith=prefix)
+    ImageFeatures.objects.filter(pixel_features).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0060_thumbnail_img_pos'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_pixel_features, migrations.RunPython.noop),
+    ]
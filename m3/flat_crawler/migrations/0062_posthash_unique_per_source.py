@@ -0,0 +1,22 @@
+# Generated by Django 3.1.5 on 2026-10-19 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flat_crawler', '0061_delete_pixel_features'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='posthash',
+            name='post_hash',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterUniqueTogether(
+            name='posthash',
+            unique_together={('source', 'post_hash')},
+        ),
+    ]
@@ -76,9 +76,13 @@ class BaseFlatInfo(models.Model):
 
 class PostHash(models.Model):
     source = models.CharField(max_length=6, choices=Source.choices)
-    post_hash = models.CharField(max_length=64, unique=True)
+    post_hash = models.CharField(max_length=64)
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Each source has its own PostHashIndex
+        unique_together = [['source', 'post_hash']]
+
 
 class CrawlingLog(models.Model):
     source = models.CharField(max_length=6, choices=Source.choices)
@@ -124,13 +128,19 @@ class Flat(models.Model):
 
     @property
     def thumbnail_image(self):
+        if self.original_post.thumbnail is None:
+            return None
         return base64.b64encode(self.original_post.thumbnail).decode('utf-8')
 
     @property
     def photos(self):
-        return [
-            base64.b64encode(photo).decode('utf-8') for photo in self.original_post.photos_bytes.split(IMG_BYTES_DELIM)
-        ]
+        return self.encode_photos(self.original_post.photos_bytes)
+
+    @staticmethod
+    def encode_photos(photos_bytes):
+        if photos_bytes is None:
+            return []
+        return [base64.b64encode(photo).decode('utf-8') for photo in photos_bytes.split(IMG_BYTES_DELIM)]
 
     @property
     def size_m2(self):
@@ -198,6 +208,9 @@ class Flat(models.Model):
         else:
             return
         self.save()
+        FlatSummary.objects.filter(flat=self).update(
+            hearted=self.hearted, starred=self.starred, rejected=self.rejected
+        )
 
 
 class FlatPost(BaseFlatInfo):
@@ -240,6 +253,30 @@ class FlatPost(BaseFlatInfo):
     post_hash = models.CharField(max_length=64)
     is_broken = models.BooleanField(default=False)
     exception_str = models.TextField(null=True)
+    # Blobs were moved to the post archive, see utils/post_archive.py
+    archived = models.BooleanField(default=False)
+    # dHash of each photo, see utils/img_hash.py
+    image_hashes = jsonfield.JSONField(null=True)
+    # Colour histograms and coarse images of photos computed by the crawler,
+    # see utils/img_fingerprints.py
+    image_fingerprints = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            # MatchingEngine._get_candidates, partial as sqlite can't use index on
+            # a bare boolean column in "WHERE is_original_post".
+            models.Index(
+                fields=['size_m2', 'price'],
+                condition=models.Q(is_original_post=True),
+                name='flatpost_candidates_idx',
+            ),
+            # Unmatched posts in MatchingEngine.match_posts
+            models.Index(fields=['flat', 'is_broken'], name='flatpost_unmatched_idx'),
+            # extract_info command
+            models.Index(fields=['district', 'tried_to_extract_locations'], name='flatpost_district_idx'),
+            # FlatView ordering
+            models.Index(fields=['dt_posted'], name='flatpost_dt_posted_idx'),
+        ]
 
     @property
     def thumbnail_image(self):
@@ -262,6 +299,83 @@ class FlatPost(BaseFlatInfo):
         # return f"\n\t{self.heading[:100]}\n{url}\n\t id: {self.id}"
 
 
+class FlatSummary(models.Model):
+    """ Denormalized Flat data served by FlatView, without joins or per-row queries.
+
+    Has to be refreshed whenever the flat, its posts, their locations or areas change.
+    Photos are not copied, FlatView serves them from the original post.
+    """
+    flat = models.OneToOneField(Flat, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    created = models.DateTimeField()
+    min_price = models.IntegerField(null=True)
+    rejected = models.BooleanField(default=False)
+    starred = models.BooleanField(default=False)
+    hearted = models.BooleanField(default=False)
+
+    # From the last active post
+    url = models.URLField(max_length=300, null=True)
+    price = models.IntegerField(null=True)
+
+    # From the original post
+    dt_posted = models.DateTimeField(null=True)
+    date_added = models.CharField(max_length=10, null=True)
+    size_m2 = models.FloatField(null=True)
+    district = models.CharField(max_length=50, null=True)
+    heading = models.CharField(max_length=200, null=True)
+    title_q = models.TextField(null=True)
+    desc = models.TextField(null=True)
+    keywords = models.TextField(null=True)
+    thumbnail_image = models.TextField(null=True)
+    location_names = models.TextField(null=True)
+    location_score = models.FloatField(null=True)
+    location_color = models.CharField(max_length=10, null=True)
+    # Original post has locations, but none of them is in a search area
+    outside_search_areas = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['district', 'dt_posted'], name='flatsummary_dt_posted_idx'),
+            models.Index(fields=['district', 'min_price'], name='flatsummary_min_price_idx'),
+        ]
+
+    @classmethod
+    def refresh_for_flat(cls, flat: Flat) -> 'FlatSummary':
+        original_post = flat.original_post
+        last_post = flat.last_post or original_post
+        summary = cls(
+            flat=flat,
+            created=flat.created,
+            min_price=flat.min_price,
+            rejected=flat.rejected,
+            starred=flat.starred,
+            hearted=flat.hearted,
+            url=last_post.url,
+            price=last_post.price,
+            dt_posted=original_post.dt_posted,
+            date_added=flat.date_added if original_post.dt_posted else None,
+            size_m2=original_post.size_m2,
+            district=original_post.district,
+            heading=original_post.heading,
+            title_q=flat.title_q,
+            desc=original_post.desc,
+            keywords=flat.keywords,
+            thumbnail_image=flat.thumbnail_image,
+            location_names=flat.location_names,
+            location_score=flat.location_score,
+            location_color=flat.location_color,
+            outside_search_areas=(
+                original_post.locations.exists() and not original_post.areas.exists()
+            ),
+        )
+        summary.save()
+        return summary
+
+    @classmethod
+    def refresh_for_post(cls, post: 'FlatPost') -> None:
+        if post.flat_id is not None:
+            cls.refresh_for_flat(Flat.objects.get(id=post.flat_id))
+
+
 class MatchingFlatPostGroup(models.Model):
     group_id_hash = models.TextField()
     posts = models.ManyToManyField(FlatPost)
@@ -271,14 +385,14 @@ class ImageMatch(models.Model):
     post_1 = models.ForeignKey(
         FlatPost, on_delete=models.SET_NULL, blank=True, null=True, related_name='img_match_1'
     )
-    # Position of image on decompressed post_1.photos_bytes list, None means thumbnail
-    img_pos_1 = models.IntegerField(null=True)
+    # Position of image on decompressed post_1.photos_bytes list, THUMBNAIL_IMG_POS means thumbnail
+    img_pos_1 = models.IntegerField()
 
     post_2 = models.ForeignKey(
         FlatPost, on_delete=models.SET_NULL, blank=True, null=True, related_name='img_match_2'
     )
-    # Position of image on decompressed post_2.photos_bytes list, None means thumbnail
-    img_pos_2 = models.IntegerField(null=True)
+    # Position of image on decompressed post_2.photos_bytes list, THUMBNAIL_IMG_POS means thumbnail
+    img_pos_2 = models.IntegerField()
 
     num_comparers_confirmed = models.IntegerField(null=True)
     num_comparers_maybe_matched = models.IntegerField(null=True)
@@ -287,3 +401,24 @@ class ImageMatch(models.Model):
     # Dict: comparer_id: comparer_score
     details_json = models.TextField(null=True)
     created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post_1', 'img_pos_1', 'post_2', 'img_pos_2'], name='unique_image_match'
+            ),
+        ]
+
+
+class ImageFeatures(models.Model):
+    post = models.ForeignKey(FlatPost, on_delete=models.CASCADE, related_name='image_features')
+    # Position of image on decompressed post.photos_bytes list, THUMBNAIL_IMG_POS means thumbnail
+    img_pos = models.IntegerField()
+    # Comparer id, version and parameters, e.g. "SimpleHistComparer:v1:bins=20"
+    comparer_key = models.CharField(max_length=100)
+    # Comparer features stored as np.savez_compressed archive
+    features = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['post', 'img_pos', 'comparer_key']]
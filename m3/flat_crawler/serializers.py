@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from flat_crawler.models import Flat
+from flat_crawler.models import Flat, FlatSummary
 
 
 class FlatSerializers(serializers.ModelSerializer):
@@ -8,4 +8,14 @@ class FlatSerializers(serializers.ModelSerializer):
         fields = ('id', 'url', 'thumbnail_image', 'size_m2', 'min_price',
                   'heading', 'desc', 'district', 'rejected', 'starred', 'hearted', 'created',
                   'dt_posted', 'photos', 'location_names', 'location_color', 'keywords',
-                  'date_added', 'title_q')
\ No newline at end of file
+                  'date_added', 'title_q')
+
+
+class FlatSummarySerializers(serializers.ModelSerializer):
+    id = serializers.UUIDField(source='flat_id')
+    # Set by FlatView.paginate_queryset
+    photos = serializers.ReadOnlyField()
+
+    class Meta:
+        model = FlatSummary
+        fields = FlatSerializers.Meta.fields
@@ -0,0 +1,73 @@
+import pytest
+
+from flat_crawler.models import Flat, FlatPost
+from flat_crawler.utils.blocking_index import BlockingIndex
+from flat_crawler.utils.flat_post_matcher import MatchingEngine
+
+#pylint:disable=no-member
+
+
+def test_blocking_index():
+    index = BlockingIndex()
+    index.add_many([
+        ('post_1', 'flat_1', 50, 500000),
+        ('post_2', 'flat_2', 51, 600000),
+        ('post_3', 'flat_3', 51.5, 500000),
+        ('post_4', 'flat_4', None, 500000),
+    ])
+    assert len(index) == 3
+    # Bounds are included
+    assert index.query(size_m2=50, price=500000, size_delta=1, price_delta=100000) == ['post_1', 'post_2']
+    assert index.query(size_m2=52, price=450000, size_delta=1, price_delta=50000) == ['post_3']
+    assert index.get_post_ids(['flat_3', 'flat_4']) == ['post_3']
+
+    index.remove_flat('flat_2')
+    assert index.query(size_m2=50, price=500000, size_delta=1, price_delta=100000) == ['post_1']
+    # Flat gets a new original post
+    index.add('post_5', 'flat_1', 50.5, 510000)
+    assert index.query(size_m2=50, price=500000, size_delta=1, price_delta=100000) == ['post_5']
+
+
+def _create_post(size_m2, price, **kwargs):
+    post = FlatPost(heading=f'{size_m2}m2, {price}zł', size_m2=size_m2, price=price, **kwargs)
+    post.save()
+    return post
+
+
+@pytest.mark.django_db
+def test_engine_blocking_index():
+    engine = MatchingEngine(blocking_index=True)
+    for size_m2, price in [(50, 500000), (50.5, 620000), (51, 450000), (55, 500000), (50, None)]:
+        engine._create_flat_from_post(post=_create_post(size_m2, price))
+    posts = [_create_post(50, 520000), _create_post(54, 420000), _create_post(49, 400000)]
+
+    query_engine = MatchingEngine(blocking_index=False)
+    for post in posts:
+        candidates = engine._get_candidates(post=post)
+        assert sorted(cand.id for cand in candidates) == sorted(
+            cand.id for cand in query_engine._get_candidates(post=post)
+        )
+        assert all(cand.flat is not None for cand in candidates)
+
+    # Flats created during the run are candidates without reloading the index
+    engine._create_flat_from_post(post=posts[0])
+    assert posts[0].id in [cand.id for cand in engine._get_candidates(post=FlatPost(size_m2=50, price=500000))]
+
+    # Merged flats are replaced by the flat they were merged into
+    post = _create_post(50.5, 540000)
+    matches = engine._get_candidates(post=post)
+    assert len(matches) == 4
+    engine._handle_multiple_matches(post=post, matches=matches)
+    flat_ids = [cand.flat_id for cand in engine._get_candidates(post=post)]
+    assert flat_ids == [FlatPost.objects.get(id=post.id).flat_id]
+    assert Flat.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_archived_posts_are_not_candidates():
+    post = _create_post(50, 500000)
+    MatchingEngine()._create_flat_from_post(post=post)
+    FlatPost.objects.filter(id=post.id).update(archived=True)
+    for blocking_index in [True, False]:
+        engine = MatchingEngine(blocking_index=blocking_index)
+        assert engine._get_candidates(post=FlatPost(size_m2=50, price=500000)) == []
@@ -0,0 +1,55 @@
+from itertools import product
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from flat_crawler.utils.compute_backends import BACKENDS, get_backend
+from flat_crawler.utils.img_matching import ImageMatchingEngine
+from flat_crawler.utils.pixel_stats import CHANNEL_HIST, color_hist_spec
+
+IMG_IDS = ['img_0_a', 'img_0_b', 'img_1_a', 'img_1_b', 'img_2_a', 'img_2_b']
+# Reference backend, comparer thresholds were tuned with skimage SSIM
+REFERENCE = 'skimage'
+
+
+def _load_img(img_id):
+    return Image.open(f'static/test_data/images/{img_id}.jpg')
+
+
+def _float_img(image):
+    return np.asarray(image, dtype=np.float32) / 255
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_backend_parity(name):
+    backend, reference = get_backend(name), get_backend(REFERENCE)
+    float_imgs = [_float_img(_load_img(img_id)) for img_id in IMG_IDS]
+    for img_1, img_2 in product(float_imgs, repeat=2):
+        assert backend.ssim(img_1, img_2) == pytest.approx(reference.ssim(img_1, img_2), abs=1e-5)
+
+    img_arr = np.asarray(_load_img('img_0_a')).reshape(-1, 3)
+    specs = [CHANNEL_HIST, color_hist_spec(6)]
+    stats, reference_stats = backend.get_pixel_stats(img_arr, specs), reference.get_pixel_stats(img_arr, specs)
+    for spec in specs:
+        assert np.array_equal(stats[spec], reference_stats[spec])
+
+    rnd = np.random.RandomState(0)
+    hist_1, hist_2 = rnd.rand(20, 3), rnd.rand(20, 3)
+    assert np.allclose(backend.hist_correlation(hist_1, hist_2), reference.hist_correlation(hist_1, hist_2), atol=1e-5)
+    assert backend.hist_correlation(hist_1[:, 0], hist_1[:, 0]) == pytest.approx(1, abs=1e-5)
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_engine_backend_parity(name):
+    engine, reference = ImageMatchingEngine(backend=name), ImageMatchingEngine(backend=REFERENCE)
+    images = [_load_img(img_id) for img_id in IMG_IDS]
+    for img_1, img_2 in product(images, repeat=2):
+        _, _, details = engine.compare_images(img_1, img_2)
+        _, _, reference_details = reference.compare_images(img_1, img_2)
+        assert details == pytest.approx(reference_details, abs=1e-5)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_backend('cuda')
@@ -0,0 +1,27 @@
+import pytest
+
+from flat_crawler.exceptions import DBWriteFailed
+from flat_crawler.models import PostHash, Source
+from flat_crawler.utils.db_writer import QueuedDBWriter
+
+
+@pytest.mark.django_db(transaction=True)
+def test_queued_db_writer():
+    writer = QueuedDBWriter(batch_size=3)
+    for num in range(10):
+        writer.save(PostHash(source=Source.GUMTREE, post_hash=f'hash_{num}'))
+    # Duplicated hash fails, but doesn't affect other writes
+    writer.save(PostHash(source=Source.GUMTREE, post_hash='hash_0'))
+    writer.run(PostHash.objects.filter(post_hash='hash_1').delete)
+    # Failure is raised in the calling thread, once
+    with pytest.raises(DBWriteFailed) as exc_info:
+        writer.flush()
+    assert len(exc_info.value.failures) == 1
+    writer.flush()
+
+    assert writer.num_written == 11
+    assert writer.num_failed == 1
+    assert sorted(PostHash.objects.values_list('post_hash', flat=True)) == [
+        f'hash_{num}' for num in range(10) if num != 1
+    ]
+    writer.close()
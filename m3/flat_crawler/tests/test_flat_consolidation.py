@@ -0,0 +1,54 @@
+import pytest
+
+from flat_crawler.models import Flat, FlatPost, FlatSummary, ImageMatch
+from flat_crawler.utils.flat_consolidation import consolidate_flats
+from flat_crawler.utils.flat_post_matcher import MatchingEngine
+
+#pylint:disable=no-member
+
+
+def _create_flat(heading, price, **kwargs):
+    post = FlatPost(heading=heading, price=price, size_m2=50, url=f'https://{heading}', **kwargs)
+    post.save()
+    engine = MatchingEngine()
+    engine._create_flat_from_post(post=post)
+    engine._db_writer.flush()
+    return FlatPost.objects.get(id=post.id)
+
+
+def _add_image_matches(post_1, post_2, scores):
+    for pos, score in enumerate(scores):
+        ImageMatch(post_1=post_1, img_pos_1=pos, post_2=post_2, img_pos_2=pos, avg_score=score).save()
+
+
+@pytest.mark.django_db
+def test_consolidate_flats():
+    first = _create_flat('first', price=500000)
+    # Connected to first by image matches, and to third by the description
+    second = _create_flat('second', price=450000, desc='description')
+    third = _create_flat('third', price=480000, desc='description')
+    # Too few confident image matches
+    other = _create_flat('other', price=500000)
+    _add_image_matches(first, second, scores=[0.95, 0.97])
+    _add_image_matches(first, other, scores=[0.95, 0.5])
+    Flat.objects.filter(id=third.flat_id).update(hearted=True)
+
+    assert consolidate_flats(dry=True)['flats_merged'] == 2
+    assert Flat.objects.count() == 4
+
+    stats = consolidate_flats(min_image_score=0.9, min_image_matches=2)
+    assert stats['components_merged'] == 1
+    assert stats['flats_merged'] == 2
+    assert stats['posts_moved'] == 2
+    assert Flat.objects.count() == 2
+
+    flat = Flat.objects.get(id=first.flat_id)
+    assert set(flat.flatpost_set.all()) == {first, second, third}
+    assert flat.min_price == 450000
+    assert flat.hearted
+    assert not FlatPost.objects.get(id=third.id).is_original_post
+    assert FlatSummary.objects.count() == 2
+    assert FlatSummary.objects.get(flat=flat).hearted
+
+    # Nothing left to merge
+    assert consolidate_flats()['flats_merged'] == 0
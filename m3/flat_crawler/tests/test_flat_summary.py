@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from rest_framework.test import APIRequestFactory
+
+from flat_crawler.models import Flat, FlatPost, FlatSummary, Location, SearchArea
+from flat_crawler.utils.flat_post_matcher import MatchingEngine
+from flat_crawler.views import FlatView
+
+#pylint:disable=no-member
+
+
+def _create_post(heading, price, dt_posted, district='mokotow', **kwargs):
+    post = FlatPost(
+        heading=heading, price=price, size_m2=50, district=district, dt_posted=dt_posted,
+        url=f'https://{heading}', thumbnail=b'thumbnail', photos_bytes=b'photo', **kwargs
+    )
+    post.save()
+    return post
+
+
+def _get_flats(**params):
+    request = APIRequestFactory().get('/flats/', {'show_unseen': 'true', **params})
+    return FlatView.as_view()(request).data['results']
+
+
+@pytest.mark.django_db
+def test_flat_summary_is_maintained():
+    engine = MatchingEngine()
+    post = _create_post('first', price=500000, dt_posted=datetime(2021, 3, 1))
+    engine._create_flat_from_post(post=post)
+    flat = Flat.objects.get()
+
+    summary = FlatSummary.objects.get(flat=flat)
+    assert summary.heading == 'first'
+    assert summary.url == 'https://first'
+
+    newer_post = _create_post('second', price=450000, dt_posted=datetime(2021, 3, 5))
+    engine._match_post_to_existing_flat(post=newer_post, match=post, match_type='test')
+    summary = FlatSummary.objects.get(flat=flat)
+    assert summary.url == 'https://second'
+    assert summary.price == 450000
+    assert summary.min_price == 450000
+
+    flat.rate(rating_type='star', is_ticked=True)
+    assert FlatSummary.objects.get(flat=flat).starred
+
+    location = Location(short_name='ul. Puławska')
+    location.save()
+    post.locations.add(location)
+    FlatSummary.refresh_for_post(post)
+    summary = FlatSummary.objects.get(flat=flat)
+    assert summary.location_names == 'ul. Puławska'
+    assert summary.outside_search_areas
+
+    post.areas.add(SearchArea.objects.create(name='area'))
+    FlatSummary.refresh_for_post(post)
+    assert not FlatSummary.objects.get(flat=flat).outside_search_areas
+
+
+@pytest.mark.django_db
+def test_flat_view(django_assert_max_num_queries):
+    engine = MatchingEngine()
+    for num, district in enumerate(['mokotow', 'ochota', 'wola']):
+        engine._create_flat_from_post(post=_create_post(
+            f'post_{num}', price=500000 + num, dt_posted=datetime(2021, 3, num + 1), district=district
+        ))
+    engine._create_flat_from_post(post=_create_post(
+        'developer', price=400000, dt_posted=datetime(2021, 3, 1), keywords='deweloper'
+    ))
+
+    with django_assert_max_num_queries(3):
+        flats = _get_flats()
+    # wola is not selected district, developer posts are hidden
+    assert [flat['heading'] for flat in flats] == ['post_1', 'post_0']
+    assert flats[0]['id'] == str(FlatPost.objects.get(heading='post_1').flat_id)
+    assert flats[0]['photos'] == ['cGhvdG8=']
+
+    flats = _get_flats(sort_by='price', district='mokotow')
+    assert [flat['heading'] for flat in flats] == ['post_0']
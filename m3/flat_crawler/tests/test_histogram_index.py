@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from flat_crawler.models import Flat, FlatPost
+from flat_crawler.utils.flat_post_matcher import MatchingEngine
+from flat_crawler.utils.histogram_index import HIST_DIM, HistogramIndex, get_image_histogram
+from flat_crawler.utils.img_fingerprints import add_image_fingerprints
+from flat_crawler.utils.img_utils import IMG_BYTES_DELIM
+
+#pylint:disable=no-member
+
+IMG_IDS = ['img_0_a', 'img_0_b', 'img_1_a', 'img_1_b', 'img_2_a', 'img_2_b']
+
+
+def _load_img(img_id):
+    return Image.open(f'static/test_data/images/{img_id}.jpg')
+
+
+def test_image_histogram():
+    hists = {img_id: get_image_histogram(_load_img(img_id)) for img_id in IMG_IDS}
+    assert hists['img_0_a'].shape == (HIST_DIM, )
+    assert np.linalg.norm(hists['img_0_a']) == pytest.approx(1)
+    # Same photo with different logo
+    assert hists['img_0_a'] @ hists['img_0_b'] > 0.95
+    assert hists['img_0_a'] @ hists['img_1_a'] < 0.9
+
+
+def test_histogram_index(tmp_path):
+    rnd = np.random.RandomState(0)
+    index = HistogramIndex(index_dir=tmp_path)
+    vectors = np.sqrt(rnd.dirichlet(np.full(HIST_DIM, 0.3), size=500)).astype(np.float32)
+    for num, vector in enumerate(vectors):
+        index.add(f'post_{num}', [(0, vector)])
+    # Near duplicates of first posts
+    noisy = np.sqrt(np.abs(vectors[:50] ** 2 + rnd.normal(0, 0.002, size=(50, HIST_DIM))))
+    noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+
+    found = 0
+    for num, vector in enumerate(noisy):
+        similar = index.query(vector[None], k=3, min_similarity=0.9)
+        found += f'post_{num}' in [post_id for post_id, _ in similar]
+    assert found >= 45
+
+    index.save()
+    loaded = HistogramIndex(index_dir=tmp_path)
+    assert len(loaded) == 500
+    assert ('post_3', 0) in loaded
+    assert loaded.query(vectors[3][None], k=1, min_similarity=0.99)[0][0] == 'post_3'
+    excluded = loaded.query(vectors[3][None], k=3, min_similarity=0.5, exclude_post_id='post_3')
+    assert 'post_3' not in [post_id for post_id, _ in excluded]
+
+    # Post is indexed once, even if its first photo has no histogram
+    post = FlatPost(photos_bytes=b'not an image')
+    loaded.add(post.id, [(1, vectors[0])])
+    loaded.add_post(post)
+    loaded.save()
+    loaded = HistogramIndex(index_dir=tmp_path)
+    loaded.add_post(post)
+    assert len(loaded) == 501
+
+
+@pytest.mark.django_db
+def test_candidates_from_histogram_index(tmp_path):
+    photos = IMG_BYTES_DELIM.join(
+        open(f'static/test_data/images/{img_id}.jpg', 'rb').read() for img_id in ['img_0_a', 'img_2_a']
+    )
+    original = FlatPost(size_m2=50, price=500000, photos_bytes=photos, is_original_post=True)
+    add_image_fingerprints(post=original, images=original.images)
+    original.save()
+    flat = Flat(original_post=original, min_price=original.price)
+    flat.save()
+    original.flat = flat
+    original.save()
+
+    # Relisted with a typo in size and a big price cut
+    relisted = FlatPost(size_m2=500, price=300000, photos_bytes=photos)
+    relisted.save()
+
+    engine = MatchingEngine()
+    assert list(engine._get_candidates(post=relisted)) == []
+
+    engine._histogram_index = HistogramIndex(index_dir=tmp_path)
+    # Photos are not decoded for posts crawled without fingerprints
+    assert engine._get_histograms(post=relisted) is None
+    add_image_fingerprints(post=relisted, images=relisted.images)
+    engine._index_histograms(post=original, histograms=engine._get_histograms(post=original))
+    candidates = engine._get_candidates(post=relisted, histograms=engine._get_histograms(post=relisted))
+    assert list(candidates) == [original]
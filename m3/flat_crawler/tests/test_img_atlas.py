@@ -0,0 +1,51 @@
+import numpy as np
+from PIL import Image
+
+from flat_crawler.constants import THUMBNAIL_IMG_POS
+from flat_crawler.utils.img_atlas import ImageAtlas, ATLAS_IMG_SHAPE
+from flat_crawler.utils.img_matching import ImageMatchingEngine
+
+
+def _load_img(img_id):
+    return Image.open(f'static/test_data/images/{img_id}.jpg')
+
+
+def test_image_atlas(tmp_path):
+    atlas = ImageAtlas(atlas_dir=tmp_path)
+    img_a, img_b = _load_img('img_0_a'), _load_img('img_1_a')
+
+    assert atlas.add(flat_post_id='post_1', img_pos=0, image=img_a) == 0
+    assert atlas.add(flat_post_id='post_1', img_pos=THUMBNAIL_IMG_POS, image=img_b) == 1
+    # Adding the same image again doesn't create a new row
+    assert atlas.add(flat_post_id='post_1', img_pos=0, image=img_a) == 0
+    # Images of other sizes are not added
+    assert atlas.add(flat_post_id='post_2', img_pos=0, image=img_a.resize((10, 10))) is None
+
+    assert len(atlas) == 2
+    assert atlas.array.shape == (2, ) + ATLAS_IMG_SHAPE
+
+    # Another instance (e.g. in other process) sees the same images
+    other_atlas = ImageAtlas(atlas_dir=tmp_path)
+    assert ('post_1', 0) in other_atlas
+    assert ('post_1', 1) not in other_atlas
+    np.testing.assert_array_equal(other_atlas.get('post_1', 0), np.asarray(img_a))
+    np.testing.assert_array_equal(other_atlas.get('post_1', THUMBNAIL_IMG_POS), np.asarray(img_b))
+
+    stacked = other_atlas.get_many([('post_1', THUMBNAIL_IMG_POS), ('post_1', 0)])
+    assert stacked.shape == (2, ) + ATLAS_IMG_SHAPE
+
+    # New images added by the first instance are visible in the other one
+    atlas.add(flat_post_id='post_3', img_pos=2, image=img_b)
+    assert other_atlas.get_row('post_3', 2) == 2
+
+
+def test_compare_atlas_images(tmp_path):
+    atlas = ImageAtlas(atlas_dir=tmp_path)
+    img_a, img_b = _load_img('img_0_a'), _load_img('img_0_b')
+    atlas.add(flat_post_id='post_1', img_pos=0, image=img_a)
+    atlas.add(flat_post_id='post_2', img_pos=0, image=img_b)
+
+    engine = ImageMatchingEngine()
+    assert engine.compare_images(
+        Image.fromarray(atlas.get('post_1', 0)), Image.fromarray(atlas.get('post_2', 0))
+    ) == engine.compare_images(img_a, img_b)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from flat_crawler.utils.img_data_cache import ImageDataCache, get_nbytes
+from flat_crawler.utils.img_matching import ImageData
+
+
+def _img_data(num_bytes):
+    return ImageData(img_arr=np.zeros(num_bytes, dtype=np.uint8), hist_std=0.5)
+
+
+def test_image_data_cache():
+    evicted = []
+    # 1 MB budget, entries of 0.3 MB
+    cache = ImageDataCache(max_mb=1, on_evict=evicted.append)
+    entry_bytes = int(0.3 * 2 ** 20)
+    assert get_nbytes(_img_data(entry_bytes)) == entry_bytes
+
+    for num in range(3):
+        cache.put(f'post_{num}:0', post_id=f'post_{num}', img_data=_img_data(entry_bytes))
+    assert cache.get('post_0:0') is not None
+    cache.put('post_3:0', post_id='post_3', img_data=_img_data(entry_bytes))
+
+    # post_1 was least recently used
+    assert evicted == ['post_1']
+    assert 'post_1:0' not in cache and 'post_0:0' in cache
+    assert cache.get('post_1:0') is None
+    assert cache.stats == {
+        'hits': 1, 'misses': 1, 'evictions': 1, 'entries': 3, 'size_mb': round(3 * entry_bytes / 2 ** 20, 2)
+    }
+
+
+def test_image_data_cache_pinning():
+    cache = ImageDataCache(max_mb=1)
+    entry_bytes = int(0.3 * 2 ** 20)
+    cache.pin_post('post')
+    cache.put('post:0', post_id='post', img_data=_img_data(entry_bytes))
+    cache.put('post:1', post_id='post', img_data=_img_data(entry_bytes))
+    for num in range(5):
+        cache.put(f'cand_{num}:0', post_id=f'cand_{num}', img_data=_img_data(entry_bytes))
+    assert 'post:0' in cache and 'post:1' in cache
+    assert cache.num_bytes <= 2 ** 20
+
+    # Pinning other post allows eviction of the previous one
+    cache.pin_post('cand_4')
+    for num in range(5, 8):
+        cache.put(f'cand_{num}:0', post_id=f'cand_{num}', img_data=_img_data(entry_bytes))
+    assert 'post:0' not in cache and 'cand_4:0' in cache
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.flat_post_matcher import MatchingEngine, _extract_fp_images
+from flat_crawler.utils.histogram_index import HistogramIndex, get_image_histogram
+from flat_crawler.utils.img_fingerprints import add_image_fingerprints, load_image_fingerprints
+from flat_crawler.utils.img_hash import dhash, get_post_image_hashes
+from flat_crawler.utils.img_matching import ImageMatchingEngine, get_img_coarse
+from flat_crawler.utils.img_utils import IMG_BYTES_DELIM, img_to_bytes
+
+#pylint:disable=no-member
+
+IMG_IDS = ['img_0_a', 'img_1_a', 'img_2_a']
+
+
+def _crawl_post():
+    """ Post as saved by the crawler, fingerprinted while the stored photos are decoded. """
+    images = [Image.open(f'static/test_data/images/{img_id}.jpg') for img_id in IMG_IDS]
+    post = FlatPost(heading='post', photos_bytes=IMG_BYTES_DELIM.join(img_to_bytes(image) for image in images))
+    add_image_fingerprints(post=post, images=post.images)
+    post.save()
+    return FlatPost.objects.get(id=post.id), post.images
+
+
+@pytest.mark.django_db
+def test_image_fingerprints():
+    post, images = _crawl_post()
+    assert post.image_hashes == [dhash(image) for image in images]
+    fingerprints = load_image_fingerprints(post)
+    assert np.array_equal(fingerprints['histograms'], [get_image_histogram(image) for image in images])
+    assert np.array_equal(fingerprints['coarse'], [get_img_coarse(image) for image in images])
+    assert load_image_fingerprints(post, num_images=2) is None
+    assert load_image_fingerprints(FlatPost(heading='no fingerprints')) is None
+
+
+@pytest.mark.django_db
+def test_matching_uses_fingerprints():
+    post, images = _crawl_post()
+    # Nothing is decoded for hashes, histograms and coarse images
+    post.photos_bytes = None
+    assert get_post_image_hashes(post) == post.image_hashes
+    engine = MatchingEngine()
+    engine._histogram_index = HistogramIndex()
+    assert np.array_equal(engine._get_histograms(post), load_image_fingerprints(post)['histograms'])
+
+    post, _ = _crawl_post()
+    fp_images = _extract_fp_images(post)
+    assert all(fp_image.img_coarse is not None for fp_image in fp_images)
+    img_data = ImageMatchingEngine()._get_img_data(fp_images[0])
+    assert np.array_equal(img_data.img_coarse, get_img_coarse(images[0]) / np.float32(255))
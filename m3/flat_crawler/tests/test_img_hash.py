@@ -0,0 +1,130 @@
+import random
+from collections import Counter
+
+import pytest
+from PIL import Image
+
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.img_hash import BKTree, dhash, hamming_distance, get_post_image_hashes, get_prefilter_recall
+from flat_crawler.utils.img_matching import ImageMatchingEngine
+from flat_crawler.utils.img_utils import IMG_BYTES_DELIM
+from flat_crawler.utils.flat_post_matcher import ImageMatcher, _extract_fp_images
+
+#pylint:disable=no-member
+
+IMG_IDS = ['img_0_a', 'img_0_b', 'img_1_a', 'img_1_b', 'img_2_a', 'img_2_b']
+
+
+def _load_img(img_id):
+    return Image.open(f'static/test_data/images/{img_id}.jpg')
+
+
+def _load_img_bytes(img_ids):
+    return IMG_BYTES_DELIM.join(
+        open(f'static/test_data/images/{img_id}.jpg', 'rb').read() for img_id in img_ids
+    )
+
+
+def test_dhash():
+    img_hashes = {img_id: dhash(_load_img(img_id)) for img_id in IMG_IDS}
+    assert all(0 <= img_hash < 2 ** 64 for img_hash in img_hashes.values())
+    # Logo doesn't change the hash much
+    assert hamming_distance(img_hashes['img_0_a'], img_hashes['img_0_b']) <= 2
+    assert hamming_distance(img_hashes['img_0_a'], img_hashes['img_2_a']) > 10
+
+
+def test_bk_tree():
+    rnd = random.Random(0)
+    hashes = [rnd.getrandbits(64) for _ in range(500)]
+    # near duplicates
+    hashes += [img_hash ^ (1 << rnd.randrange(64)) for img_hash in hashes[:50]]
+    tree = BKTree((img_hash, ind) for ind, img_hash in enumerate(hashes))
+    assert len(tree) == len(hashes)
+
+    for query in hashes[:20] + [rnd.getrandbits(64) for _ in range(20)]:
+        expected = sorted(
+            (hamming_distance(query, img_hash), ind) for ind, img_hash in enumerate(hashes)
+            if hamming_distance(query, img_hash) <= 12
+        )
+        assert sorted(tree.find(query, radius=12)) == expected
+
+
+def test_prefilter_recall():
+    recall, num_relevant = get_prefilter_recall(
+        engine=ImageMatchingEngine(), images=[_load_img(img_id) for img_id in IMG_IDS], radius=10
+    )
+    assert num_relevant > 0
+    assert recall == 1.0
+
+
+@pytest.mark.django_db
+def test_image_matcher_prefilter():
+    post = FlatPost(heading='post', photos_bytes=_load_img_bytes(['img_0_a', 'img_1_a', 'img_2_a']))
+    post.save()
+    candidate = FlatPost(heading='candidate', photos_bytes=_load_img_bytes(['img_2_b', 'img_0_b', 'img_0_a']))
+    candidate.save()
+
+    engine = ImageMatchingEngine()
+    matcher = ImageMatcher(post=post, matching_engine=engine, dry=True)
+    pairs = matcher._get_image_pairs(
+        matcher._get_hash_distances(candidate=candidate, cand_images=_extract_fp_images(candidate))
+    )
+    assert (0, 1) in pairs and (0, 2) in pairs
+    assert len(pairs) < 9
+    assert matcher._match(candidate)
+
+    # Dry matcher doesn't save hashes
+    candidate = FlatPost.objects.get(id=candidate.id)
+    assert candidate.image_hashes is None
+    hashes = get_post_image_hashes(candidate)
+    assert FlatPost.objects.get(id=candidate.id).image_hashes == hashes
+
+
+@pytest.mark.django_db
+def test_image_matcher_thumbnail_gate():
+    post = FlatPost(
+        heading='post', thumbnail=_load_img_bytes(['img_0_a']), photos_bytes=_load_img_bytes(['img_0_a', 'img_1_a'])
+    )
+    post.save()
+    same = FlatPost(
+        heading='same', thumbnail=_load_img_bytes(['img_0_a']), photos_bytes=_load_img_bytes(['img_0_b', 'img_1_a'])
+    )
+    # Near duplicates of a single post photo don't decide at the gate
+    repeated = FlatPost(
+        heading='repeated', thumbnail=_load_img_bytes(['img_0_a']), photos_bytes=_load_img_bytes(['img_0_b', 'img_0_a'])
+    )
+    other = FlatPost(
+        heading='other', thumbnail=_load_img_bytes(['img_2_b']), photos_bytes=_load_img_bytes(['img_2_b', 'img_2_a'])
+    )
+    no_thumbnail = FlatPost(heading='no_thumbnail', photos_bytes=_load_img_bytes(['img_0_b', 'img_1_a']))
+    candidates = [same, repeated, other, no_thumbnail]
+    for candidate in candidates:
+        candidate.save()
+
+    gate_stats = Counter()
+    matcher = ImageMatcher(
+        post=post, matching_engine=ImageMatchingEngine(stop_early=True), dry=True, gate_stats=gate_stats
+    )
+    assert matcher._match_candidates(candidates) == [same, repeated, no_thumbnail]
+    assert gate_stats == {'accepted': 1, 'rejected': 1, 'gallery': 2}
+
+
+@pytest.mark.django_db
+def test_image_matcher_early_termination():
+    img_ids = ['img_0_a', 'img_1_a', 'img_2_a']
+    post = FlatPost(heading='post', photos_bytes=_load_img_bytes(img_ids))
+    post.save()
+    same = FlatPost(heading='same', photos_bytes=_load_img_bytes(img_ids + ['img_0_b']))
+    other = FlatPost(heading='other', photos_bytes=_load_img_bytes(['img_2_b']))
+    candidates = [same, other]
+    for candidate in candidates:
+        candidate.save()
+
+    num_pairs = {}
+    for exhaustive in [False, True]:
+        engine = ImageMatchingEngine(stop_early=True)
+        matcher = ImageMatcher(post=post, matching_engine=engine, dry=True, exhaustive=exhaustive)
+        assert matcher._match_candidates(candidates) == [same]
+        num_pairs[exhaustive] = engine.cascade_stats['num_pairs']
+    # Same decisions, without comparing the remaining pairs once the threshold is reached
+    assert num_pairs[False] < num_pairs[True]
@@ -31,8 +31,11 @@ def test_get_img_bytes_from_url():
 @patch('flat_crawler.utils.img_utils.get_img_from_url', new=mock_get_img_from_url)
 def test_storing_images_as_bytes():
     urls = [GOOD_URL, GOOD_URL, 'bad url', GOOD_URL]
-    img_bytes = img_urls_to_bytes(img_urls=urls)
+    decoded_images = []
+    img_bytes = img_urls_to_bytes(img_urls=urls, images=decoded_images)
     images = bytes_to_images(img_bytes)
     assert len(images) == 3
     for img in images:
         assert img.size == THUMBNAIL_SIZE
+    # Kept images are decoded from the stored bytes
+    assert [img.tobytes() for img in decoded_images] == [img.tobytes() for img in images]
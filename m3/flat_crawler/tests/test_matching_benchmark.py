@@ -0,0 +1,25 @@
+import pytest
+
+from flat_crawler.utils.matching_benchmark import TRANSFORMS, build_corpus, build_posts, run_benchmark
+
+
+def test_build_corpus():
+    corpus = build_corpus(num_variants=2, img_size=(60, 40))
+    num_sources = len([synthetic for synthetic in corpus if synthetic.kind == 'original'])
+    assert len(corpus) == num_sources * (1 + 2 * len(TRANSFORMS))
+    assert all(synthetic.image.size == (60, 40) for synthetic in corpus)
+
+    posts, listing_ids = build_posts(corpus, photos_per_post=2)
+    assert len(posts) == len(listing_ids) == (len(set(s.photo_id for s in corpus)) // 2) * (1 + len(TRANSFORMS))
+    assert all(len(post.images) == 2 for post in posts)
+
+
+@pytest.mark.django_db
+def test_run_benchmark():
+    results = run_benchmark(num_variants=1)
+    assert set(results['pair_score']) == {'SimpleHistComparer', 'CrossCorrComparer', 'SsimComparer'}
+    assert set(results['backends']) == {'numpy', 'opencv', 'skimage'}
+    assert results['engine']['pairs_per_sec'] > 0
+    # Variants are matched conservatively, but different photos never match
+    assert results['engine']['precision'] >= 0.9
+    assert results['matcher']['precision'] >= 0.9
@@ -60,6 +60,10 @@ def test_otodom_crawler():
         assert post.dt_posted
         assert post.size_m2
         assert post.street == 'Puławska 16'
+        # Photos are fingerprinted while the crawler has them decoded
+        if post.photos_bytes is not None:
+            assert len(post.image_hashes) == len(post.images)
+            assert post.image_fingerprints is not None
 
     districts = sorted(set(FlatPost.objects.values_list('district', flat=True)))
     assert districts == ['mokotow', 'ochota', 'srodmiescie', 'ursus', 'wola', 'zoliborz']
@@ -0,0 +1,60 @@
+import numpy as np
+from PIL import Image
+
+from flat_crawler.utils.img_matching import HistComparer, ImageData, ImageMatchingEngine, SimpleHistComparer
+from flat_crawler.utils.pixel_stats import (
+    CHANNEL_HIST, _gather_pixel_stats, color_hist_spec, get_channel_moments, get_color_levels, get_pixel_stats
+)
+
+
+def _random_img_arr(num_pixels=1000):
+    img_arr = np.random.RandomState(0).randint(0, 256, size=(num_pixels, 3)).astype(np.uint8)
+    # Bin edges and extremes
+    img_arr[:4] = [[0, 0, 0], [255, 255, 255], [51, 102, 153], [42, 43, 85]]
+    return img_arr
+
+
+def test_pixel_stats():
+    img_arr = _random_img_arr()
+    stats = get_pixel_stats(img_arr, specs=[CHANNEL_HIST, color_hist_spec(6)])
+
+    for c_ind in range(3):
+        assert np.array_equal(stats[CHANNEL_HIST][c_ind], np.bincount(img_arr[:, c_ind], minlength=256))
+    levels = (img_arr / (255 / 6 + 0.0001)).astype(int)
+    colors = levels[:, 0] + levels[:, 1] * 6 + levels[:, 2] * 36
+    assert np.array_equal(stats[color_hist_spec(6)], np.histogram(colors, bins=216, range=(0, 215))[0])
+
+    mean, std = get_channel_moments(stats[CHANNEL_HIST])
+    assert np.allclose(mean, img_arr.mean(axis=0), rtol=1e-6)
+    assert np.allclose(std, img_arr.std(axis=0), rtol=1e-6)
+
+    # Loop compiled by numba, run as plain python
+    channel_hist = np.zeros((3, 256), dtype=np.int64)
+    color_hists = np.zeros((1, 216), dtype=np.int64)
+    _gather_pixel_stats(img_arr, get_color_levels(6)[None], np.array([6]), channel_hist, color_hists)
+    assert np.array_equal(channel_hist, stats[CHANNEL_HIST])
+    assert np.array_equal(color_hists[0], stats[color_hist_spec(6)])
+
+
+def test_comparer_features_from_pixel_stats():
+    img_arr = _random_img_arr()
+    comparer = SimpleHistComparer()
+    img_data = comparer.add_image_data(ImageData(img_arr=img_arr), image=None)
+    hist = np.array([
+        np.histogram(img_arr[:, c_ind], bins=20, density=True, range=(0, 255))[0] for c_ind in range(3)
+    ]).T
+    hist = np.ascontiguousarray(hist / hist.sum(axis=0), dtype=np.float32)
+    assert np.array_equal(img_data.hist_norm, hist - hist.mean(axis=0))
+
+    img_data = HistComparer().add_image_data(ImageData(img_arr=img_arr), image=None)
+    assert np.isclose(img_data.hist_norm.sum(), 1)
+
+
+def test_engine_pixel_stats():
+    engine = ImageMatchingEngine()
+    assert CHANNEL_HIST in engine._pixel_stats_specs
+    image = Image.open('static/test_data/images/img_0_a.jpg')
+    img_data = engine._get_img_data_for_image(image)
+    # Statistics are gathered once for all comparers and not kept with the features
+    assert img_data.pixel_stats is None
+    assert engine.compare_images(image, image)[1] == engine.num_comparers
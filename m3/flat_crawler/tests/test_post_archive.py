@@ -0,0 +1,70 @@
+import pytest
+
+from flat_crawler.models import Flat, FlatPost, FlatSummary, Location
+from flat_crawler.utils.post_archive import PostArchive
+
+#pylint:disable=no-member
+
+PHOTOS = b'photo_1$!%photo_2'
+
+
+def _create_post(**kwargs):
+    post = FlatPost(
+        heading='heading', is_broken=True, photos_bytes=PHOTOS, post_soup=b'<soup>', **kwargs
+    )
+    post.save()
+    return post
+
+
+@pytest.mark.django_db
+def test_archive_and_restore_stub(tmp_path):
+    archive = PostArchive(archive_path=tmp_path / 'archive.sqlite3')
+    post = _create_post()
+    location = Location(short_name='ul. Puławska')
+    location.save()
+    post.locations.add(location)
+
+    archive.archive_post(post)
+    stub = FlatPost.objects.get(id=post.id)
+    assert stub.archived
+    assert stub.photos_bytes is None
+    assert stub.post_soup is None
+    assert stub.heading == 'heading'
+    assert post.id in archive
+
+    restored = archive.restore_post(post.id)
+    assert not restored.archived
+    restored = FlatPost.objects.get(id=post.id)
+    assert bytes(restored.photos_bytes) == PHOTOS
+    assert bytes(restored.post_soup) == b'<soup>'
+    assert post.id not in archive
+
+
+@pytest.mark.django_db
+def test_archive_and_restore_deleted_row(tmp_path):
+    archive = PostArchive(archive_path=tmp_path / 'archive.sqlite3')
+    original_post = _create_post(thumbnail=b'thumbnail')
+    flat = Flat(original_post=original_post, min_price=100)
+    flat.save()
+    FlatSummary.refresh_for_flat(flat)
+    post = _create_post(flat=flat)
+    location = Location(short_name='ul. Puławska')
+    location.save()
+    post.locations.add(location)
+
+    post_id = post.id
+
+    archive.archive_post(original_post, delete_row=True)
+    archive.archive_post(post, delete_row=True)
+    # Original post of a flat is kept as a stub
+    assert FlatPost.objects.get(id=original_post.id).archived
+    assert FlatSummary.objects.get(flat=flat).thumbnail_image is None
+    assert not FlatPost.objects.filter(id=post_id).exists()
+    assert len(archive) == 2
+
+    archive.restore_post(str(post_id))
+    restored = FlatPost.objects.get(id=post_id)
+    assert restored.flat == flat
+    assert bytes(restored.photos_bytes) == PHOTOS
+    assert list(restored.locations.all()) == [location]
+    assert len(archive) == 1
@@ -0,0 +1,80 @@
+import datetime
+
+import pytest
+
+from flat_crawler.models import PostHash, Source
+from flat_crawler.utils.post_hashes import BloomFilter, PostHashIndex
+
+#pylint:disable=no-member
+
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(capacity=1000, error_rate=0.01)
+    keys = [f'key_{num}' for num in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+    false_positives = sum(f'other_{num}' in bloom for num in range(10000))
+    assert false_positives < 300
+
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert all(key in restored for key in keys)
+    assert restored.num_keys == 1000
+
+
+@pytest.mark.django_db
+def test_post_hash_index(tmp_path):
+    PostHash(source=Source.GUMTREE, post_hash='old').save()
+    PostHash(source=Source.OTODOM, post_hash='otodom').save()
+
+    index = PostHashIndex(source=Source.GUMTREE, bloom_dir=tmp_path)
+    assert 'old' in index
+    assert 'otodom' not in index
+    assert 'new' not in index
+
+    index.add('new')
+    assert 'new' in index
+    index.flush()
+    assert PostHash.objects.filter(source=Source.GUMTREE).count() == 2
+    assert (tmp_path / f'{Source.GUMTREE}.bloom').exists()
+
+    # Filter is loaded from file and updated with hashes added since
+    PostHash(source=Source.GUMTREE, post_hash='newest').save()
+    index = PostHashIndex(source=Source.GUMTREE, bloom_dir=tmp_path)
+    assert all(post_hash in index for post_hash in ['old', 'new', 'newest'])
+
+
+@pytest.mark.django_db
+def test_post_hash_index_age_out():
+    PostHash(source=Source.GUMTREE, post_hash='old').save()
+    PostHash.objects.filter(post_hash='old').update(
+        created=datetime.datetime.now() - datetime.timedelta(days=10)
+    )
+    PostHash(source=Source.GUMTREE, post_hash='recent').save()
+
+    index = PostHashIndex(source=Source.GUMTREE, max_age_days=7, bloom_dir=None)
+    assert 'old' not in index
+    assert 'recent' in index
+
+    # Aged out hash is refreshed, not duplicated
+    index.add('old')
+    index.flush()
+    assert 'old' in index
+    assert PostHash.objects.filter(post_hash='old').count() == 1
+
+
+@pytest.mark.django_db
+def test_post_hash_index_age_out_other_source():
+    min_created = datetime.datetime.now() - datetime.timedelta(days=10)
+    PostHash(source=Source.GUMTREE, post_hash='shared').save()
+    PostHash(source=Source.OTODOM, post_hash='shared').save()
+    PostHash.objects.update(created=min_created)
+
+    index = PostHashIndex(source=Source.GUMTREE, max_age_days=7, bloom_dir=None)
+    index.add('shared')
+    index.flush()
+    assert 'shared' in index
+    # Hash of the other source stays aged out
+    assert 'shared' not in PostHashIndex(source=Source.OTODOM, max_age_days=7, bloom_dir=None)
+    assert PostHash.objects.get(source=Source.OTODOM, post_hash='shared').created == min_created
@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+from flat_crawler.models import Flat, FlatPost, ImageMatch
+from flat_crawler.utils.flat_post_matcher import MatchingEngine
+
+#pylint:disable=no-member
+
+
+def _assert_uses_index(queryset, index_name):
+    plan = queryset.explain()
+    assert index_name in plan, plan
+
+
+@pytest.mark.django_db
+def test_candidates_query_uses_index():
+    post = FlatPost(size_m2=50, price=500000)
+    _assert_uses_index(MatchingEngine()._get_candidates_query(post=post), 'flatpost_candidates_idx')
+
+
+@pytest.mark.django_db
+def test_unmatched_posts_query_uses_index():
+    _assert_uses_index(
+        FlatPost.objects.filter(flat__isnull=True, is_broken=False), 'flatpost_unmatched_idx'
+    )
+
+
+@pytest.mark.django_db
+def test_extract_info_query_uses_index():
+    _assert_uses_index(
+        FlatPost.objects.filter(district__in=['mokotow'], tried_to_extract_locations=False),
+        'flatpost_district_idx'
+    )
+
+
+@pytest.mark.django_db
+def test_image_match_query_uses_index():
+    # sqlite creates unique constraints as table constraints, with automatically named index
+    plan = ImageMatch.objects.filter(
+        post_1=uuid.uuid4(), img_pos_1=0, post_2=uuid.uuid4(), img_pos_2=1
+    ).explain()
+    assert 'USING INDEX' in plan, plan
+    assert '(post_1_id=? AND img_pos_1=? AND post_2_id=? AND img_pos_2=?)' in plan, plan
+
+
+@pytest.mark.django_db
+def test_flat_ordering_uses_index():
+    _assert_uses_index(
+        Flat.objects.order_by('-original_post__dt_posted'), 'flatpost_dt_posted_idx'
+    )
@@ -0,0 +1,53 @@
+import logging
+import math
+from bisect import bisect_left, bisect_right, insort
+from typing import Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BlockingIndex(object):
+    """ Original posts of flats sorted by (size_m2, price), for MatchingEngine candidates.
+
+    Keeps only ids and the sort key of each post, posts themselves are fetched by
+    id for the few candidates found. Posts without size or price are never candidates,
+    as in the range query over FlatPost.
+    """
+
+    def __init__(self):
+        # Sorted (size_m2, price, post_id)
+        self._keys = []
+        self._key_by_flat_id = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, post_id, flat_id, size_m2, price) -> None:
+        if size_m2 is None or price is None:
+            return
+        self.remove_flat(flat_id)
+        key = (size_m2, price, post_id)
+        insort(self._keys, key)
+        self._key_by_flat_id[flat_id] = key
+
+    def add_many(self, rows: Iterable[Tuple]) -> None:
+        """ Adds (post_id, flat_id, size_m2, price) rows. """
+        for row in rows:
+            self.add(*row)
+
+    def remove_flat(self, flat_id) -> None:
+        key = self._key_by_flat_id.pop(flat_id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def get_post_ids(self, flat_ids: Iterable) -> List:
+        return [self._key_by_flat_id[flat_id][2] for flat_id in flat_ids if flat_id in self._key_by_flat_id]
+
+    def query(self, size_m2: float, price: int, size_delta: float, price_delta: int) -> List:
+        """ Ids of posts with size and price within the deltas, bounds included. """
+        start = bisect_left(self._keys, (size_m2 - size_delta, ))
+        stop = bisect_right(self._keys, (size_m2 + size_delta, math.inf))
+        return [
+            post_id for _, post_price, post_id in self._keys[start:stop]
+            if price - price_delta <= post_price <= price + price_delta
+        ]
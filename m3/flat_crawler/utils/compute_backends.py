@@ -0,0 +1,144 @@
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from skimage.metrics import structural_similarity
+
+from flat_crawler.utils.pixel_stats import CHANNEL_HIST, NUM_VALUES, get_pixel_stats
+
+# SSIM parameters, defaults of skimage structural_similarity the comparer thresholds were tuned with.
+SSIM_WIN_SIZE = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+# Range of float images in skimage
+SSIM_DATA_RANGE = 2.0
+
+
+def _window_means(arr: np.array, axes: Tuple[int, int] = (0, 1)) -> np.array:
+    """ Means of all windows fully inside the image, from running sums along rows and columns. """
+    size = SSIM_WIN_SIZE
+    sums = arr
+    for axis in axes:
+        sums = sums.cumsum(axis=axis)
+        # Window ending at each position, the first one starts at 0
+        first, ends, starts = [[slice(None)] * sums.ndim for _ in range(3)]
+        first[axis], ends[axis], starts[axis] = slice(size - 1, size), slice(size, None), slice(None, -size)
+        sums = np.concatenate([sums[tuple(first)], sums[tuple(ends)] - sums[tuple(starts)]], axis=axis)
+    return sums / size ** 2
+
+
+def _get_ssim_map(ux, uy, uxx, uyy, uxy) -> np.array:
+    """ SSIM of windows, given means of pixels, their squares and products in each window. """
+    num_pixels = SSIM_WIN_SIZE ** 2
+    # Sample covariance
+    cov_norm = num_pixels / (num_pixels - 1)
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+    c1 = (SSIM_K1 * SSIM_DATA_RANGE) ** 2
+    c2 = (SSIM_K2 * SSIM_DATA_RANGE) ** 2
+    return ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux ** 2 + uy ** 2 + c1) * (vx + vy + c2))
+
+
+def ssim_many(img: np.array, imgs: np.array) -> np.array:
+    """ Mean SSIM of (height, width) image with each of (num images, height, width) images.
+
+    Batched version for small images, with numpy regardless of the backend.
+    """
+    imgs = imgs.astype(np.float64)
+    img = np.broadcast_to(img.astype(np.float64), imgs.shape)
+    ssim_map = _get_ssim_map(*(
+        _window_means(arr, axes=(1, 2)) for arr in (img, imgs, img * img, imgs * imgs, img * imgs)
+    ))
+    return ssim_map.mean(axis=(1, 2))
+
+
+class NumpyBackend(object):
+    """ Computations of image comparers, implemented with numpy.
+
+    Backends give the same results up to floating point errors, see test_compute_backends.
+    """
+    NAME = 'numpy'
+
+    def get_pixel_stats(self, img_arr: np.array, specs: Iterable[Tuple]) -> Dict[Tuple, np.array]:
+        return get_pixel_stats(img_arr, specs=specs)
+
+    def ssim(self, img_1: np.array, img_2: np.array) -> float:
+        """ Mean structural similarity of (height, width, channels) float images, over all channels.
+
+        Windows are SSIM_WIN_SIZE squares fully inside the image, as in skimage,
+        which computes them for the whole image and crops the border.
+        """
+        img_1, img_2 = img_1.astype(np.float64), img_2.astype(np.float64)
+        return float(_get_ssim_map(*(
+            _window_means(arr) for arr in (img_1, img_2, img_1 * img_1, img_2 * img_2, img_1 * img_2)
+        )).mean())
+
+    def hist_correlation(self, hist_1: np.array, hist_2: np.array) -> np.array:
+        """ Pearson correlation of histograms, of each column for (bins, channels) histograms. """
+        centered_1, centered_2 = hist_1 - hist_1.mean(axis=0), hist_2 - hist_2.mean(axis=0)
+        return np.sum(centered_1 * centered_2, axis=0) / np.sqrt(
+            np.sum(centered_1 ** 2, axis=0) * np.sum(centered_2 ** 2, axis=0)
+        )
+
+
+class SkimageBackend(NumpyBackend):
+    NAME = 'skimage'
+
+    def ssim(self, img_1: np.array, img_2: np.array) -> float:
+        return structural_similarity(img_1, img_2, multichannel=True)
+
+
+class OpenCVBackend(NumpyBackend):
+    NAME = 'opencv'
+
+    def __init__(self):
+        # Imported only when selected, opencv is heavy and needs system libraries
+        import cv2
+        self._cv2 = cv2
+
+    def get_pixel_stats(self, img_arr: np.array, specs: Iterable[Tuple]) -> Dict[Tuple, np.array]:
+        specs = set(specs)
+        stats = super().get_pixel_stats(img_arr, specs=specs - {CHANNEL_HIST})
+        if CHANNEL_HIST in specs:
+            pixels = np.ascontiguousarray(img_arr).reshape(1, *img_arr.shape)
+            stats[CHANNEL_HIST] = np.stack([
+                self._cv2.calcHist([pixels], [channel], None, [NUM_VALUES], [0, NUM_VALUES])[:, 0]
+                for channel in range(img_arr.shape[1])
+            ]).astype(np.int64)
+        return stats
+
+    def ssim(self, img_1: np.array, img_2: np.array) -> float:
+        img_1, img_2 = img_1.astype(np.float64), img_2.astype(np.float64)
+        pad = (SSIM_WIN_SIZE - 1) // 2
+        return float(_get_ssim_map(*(
+            self._cv2.boxFilter(
+                arr, ddepth=-1, ksize=(SSIM_WIN_SIZE, SSIM_WIN_SIZE), borderType=self._cv2.BORDER_REFLECT
+            )[pad:-pad, pad:-pad]
+            for arr in (img_1, img_2, img_1 * img_1, img_2 * img_2, img_1 * img_2)
+        )).mean())
+
+    def hist_correlation(self, hist_1: np.array, hist_2: np.array) -> np.array:
+        hist_1, hist_2 = hist_1.reshape(len(hist_1), -1), hist_2.reshape(len(hist_2), -1)
+        correlations = np.array([
+            self._cv2.compareHist(
+                np.ascontiguousarray(hist_1[:, col], dtype=np.float32),
+                np.ascontiguousarray(hist_2[:, col], dtype=np.float32),
+                self._cv2.HISTCMP_CORREL,
+            )
+            for col in range(hist_1.shape[1])
+        ])
+        return correlations if hist_1.shape[1] > 1 else correlations[0]
+
+
+BACKENDS = {backend.NAME: backend for backend in (NumpyBackend, SkimageBackend, OpenCVBackend)}
+
+_backends = {}
+
+
+def get_backend(name: str) -> NumpyBackend:
+    """ Returns backend shared within the process. """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown compute backend {name}, available: {', '.join(BACKENDS)}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
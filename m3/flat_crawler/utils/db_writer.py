@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+
+from django.db import connections, transaction
+
+from flat_crawler.constants import SQLITE_CONCURRENT_MODE, DB_WRITER_BATCH_SIZE
+from flat_crawler.exceptions import DBWriteFailed
+
+logger = logging.getLogger(__name__)
+
+# Applied on every new sqlite connection in concurrent mode.
+# WAL lets readers (web UI) work while the crawler or matcher writes.
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    # Safe with WAL, syncs only on checkpoints
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=10000',
+    'PRAGMA temp_store=MEMORY',
+    # In KiB when negative
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+]
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """ connection_created signal handler. """
+    if SQLITE_CONCURRENT_MODE and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+
+
+class DBWriter(object):
+    """ Executes writes immediately in the calling thread. """
+
+    def save(self, obj, **kwargs) -> None:
+        obj.save(**kwargs)
+
+    def run(self, func: Callable, *args, **kwargs) -> None:
+        func(*args, **kwargs)
+
+    def flush(self) -> None:
+        """ Blocks until all scheduled writes are executed.
+
+        Raises:
+            DBWriteFailed: If any of them failed since the last flush.
+        """
+        pass
+
+
+class QueuedDBWriter(DBWriter):
+    """ Executes all writes in a single background thread.
+
+    Scheduled writes are executed in order, grouped in transactions of up to
+    batch_size writes. Each write runs in its own savepoint, so a failing write
+    doesn't roll back the rest of the batch. Failures are collected and raised
+    as DBWriteFailed by the next save(), run() or flush() in the calling thread.
+    Callers have to flush() before reading data they've just written.
+    """
+
+    def __init__(self, batch_size: int = DB_WRITER_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._queue = queue.Queue()
+        self.num_written = 0
+        self.num_failed = 0
+        # (func, exception) of failed writes not raised yet
+        self._failures = []
+        self._failures_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._write_loop, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def save(self, obj, **kwargs) -> None:
+        self.run(obj.save, **kwargs)
+
+    def run(self, func: Callable, *args, **kwargs) -> None:
+        self._queue.put((func, args, kwargs))
+        self._raise_failures()
+
+    def flush(self) -> None:
+        self._queue.join()
+        self._raise_failures()
+
+    def close(self) -> None:
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_failures()
+
+    def _raise_failures(self) -> None:
+        with self._failures_lock:
+            failures, self._failures = self._failures, []
+        if failures:
+            raise DBWriteFailed(failures)
+
+    def _write_loop(self) -> None:
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while batch[-1] is not None and len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                writes = [write for write in batch if write is not None]
+                try:
+                    self._write_batch(writes)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                if len(writes) < len(batch):
+                    return
+        finally:
+            connections.close_all()
+
+    def _write_batch(self, writes) -> None:
+        with transaction.atomic():
+            for func, args, kwargs in writes:
+                try:
+                    with transaction.atomic():
+                        func(*args, **kwargs)
+                    self.num_written += 1
+                except Exception as exc:
+                    logger.exception(f"Write {func} failed")
+                    self.num_failed += 1
+                    with self._failures_lock:
+                        self._failures.append((func, exc))
+
+
+_db_writer = None
+
+
+def get_db_writer() -> DBWriter:
+    """ Returns writer shared within the process, queued one in concurrent mode. """
+    global _db_writer
+    if _db_writer is None:
+        _db_writer = QueuedDBWriter() if SQLITE_CONCURRENT_MODE else DBWriter()
+    return _db_writer
@@ -0,0 +1,76 @@
+import logging
+from collections import defaultdict
+from io import BytesIO
+from typing import Dict, List
+
+import numpy as np
+
+from flat_crawler.models import ImageFeatures
+from flat_crawler.utils.img_matching import BaseComparer, ImageData
+from flat_crawler.utils.db_writer import get_db_writer
+
+logger = logging.getLogger(__name__)
+
+
+def features_to_bytes(features: Dict[str, np.array]) -> bytes:
+    features_bytes = BytesIO()
+    np.savez_compressed(features_bytes, **features)
+    return features_bytes.getvalue()
+
+
+def bytes_to_features(features_bytes: bytes) -> Dict[str, np.array]:
+    with np.load(BytesIO(features_bytes), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+class ImageFeatureStore(object):
+    """ Persists per-image comparer features, so they are computed only once.
+
+    Features of each comparer are stored separately under its feature_key,
+    so changing comparer version or parameters only recomputes its own features.
+    Only compact features (histograms, moments) are stored, pixel features are
+    recomputed from the decoded image, see BaseComparer.PIXEL_FEATURES.
+    """
+
+    def load_post_img_data(
+        self, flat_post_id: str, comparers: List[BaseComparer]
+    ) -> Dict[int, ImageData]:
+        """ Returns ImageData for every image of the post having features of all comparers.
+
+        Pixel features are not set, see ImageMatchingEngine._add_pixel_data.
+        """
+        comparers = [comparer for comparer in comparers if comparer.FEATURES]
+        rows = ImageFeatures.objects.filter(
+            post_id=flat_post_id, comparer_key__in=[comparer.feature_key for comparer in comparers]
+        ).values_list('img_pos', 'comparer_key', 'features')
+        features_dict = defaultdict(dict)
+        for img_pos, comparer_key, features_bytes in rows:
+            features_dict[img_pos][comparer_key] = bytes(features_bytes)
+
+        img_data_dict = {}
+        for img_pos, comparer_features in features_dict.items():
+            if len(comparer_features) < len(comparers):
+                continue
+            img_data = ImageData()
+            for comparer in comparers:
+                features = bytes_to_features(comparer_features[comparer.feature_key])
+                img_data = comparer.load_features(img_data=img_data, features=features)
+            img_data_dict[img_pos] = img_data
+        return img_data_dict
+
+    def save_img_data(
+        self,
+        flat_post_id: str,
+        img_pos: int,
+        img_data: ImageData,
+        comparers: List[BaseComparer],
+    ) -> None:
+        get_db_writer().run(ImageFeatures.objects.bulk_create, [
+            ImageFeatures(
+                post_id=flat_post_id,
+                img_pos=img_pos,
+                comparer_key=comparer.feature_key,
+                features=features_to_bytes(comparer.dump_features(img_data)),
+            )
+            for comparer in comparers if comparer.FEATURES
+        ], ignore_conflicts=True)
@@ -0,0 +1,122 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import networkx as nx
+from django.db import transaction
+
+from flat_crawler.constants import CONSOLIDATION_MIN_IMAGE_MATCHES, CONSOLIDATION_MIN_IMAGE_SCORE
+from flat_crawler.models import Flat, FlatPost, FlatSummary, ImageMatch
+from flat_crawler.utils.db_writer import get_db_writer
+from flat_crawler.utils.flat_post_matcher import BaseInfoMatcher, merge_flat_ratings
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+
+
+def build_post_graph(
+    min_image_score: float = CONSOLIDATION_MIN_IMAGE_SCORE,
+    min_image_matches: int = CONSOLIDATION_MIN_IMAGE_MATCHES,
+) -> nx.Graph:
+    """ Graph of posts with flats, edges connect posts of the same flat.
+
+    Posts are connected if at least min_image_matches of their images matched with
+    avg_score of at least min_image_score, or if BaseInfoMatcher identifies them.
+    Nodes are post ids, with flat_id attribute.
+    """
+    graph = nx.Graph()
+    base_info_fields = BaseInfoMatcher.ANY_FIELDS + BaseInfoMatcher.ALL_FIELDS
+    posts = FlatPost.objects.filter(flat__isnull=False).values_list('id', 'flat_id', *base_info_fields)
+    # Posts with equal key, missing values don't identify anything
+    posts_by_key = defaultdict(list)
+    for post_id, flat_id, *values in posts:
+        graph.add_node(post_id, flat_id=flat_id)
+        info = dict(zip(base_info_fields, values))
+        keys = [(field, info[field]) for field in BaseInfoMatcher.ANY_FIELDS]
+        keys.append(tuple(info[field] for field in BaseInfoMatcher.ALL_FIELDS))
+        for key in keys:
+            if None not in key:
+                posts_by_key[key].append(post_id)
+    for post_ids in posts_by_key.values():
+        # Path is enough to connect all of them
+        nx.add_path(graph, post_ids)
+
+    image_matches = Counter(ImageMatch.objects.filter(
+        avg_score__gte=min_image_score,
+        post_1__flat__isnull=False,
+        post_2__flat__isnull=False,
+    ).values_list('post_1_id', 'post_2_id'))
+    graph.add_edges_from(
+        (post_1_id, post_2_id) for (post_1_id, post_2_id), num_matches in image_matches.items()
+        if num_matches >= min_image_matches and post_1_id != post_2_id
+    )
+    return graph
+
+
+def get_flat_groups(graph: nx.Graph) -> List[List]:
+    """ Ids of flats to merge, of each connected component with more than one flat. """
+    flat_ids = nx.get_node_attributes(graph, 'flat_id')
+    flat_groups = []
+    for component in nx.connected_components(graph):
+        component_flat_ids = set(flat_ids[post_id] for post_id in component)
+        if len(component_flat_ids) > 1:
+            flat_groups.append(list(component_flat_ids))
+    return flat_groups
+
+
+def consolidate_flats(
+    min_image_score: float = CONSOLIDATION_MIN_IMAGE_SCORE,
+    min_image_matches: int = CONSOLIDATION_MIN_IMAGE_MATCHES,
+    dry: bool = False,
+) -> Dict:
+    """ Merges flats of each connected component of the post graph into its oldest flat.
+
+    Unlike MatchingEngine.merge_multiple_posts, all merges are found at once and saved in
+    a single transaction, with bulk updates of posts and flats.
+    """
+    start = time.perf_counter()
+    # Matches saved by the matching have to be visible
+    get_db_writer().flush()
+    graph = build_post_graph(min_image_score=min_image_score, min_image_matches=min_image_matches)
+    flat_groups = get_flat_groups(graph)
+    flats = Flat.objects.in_bulk([flat_id for flat_ids in flat_groups for flat_id in flat_ids])
+
+    main_flats, merged_flat_ids = [], []
+    main_flat_ids = {}
+    for flat_ids in flat_groups:
+        group_flats = sorted((flats[flat_id] for flat_id in flat_ids), key=lambda flat: flat.created)
+        main_flat = group_flats[0]
+        merge_flat_ratings(main_flat=main_flat, flats=group_flats)
+        min_prices = [flat.min_price for flat in group_flats if flat.min_price is not None]
+        main_flat.min_price = min(min_prices) if min_prices else None
+        main_flats.append(main_flat)
+        for flat in group_flats[1:]:
+            logger.info(f"Merging flat {flat} into {main_flat}")
+            merged_flat_ids.append(flat.id)
+            main_flat_ids[flat.id] = main_flat.id
+
+    moved_posts = list(FlatPost.objects.filter(flat_id__in=merged_flat_ids).only('id', 'flat_id'))
+    for post in moved_posts:
+        post.flat_id = main_flat_ids[post.flat_id]
+        post.is_original_post = False
+
+    if not dry:
+        with transaction.atomic():
+            FlatPost.objects.bulk_update(moved_posts, ['flat', 'is_original_post'], batch_size=BULK_BATCH_SIZE)
+            Flat.objects.bulk_update(
+                main_flats, ['min_price', 'hearted', 'starred', 'rejected'], batch_size=BULK_BATCH_SIZE
+            )
+            Flat.objects.filter(id__in=merged_flat_ids).delete()
+            for main_flat in main_flats:
+                FlatSummary.refresh_for_flat(main_flat)
+
+    return {
+        'num_posts': graph.number_of_nodes(),
+        'num_edges': graph.number_of_edges(),
+        'components_merged': len(flat_groups),
+        'flats_merged': len(merged_flat_ids),
+        'posts_moved': len(moved_posts),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
@@ -1,15 +1,35 @@
 import logging
 import json
 from abc import ABC, abstractmethod
-from typing import Optional, Iterable, List
+from collections import Counter
+from itertools import product
+from typing import Optional, Iterable, List, Tuple, Dict
 
 import numpy as np
+from django.db.models import Q
 from django.db.models.query import QuerySet
 
-from flat_crawler.models import Flat, FlatPost, MatchingFlatPostGroup
+from flat_crawler.constants import (
+    IMAGE_HASH_RADIUS,
+    IMAGE_MATCHING_EXHAUSTIVE,
+    IMAGE_MATCHING_WORKERS,
+    MATCHING_BLOCKING_INDEX,
+    THUMBNAIL_IMG_POS,
+    HISTOGRAM_INDEX_TOP_K,
+    HISTOGRAM_INDEX_MIN_SIMILARITY,
+)
+from flat_crawler.exceptions import DBWriteFailed
+from flat_crawler.models import Flat, FlatPost, FlatSummary, ImageMatch, MatchingFlatPostGroup
 from flat_crawler.utils.base_utils import elements_to_str
-from flat_crawler.utils.img_utils import bytes_to_images
+from flat_crawler.utils.blocking_index import BlockingIndex
+from flat_crawler.utils.img_utils import split_img_bytes
 from flat_crawler.utils.img_matching import ImageMatchingEngine, FlatPostImage
+from flat_crawler.utils.feature_store import ImageFeatureStore
+from flat_crawler.utils.img_atlas import get_image_atlas
+from flat_crawler.utils.db_writer import get_db_writer
+from flat_crawler.utils.img_fingerprints import load_image_fingerprints
+from flat_crawler.utils.img_hash import BKTree, get_post_image_hashes
+from flat_crawler.utils.histogram_index import get_histogram_index
 
 logger = logging.getLogger(__name__)
 
@@ -58,16 +78,26 @@ class ThumbnailMatcher(BaseMatcher):
 
 
 def _extract_fp_images(post: FlatPost) -> List[FlatPostImage]:
-    images = bytes_to_images(post.photos_bytes)
-    if len(images) > 0:
-        return [FlatPostImage(flat_post=post, image=img, img_pos=pos)
-                for pos, img in enumerate(images)
+    # Images are decoded by the engine only if their features aren't cached
+    images_bytes = split_img_bytes(post.photos_bytes)
+    if len(images_bytes) > 0:
+        fingerprints = load_image_fingerprints(post, num_images=len(images_bytes))
+        coarse = fingerprints['coarse'] if fingerprints is not None else [None] * len(images_bytes)
+        return [FlatPostImage(flat_post=post, img_bytes=img_bytes, img_pos=pos, img_coarse=img_coarse)
+                for pos, (img_bytes, img_coarse) in enumerate(zip(images_bytes, coarse))
         ]
     else:
         logger.warning(f"Missing photos for {post}")
         return []
 
 
+def _extract_thumbnail_fp_image(post: FlatPost) -> Optional[FlatPostImage]:
+    images_bytes = split_img_bytes(post.thumbnail)
+    if len(images_bytes) != 1:
+        return None
+    return FlatPostImage(flat_post=post, img_bytes=images_bytes[0], img_pos=THUMBNAIL_IMG_POS)
+
+
 class ImageMatcher(BaseMatcher):
     MATCH_TYPE = "image"
 
@@ -75,17 +105,182 @@ class ImageMatcher(BaseMatcher):
     CONFIDENT_THRESHOLD = 2
     MAYBE_THRESHOLD = 4
 
-    def __init__(self, post, matching_engine: ImageMatchingEngine, dry: bool = False):
+    # Thumbnail gating, see _gate_candidates. On the benchmark_matching corpus dHash-es
+    # of different photos are at least 19 bits apart, logo and brightness variants of
+    # the same photo mostly within 6 bits.
+    GATE_ACCEPT_DISTANCE = 6
+    GATE_REJECT_DISTANCE = 16
+
+    def __init__(
+        self,
+        post,
+        matching_engine: ImageMatchingEngine,
+        dry: bool = False,
+        exhaustive: bool = IMAGE_MATCHING_EXHAUSTIVE,
+        gate_stats: Optional[Counter] = None,
+    ):
+        """
+        Args:
+            exhaustive: Compare all pairs of gallery images, instead of stopping once
+                the candidate is decided, see _match_galleries.
+            gate_stats: Counter of candidates accepted or rejected by the gate, or
+                compared by galleries, shared by matchers of a single run.
+        """
         super().__init__(post=post)
         self._engine = matching_engine
+        self._engine.pin_post(post.id)
         self._fp_images = _extract_fp_images(post=post)
         self._dry = dry
+        self._exhaustive = exhaustive
+        self._gate_stats = gate_stats if gate_stats is not None else Counter()
+        # Hashes of post images, only pairs within IMAGE_HASH_RADIUS are compared.
+        self._hash_tree = None
+        if IMAGE_HASH_RADIUS is not None:
+            post_hashes = get_post_image_hashes(post, images=(fp.image for fp in self._fp_images), dry=dry)
+            self._hash_tree = BKTree((img_hash, pos) for pos, img_hash in enumerate(post_hashes))
 
-    def _match(self, candidate: FlatPost) -> bool:
-        cand_images = _extract_fp_images(post=candidate)
-        matches = [self._engine.get_image_match(img1, img2, dry=self._dry)
-                   for img1 in self._fp_images for img2 in cand_images
+    def _match_candidates(self, candidates: QuerySet):
+        candidates = list(candidates)
+        self._engine.preload_image_matches(
+            flat_post_id=self._post.id, candidate_ids=[cand.id for cand in candidates]
+        )
+        try:
+            cands_images = [_extract_fp_images(post=cand) for cand in candidates]
+            cands_distances = [
+                self._get_hash_distances(candidate=cand, cand_images=cand_images)
+                for cand, cand_images in zip(candidates, cands_images)
+            ]
+            decisions = self._gate_candidates(candidates=candidates, cands_distances=cands_distances)
+            # Candidates the gate couldn't decide about
+            gallery_inds = [ind for ind, decision in enumerate(decisions) if decision is None]
+            gallery_decisions = self._match_galleries(
+                candidates=[candidates[ind] for ind in gallery_inds],
+                cands_images=[cands_images[ind] for ind in gallery_inds],
+                cands_pairs=[self._get_image_pairs(cands_distances[ind]) for ind in gallery_inds],
+            )
+        finally:
+            self._engine.flush_image_matches()
+        for ind, decision in zip(gallery_inds, gallery_decisions):
+            decisions[ind] = decision
+        return [cand for cand, decision in zip(candidates, decisions) if decision]
+
+    def _match_galleries(
+        self,
+        candidates: List[FlatPost],
+        cands_images: List[List[FlatPostImage]],
+        cands_pairs: List[Optional[List[Tuple[int, int]]]],
+    ) -> List[bool]:
+        """ Compares gallery images of candidates in rounds, pairs in given order.
+
+        Each round compares the next pairs of all undecided candidates in a single batch,
+        rounds double in size. Candidate is decided as soon as any threshold of _is_match
+        is reached, or none can be reached with the remaining pairs, so decisions are the
+        same as after comparing all pairs. Exhaustive matcher compares all pairs at once.
+        """
+        # Without hashes all pairs are compared, in order of images
+        cands_pairs = [
+            pairs if pairs is not None else list(product(range(len(self._fp_images)), range(len(cand_images))))
+            for pairs, cand_images in zip(cands_pairs, cands_images)
         ]
+        decisions = [None] * len(candidates)
+        cands_matches = [[] for _ in candidates]
+        num_compared = [0] * len(candidates)
+        round_size = max(map(len, cands_pairs), default=0) if self._exhaustive else self.CONFIDENT_THRESHOLD
+        while True:
+            undecided = [ind for ind, decision in enumerate(decisions) if decision is None]
+            if not undecided:
+                return decisions
+            round_pairs = [
+                cands_pairs[ind][num_compared[ind]:num_compared[ind] + round_size] for ind in undecided
+            ]
+            round_matches = self._engine.get_image_matches_many(
+                self._fp_images, [cands_images[ind] for ind in undecided], dry=self._dry, cands_pairs=round_pairs,
+            )
+            for ind, pairs, matches in zip(undecided, round_pairs, round_matches):
+                num_compared[ind] += len(pairs)
+                cands_matches[ind].extend(matches)
+                decisions[ind] = self._decide(
+                    candidate=candidates[ind],
+                    matches=cands_matches[ind],
+                    num_remaining=len(cands_pairs[ind]) - num_compared[ind],
+                )
+            round_size *= 2
+
+    def _decide(self, candidate: FlatPost, matches: List[Optional[ImageMatch]], num_remaining: int) -> Optional[bool]:
+        """ Decision of _is_match, or None if it depends on the remaining pairs. """
+        thresholds = self._get_thresholds(candidate=candidate, matches=matches)
+        if any(match_num >= threshold for match_num, threshold in thresholds):
+            return True
+        if all(match_num + num_remaining < threshold for match_num, threshold in thresholds):
+            return self._is_match(candidate=candidate, matches=matches)
+        return None
+
+    def _gate_candidates(
+        self, candidates: List[FlatPost], cands_distances: List[Optional[Dict]]
+    ) -> List[Optional[bool]]:
+        """ Decides about candidates by thumbnails and image hashes, before comparing galleries.
+
+        Candidate is accepted if thumbnails match according to all comparers and at least
+        EXACT_THRESHOLD distinct post images have near duplicates among distinct candidate
+        images, so a photo repeated in either gallery counts once. Rejected if thumbnails
+        don't match and no gallery images are close.
+        Returns: True or False for decided candidates, None for the others.
+        """
+        decisions = [None] * len(candidates)
+        post_thumbnail = _extract_thumbnail_fp_image(post=self._post)
+        gated = []
+        if post_thumbnail is not None and self._hash_tree is not None:
+            for ind, cand in enumerate(candidates):
+                cand_thumbnail = _extract_thumbnail_fp_image(post=cand)
+                if cand_thumbnail is not None and self._engine.are_comparable(post_thumbnail, cand_thumbnail):
+                    gated.append((ind, cand_thumbnail))
+
+        # Single pair of images per candidate
+        thumbnail_matches = self._engine.get_image_matches_many(
+            [post_thumbnail], [[cand_thumbnail] for _, cand_thumbnail in gated], dry=self._dry
+        ) if gated else []
+        for (ind, _), (thumbnail_match, ) in zip(gated, thumbnail_matches):
+            distances = cands_distances[ind]
+            close_pairs = [pair for pair, dist in distances.items() if dist <= self.GATE_ACCEPT_DISTANCE]
+            num_close = min(len(set(pos for pos, _ in close_pairs)), len(set(pos for _, pos in close_pairs)))
+            if (
+                thumbnail_match is not None and
+                thumbnail_match.num_comparers_confirmed == self._engine.num_comparers and
+                num_close >= self.EXACT_THRESHOLD
+            ):
+                decisions[ind] = True
+            elif (
+                (thumbnail_match is None or thumbnail_match.num_comparers_confirmed == 0) and
+                not any(dist <= self.GATE_REJECT_DISTANCE for dist in distances.values())
+            ):
+                decisions[ind] = False
+
+        self._gate_stats['accepted'] += decisions.count(True)
+        self._gate_stats['rejected'] += decisions.count(False)
+        self._gate_stats['gallery'] += decisions.count(None)
+        return decisions
+
+    def _match(self, candidate: FlatPost) -> bool:
+        return len(self._match_candidates([candidate])) > 0
+
+    def _is_match(self, candidate: FlatPost, matches: List[Optional[ImageMatch]]) -> bool:
+        thresholds = self._get_thresholds(candidate=candidate, matches=matches)
+        for match_num, threshold in thresholds:
+            if match_num >= threshold:
+                return True
+
+        exact_matches, confident_and_exact, all_matches = (match_num for match_num, _ in thresholds)
+        if all_matches > 0:
+            print(f"Close: {candidate.heading}, {candidate.size_m2}m2, {candidate.price}zł")
+            print(
+                f"Exact {exact_matches}, confident: {confident_and_exact - exact_matches}, "
+                f"maybe: {all_matches - confident_and_exact}"
+            )
+
+        return False
+
+    def _get_thresholds(self, candidate: FlatPost, matches: List[Optional[ImageMatch]]) -> List[Tuple[int, int]]:
+        """ Numbers of matches and thresholds they need to reach, candidate matches if any reaches it. """
         exact_matches, confident_matches, maybe_matches = 0, 0, 0
         for match in filter(lambda x: x is not None, matches):
             if match.num_comparers_confirmed == self._engine.num_comparers:
@@ -109,27 +304,48 @@ class ImageMatcher(BaseMatcher):
         ):
             lower_thresholds = True
 
-        for match_num, threshold in thresholds:
-            if lower_thresholds:
-                threshold -= 1
-            if match_num >= threshold:
-                return True
-
-        if exact_matches + confident_matches + maybe_matches > 0:
-            print(f"Close: {candidate.heading}, {candidate.size_m2}m2, {candidate.price}zł")
-            print(f"Exact {exact_matches}, confident: {confident_matches}, maybe: {maybe_matches}")
-
-        return False
+        if lower_thresholds:
+            thresholds = [(match_num, threshold - 1) for match_num, threshold in thresholds]
+        return thresholds
+
+    def _get_hash_distances(
+        self, candidate: FlatPost, cand_images: List[FlatPostImage]
+    ) -> Optional[Dict[Tuple[int, int], int]]:
+        """ Hamming distances of close pairs of post and candidate images. """
+        if self._hash_tree is None:
+            return None
+        # Images are opened only if the hashes are missing
+        cand_hashes = get_post_image_hashes(
+            candidate, images=(fp.image for fp in cand_images), dry=self._dry
+        )
+        radius = max(IMAGE_HASH_RADIUS, self.GATE_REJECT_DISTANCE)
+        return {
+            (pos, cand_pos): dist
+            for cand_pos, cand_hash in enumerate(cand_hashes)
+            for dist, pos in self._hash_tree.find(cand_hash, radius=radius)
+        }
+
+    def _get_image_pairs(self, hash_distances: Optional[Dict]) -> Optional[List[Tuple[int, int]]]:
+        """ Pairs of post and candidate images to compare, closest hashes first. """
+        if hash_distances is None:
+            return None
+        return [
+            pair for dist, pair in sorted((dist, pair) for pair, dist in hash_distances.items())
+            if dist <= IMAGE_HASH_RADIUS
+        ]
 
 
 class BaseInfoMatcher(BaseMatcher):
     MATCH_TYPE = "base_info"
+    # Posts are the same flat if any of ANY_FIELDS, or all of ALL_FIELDS are equal
+    ANY_FIELDS = ["url", "desc"]
+    ALL_FIELDS = ["size_m2", "heading", "district"]
 
     def _match(self, candidate: FlatPost) -> bool:
-        if self._any(candidate=candidate, fields=["url", "desc"]):
+        if self._any(candidate=candidate, fields=self.ANY_FIELDS):
             return True
 
-        if self._all(candidate=candidate, fields=["size_m2", "heading", "district"]):
+        if self._all(candidate=candidate, fields=self.ALL_FIELDS):
             return True
 
     def _any(self, candidate, fields):
@@ -142,7 +358,26 @@ class BaseInfoMatcher(BaseMatcher):
             getattr(self._post, field) == getattr(candidate, field) for field in fields
         )
 
-image_matching_engine = ImageMatchingEngine(stop_early=True)
+def merge_flat_ratings(main_flat: Flat, flats: Iterable[Flat]) -> None:
+    """ Rating of flats merged into main_flat, heart beats star beats reject. """
+    flats = list(flats)
+    main_flat.hearted = any(flat.hearted for flat in flats)
+    main_flat.starred = not main_flat.hearted and any(flat.starred for flat in flats)
+    main_flat.rejected = (
+        not main_flat.hearted and
+        not main_flat.starred and
+        any(flat.rejected for flat in flats)
+    )
+
+
+image_matching_engine = ImageMatchingEngine(
+    stop_early=True,
+    feature_store=ImageFeatureStore(),
+    image_atlas=get_image_atlas(),
+    cascade=True,
+    pyramid=True,
+    num_workers=IMAGE_MATCHING_WORKERS,
+)
 
 
 class MatchingEngine(object):
@@ -150,44 +385,84 @@ class MatchingEngine(object):
         (BaseInfoMatcher, {}),
         (ImageMatcher, {'matching_engine': image_matching_engine}),
     ]
-
-    def __init__(self, match_broken=False, rematch_mode: bool = False):
+    # Original posts of flats within these size and price deltas are candidates
+    CANDIDATE_SIZE_DELTA = 1
+    CANDIDATE_PRICE_DELTA = 100000
+
+    def __init__(
+        self, match_broken=False, rematch_mode: bool = False, blocking_index: bool = MATCHING_BLOCKING_INDEX
+    ):
+        """
+        Args:
+            blocking_index: Find candidates in BlockingIndex of all original posts, loaded
+                on first use, instead of a range query for each post.
+        """
         self._match_broken = match_broken
         self._rematch_mode = rematch_mode
+        self._db_writer = get_db_writer()
+        self._histogram_index = get_histogram_index()
+        self._use_blocking_index = blocking_index
+        self._blocking_index = None
+        # Per-run arguments of matchers, in addition to MATCHERS_CONFIG
+        self._gate_stats = Counter()
+        self._matchers_kwargs = {ImageMatcher: {'gate_stats': self._gate_stats}}
 
     def match_posts(self):
-        unmatched_posts = FlatPost.objects.filter(flat__isnull=True)
+        unmatched_posts = FlatPost.objects.filter(flat__isnull=True, archived=False)
         # Filter out broken posts, unless we do want to match them.
         if not self._match_broken:
             unmatched_posts = unmatched_posts.filter(is_broken=False)
         unmatched_posts = list(unmatched_posts)
         num_unmatched = len(unmatched_posts)
         logger.info(f"Matching {num_unmatched} unmatched posts.")
+        self._gate_stats.clear()
         failed_matches = []
         num_created = 0
         num_matched = 0
         num_exceptions = 0
-        for post in unmatched_posts:
-            try:
-                candidates = self._get_candidates(post=post)
-                matches, match_type = self._find_matches(post=post, candidates=candidates)
-                if matches is None:
-                    self._create_flat_from_post(post=post)
-                    num_created += 1
-                elif len(matches) == 1:
-                    self._match_post_to_existing_flat(
-                        post=post, match=matches[0], match_type=match_type
-                    )
-                    num_matched += 1
-                else:
-                    self._handle_multiple_matches(post=post, matches=matches)
-                    failed_matches.append(post)
-            except Exception as exc:
-                logger.exception(f"Matching {post} failed with {exc}")
-                post.is_broken = True
-                post.exception_str = str(exc)
-                post.save()
-                num_exceptions += 1
+        num_failed_writes = 0
+        try:
+            for post in unmatched_posts:
+                try:
+                    histograms = self._get_histograms(post=post)
+                    candidates = self._get_candidates(post=post, histograms=histograms)
+                    matches, match_type = self._find_matches(post=post, candidates=candidates)
+                    if matches is None:
+                        self._create_flat_from_post(post=post)
+                        num_created += 1
+                    elif len(matches) == 1:
+                        self._match_post_to_existing_flat(
+                            post=post, match=matches[0], match_type=match_type
+                        )
+                        num_matched += 1
+                    else:
+                        self._handle_multiple_matches(post=post, matches=matches)
+                        failed_matches.append(post)
+                    self._index_histograms(post=post, histograms=histograms)
+                except DBWriteFailed as exc:
+                    # Writes scheduled so far, not necessarily of this post, failed.
+                    # Unmatched posts are matched again in the next run.
+                    logger.error(f"Saving matching results failed while matching {post}: {exc}")
+                    num_failed_writes += len(exc.failures)
+                except Exception as exc:
+                    logger.exception(f"Matching {post} failed with {exc}")
+                    post.is_broken = True
+                    post.exception_str = str(exc)
+                    self._db_writer.save(post)
+                    num_exceptions += 1
+        finally:
+            # Shuts down the worker pool and frees shared memory of parallel scoring
+            image_matching_engine.close()
+        try:
+            self._db_writer.flush()
+        except DBWriteFailed as exc:
+            logger.error(f"Saving matching results failed: {exc}")
+            num_failed_writes += len(exc.failures)
+        if self._histogram_index is not None:
+            self._histogram_index.save()
+        logger.info(f"Image data cache: {image_matching_engine.cache_stats}")
+        logger.info(f"Image comparers cascade: {image_matching_engine.cascade_stats}")
+        logger.info(f"Thumbnail gating: {dict(self._gate_stats)}")
 
         logger.warning(
             f"Following posts failed to match:\n {elements_to_str(failed_matches)}"
@@ -197,11 +472,15 @@ class MatchingEngine(object):
             f"{num_created} flats created.\n"
             f"{num_matched} posts matched to existing flats.\n"
             f"{len(failed_matches)} posts failed to match\n"
-            f"{num_exceptions} posts were broken."
+            f"{num_exceptions} posts were broken.\n"
+            f"{num_failed_writes} writes failed."
         )
 
     @classmethod
     def merge_multiple_posts(cls, posts: Iterable[FlatPost]):
+        db_writer = get_db_writer()
+        # Flats of the posts are read below, make sure they are up to date.
+        db_writer.flush()
         posts_str = elements_to_str(posts)
         posts_without_flat = [post for post in posts if post.flat is None]
         flats = list(set(post.flat for post in posts if post.flat is not None))
@@ -212,29 +491,25 @@ class MatchingEngine(object):
             flat = flats[0]
             for post in posts_without_flat:
                 post.flat = flat
-                post.save()
+                db_writer.save(post)
+            db_writer.run(FlatSummary.refresh_for_flat, flat)
         else:
             logger.info(f"Merging posts:\n {posts_str}")
             flats.sort(key=lambda flat: flat.created)
             main_flat = flats[0]
-            main_flat.hearted = any(flat.hearted for flat in flats)
-            main_flat.starred = not main_flat.hearted and any(flat.starred for flat in flats)
-            main_flat.rejected = (
-                not main_flat.hearted and
-                not main_flat.starred and
-                any(flat.rejected for flat in flats)
-            )
-            main_flat.save()
+            merge_flat_ratings(main_flat=main_flat, flats=flats)
+            db_writer.save(main_flat)
             for flat in flats[1:]:
                 logger.info(f"Merging flat {flat} into {main_flat}")
                 for related_post in flat.flatpost_set.all():
                     related_post.flat = main_flat
                     related_post.is_original_post = False
-                    related_post.save()
-                flat.delete()
+                    db_writer.save(related_post)
+                db_writer.run(flat.delete)
             for post in posts_without_flat:
                 post.flat = main_flat
-                post.save()
+                db_writer.save(post)
+            db_writer.run(FlatSummary.refresh_for_flat, main_flat)
 
     def rematch_posts(self, rematched_posts: List[FlatPost]):
         self._rematch_mode = True
@@ -246,7 +521,7 @@ class MatchingEngine(object):
         for post in rematched_posts:
             logger.info(f"Rematching post: {post}")
             try:
-                matches, match_type = self._find_matches(post=post)
+                matches, match_type = self._find_matches(post=post, candidates=self._get_candidates(post=post))
                 if matches is None:
                     continue
                 if len(matches) >= 1:
@@ -256,8 +531,9 @@ class MatchingEngine(object):
                 logger.exception(f"Matching {post} failed with {exc}")
                 post.is_broken = True
                 post.exception_str = str(exc)
-                post.save()
+                self._db_writer.save(post)
                 num_exceptions += 1
+        self._db_writer.flush()
 
         logger.info(
             f"Rematching summary:\n"
@@ -269,23 +545,36 @@ class MatchingEngine(object):
         flat = match.flat
         logger.info(f"Attaching post: {post} to existing flat: {flat.original_post}")
         flat.min_price = min(flat.min_price, post.price)
-        flat.save()
+        self._db_writer.save(flat)
         post.flat = flat
         post.matched_by = match_type
-        post.save()
+        self._db_writer.save(post)
+        self._db_writer.run(FlatSummary.refresh_for_flat, flat)
 
     def _create_flat_from_post(self, post: FlatPost):
         logger.info(f"Creating new Flat from post: {post}")
         new_flat = Flat(min_price=post.price, original_post=post)
-        new_flat.save()
+        self._db_writer.save(new_flat)
         post.flat = new_flat
         post.is_original_post = True
         post.matched_by = ORIGINAL_POST
-        post.save()
+        self._db_writer.save(post)
+        self._db_writer.run(FlatSummary.refresh_for_flat, new_flat)
+        if self._blocking_index is not None:
+            self._blocking_index.add(post.id, new_flat.id, post.size_m2, post.price)
 
     def _handle_multiple_matches(self, post: FlatPost, matches: Iterable[FlatPost]):
         posts = [post] + list(matches)
         self.merge_multiple_posts(posts=posts)
+        if self._blocking_index is not None:
+            # Flats of the matches were merged into one of them, which kept its original post
+            flat_ids = set(match.flat_id for match in matches)
+            for flat_id in flat_ids:
+                self._blocking_index.remove_flat(flat_id)
+            self._db_writer.flush()
+            self._blocking_index.add_many(self._get_blocking_rows(
+                FlatPost.objects.filter(is_original_post=True, flat_id__in=flat_ids)
+            ))
         # matches_ids = ",".join(sorted(map(str, (p.id for p in posts))))
         # logger.warning(f"Multiple posts matching: {matches_ids}")
         # group, created = MatchingFlatPostGroup.objects.get_or_create(group_id_hash=matches_ids)
@@ -293,26 +582,96 @@ class MatchingEngine(object):
         #     for matched_post in posts:
         #         group.posts.add(matched_post)
 
-    def _get_candidates(self, post: FlatPost):
-        flat_q = FlatPost.objects.filter(is_original_post=True)
-        flat_q = flat_q.filter(size_m2__gte=post.size_m2 - 1)
-        flat_q = flat_q.filter(size_m2__lte=post.size_m2 + 1)
-        flat_q = flat_q.filter(price__lte=post.price + 100000)
-        flat_q = flat_q.filter(price__gte=post.price - 100000)
-        return flat_q
+    def _get_candidates(self, post: FlatPost, histograms: Optional[np.array] = None):
+        """
+        Args:
+            histograms: Histograms of post images, flats with similar images are candidates
+                regardless of size and price.
+        """
+        # Flats created for previous posts have to be visible.
+        self._db_writer.flush()
+        similar_flat_ids = self._get_similar_flat_ids(post=post, histograms=histograms)
+        if not self._use_blocking_index:
+            return list(self._get_candidates_query(post=post, similar_flat_ids=similar_flat_ids))
+
+        blocking_index = self._get_blocking_index()
+        post_ids = blocking_index.query(
+            size_m2=post.size_m2,
+            price=post.price,
+            size_delta=self.CANDIDATE_SIZE_DELTA,
+            price_delta=self.CANDIDATE_PRICE_DELTA,
+        )
+        post_ids += blocking_index.get_post_ids(similar_flat_ids)
+        post_ids = list(dict.fromkeys(post_id for post_id in post_ids if post_id != post.id))
+        if not post_ids:
+            return []
+        posts_by_id = FlatPost.objects.filter(archived=False).select_related('flat').in_bulk(post_ids)
+        return [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+
+    def _get_candidates_query(self, post: FlatPost, similar_flat_ids: List = ()) -> QuerySet:
+        # Archived posts have no photos to compare
+        flat_q = FlatPost.objects.filter(is_original_post=True, archived=False)
+        window_q = Q(
+            size_m2__gte=post.size_m2 - self.CANDIDATE_SIZE_DELTA,
+            size_m2__lte=post.size_m2 + self.CANDIDATE_SIZE_DELTA,
+            price__lte=post.price + self.CANDIDATE_PRICE_DELTA,
+            price__gte=post.price - self.CANDIDATE_PRICE_DELTA,
+        )
+        if similar_flat_ids:
+            window_q |= Q(flat_id__in=similar_flat_ids)
+        return flat_q.filter(window_q).select_related('flat')
+
+    def _get_blocking_index(self) -> BlockingIndex:
+        """ Loads original posts with a single query, then it's kept up to date by the engine. """
+        if self._blocking_index is None:
+            self._blocking_index = BlockingIndex()
+            self._blocking_index.add_many(self._get_blocking_rows(FlatPost.objects.filter(is_original_post=True)))
+            logger.info(f"Blocking index of {len(self._blocking_index)} flats loaded")
+        return self._blocking_index
+
+    def _get_blocking_rows(self, posts: QuerySet) -> QuerySet:
+        return posts.filter(flat__isnull=False, archived=False).values_list('id', 'flat_id', 'size_m2', 'price')
+
+    def _get_histograms(self, post: FlatPost) -> Optional[np.array]:
+        """ Histograms from fingerprints of the crawler, photos are not decoded to compute them.
+
+        Posts crawled without fingerprints are indexed by build_histogram_index command.
+        """
+        if self._histogram_index is None:
+            return None
+        fingerprints = load_image_fingerprints(post)
+        if fingerprints is None:
+            return None
+        return fingerprints['histograms']
+
+    def _get_similar_flat_ids(self, post: FlatPost, histograms: Optional[np.array]) -> List:
+        if self._histogram_index is None or histograms is None:
+            return []
+        similar = self._histogram_index.query(
+            histograms,
+            k=HISTOGRAM_INDEX_TOP_K,
+            min_similarity=HISTOGRAM_INDEX_MIN_SIMILARITY,
+            exclude_post_id=post.id,
+        )
+        return list(FlatPost.objects.filter(
+            id__in=[post_id for post_id, _ in similar], flat__isnull=False
+        ).values_list('flat_id', flat=True).distinct())
+
+    def _index_histograms(self, post: FlatPost, histograms: Optional[np.array]) -> None:
+        if self._histogram_index is not None and histograms is not None:
+            self._histogram_index.add(post.id, list(enumerate(histograms)))
 
-    def _find_matches(self, post: FlatPost, candidates) -> Optional[Iterable[FlatPost]]:
+    def _find_matches(self, post: FlatPost, candidates: List[FlatPost]) -> Optional[Iterable[FlatPost]]:
         if not self._rematch_mode:
             assert post.flat is None, "Don't match posts already matched"
             assert (
                 not post.is_original_post is None
             ), "Unmatched post has is_original_post=True."
 
-        if candidates.count() > 0:
+        if candidates:
             assert all(cand.flat is not None for cand in candidates)
             for MatcherCls, config in self.MATCHERS_CONFIG:
-                config["post"] = post
-                matcher = MatcherCls(**config)
+                matcher = MatcherCls(post=post, **config, **self._matchers_kwargs.get(MatcherCls, {}))
                 matches = matcher.find_matches(candidates=candidates)
                 if matches:
                     return matches, matcher.MATCH_TYPE
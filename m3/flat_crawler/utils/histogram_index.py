@@ -0,0 +1,166 @@
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL.Image import Image
+
+from flat_crawler.constants import HISTOGRAM_INDEX_DIR
+from flat_crawler.models import FlatPost
+
+logger = logging.getLogger(__name__)
+
+# Bins per RGB channel of the joint colour histogram
+HIST_BINS = 4
+HIST_DIM = HIST_BINS ** 3
+NUM_TABLES = 8
+NUM_BITS = 12
+# Planes are generated, not stored, keep the seed fixed.
+PLANES_SEED = 0
+
+
+def get_image_histogram(image: Image) -> np.array:
+    """ Square root of normalized joint colour histogram (unit L2 norm).
+
+    Dot product of two such vectors is the Bhattacharyya coefficient of the histograms.
+    """
+    pixels = np.asarray(image.convert('RGB')).reshape(-1, 3) // (256 // HIST_BINS)
+    bins = pixels[:, 0] * HIST_BINS ** 2 + pixels[:, 1] * HIST_BINS + pixels[:, 2]
+    hist = np.bincount(bins, minlength=HIST_DIM).astype(np.float32)
+    return np.sqrt(hist / hist.sum())
+
+
+class HistogramIndex(object):
+    """ Random projection LSH over image histograms of all posts.
+
+    Each of NUM_TABLES tables buckets images by signs of NUM_BITS random projections
+    of their (centered) histograms. Query looks only at images sharing a bucket with
+    it in any table, and ranks them by exact similarity.
+    Histograms are persisted in index_dir, buckets are rebuilt on load.
+    """
+    FILENAME = 'histograms.npz'
+
+    def __init__(self, index_dir=None):
+        self._path = Path(index_dir) / self.FILENAME if index_dir is not None else None
+        planes = np.random.RandomState(PLANES_SEED).randn(NUM_TABLES, HIST_DIM, NUM_BITS)
+        self._planes = planes.astype(np.float32)
+        self._bit_weights = 1 << np.arange(NUM_BITS)
+        self._center = np.full(HIST_DIM, 1 / np.sqrt(HIST_DIM), dtype=np.float32)
+        # Rows beyond len(self) are preallocated
+        self._vectors = np.zeros((0, HIST_DIM), dtype=np.float32)
+        self._post_ids = []
+        self._img_positions = []
+        self._keys = set()
+        # Posts whose images were added, possibly none of them
+        self._indexed_post_ids = set()
+        # table -> bucket code -> rows
+        self._buckets = [defaultdict(list) for _ in range(NUM_TABLES)]
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._post_ids)
+
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return key in self._keys
+
+    def add(self, post_id: str, histograms: List[Tuple[int, np.array]]) -> None:
+        """ Adds (img_pos, histogram) of images of the post, skipping ones already added. """
+        post_id = str(post_id)
+        self._indexed_post_ids.add(post_id)
+        histograms = [(img_pos, hist) for img_pos, hist in histograms if (post_id, img_pos) not in self._keys]
+        if not histograms:
+            return
+        self._add_vectors(
+            keys=[(post_id, img_pos) for img_pos, _ in histograms],
+            vectors=np.stack([hist for _, hist in histograms]).astype(np.float32),
+        )
+
+    def add_post(self, post: FlatPost, images: Optional[List[Image]] = None) -> None:
+        """ Adds photos of the post, unless it was added already. """
+        if str(post.id) in self._indexed_post_ids:
+            return
+        images = post.images if images is None else images
+        self.add(post.id, [(img_pos, get_image_histogram(image)) for img_pos, image in enumerate(images)])
+
+    def query(
+        self, histograms: np.array, k: int, min_similarity: float, exclude_post_id: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """ Returns up to k (post id, similarity) most similar to any of the histograms. """
+        if len(self) == 0 or len(histograms) == 0:
+            return []
+        exclude_post_id = str(exclude_post_id) if exclude_post_id is not None else None
+        histograms = np.asarray(histograms, dtype=np.float32).reshape(-1, HIST_DIM)
+        codes = self._get_codes(histograms).tolist()
+        best = {}
+        for hist, hist_codes in zip(histograms, codes):
+            rows = set()
+            for table, code in enumerate(hist_codes):
+                rows.update(self._buckets[table].get(code, ()))
+            if not rows:
+                continue
+            rows = np.fromiter(rows, dtype=np.int64)
+            similarities = self._vectors[rows] @ hist
+            for row, similarity in zip(rows, similarities):
+                post_id = self._post_ids[row]
+                if similarity >= min_similarity and post_id != exclude_post_id:
+                    best[post_id] = max(best.get(post_id, 0.0), float(similarity))
+        return sorted(best.items(), key=lambda item: -item[1])[:k]
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        keys = list(zip(self._post_ids, self._img_positions))
+        tmp_path = self._path.with_suffix('.tmp.npz')
+        np.savez(
+            tmp_path,
+            vectors=self._vectors[:len(self)],
+            post_ids=np.array([post_id for post_id, _ in keys], dtype=str),
+            img_positions=np.array([img_pos for _, img_pos in keys]),
+        )
+        tmp_path.replace(self._path)
+
+    def _load(self) -> None:
+        if self._path is None or not self._path.exists():
+            return
+        with np.load(self._path) as data:
+            keys = [
+                (post_id, int(img_pos))
+                for post_id, img_pos in zip(data['post_ids'].tolist(), data['img_positions'])
+            ]
+            self._add_vectors(keys=keys, vectors=data['vectors'])
+        logger.info(f"Loaded histograms of {len(self)} images")
+
+    def _add_vectors(self, keys: List[Tuple[str, int]], vectors: np.array) -> None:
+        first_row = len(self._post_ids)
+        if first_row + len(vectors) > len(self._vectors):
+            capacity = max(2 * len(self._vectors), first_row + len(vectors))
+            self._vectors = np.concatenate(
+                [self._vectors[:first_row], np.zeros((capacity - first_row, HIST_DIM), dtype=np.float32)]
+            )
+        self._vectors[first_row:first_row + len(vectors)] = vectors
+        codes = self._get_codes(vectors).tolist()
+        for row, (code_row, (post_id, img_pos)) in enumerate(zip(codes, keys), first_row):
+            self._post_ids.append(post_id)
+            self._img_positions.append(img_pos)
+            self._keys.add((post_id, img_pos))
+            self._indexed_post_ids.add(post_id)
+            for table, code in enumerate(code_row):
+                self._buckets[table][code].append(row)
+
+    def _get_codes(self, vectors: np.array) -> np.array:
+        """ Bucket code of each vector in each table, shape (num vectors, NUM_TABLES). """
+        bits = np.einsum('nd,tdb->ntb', vectors - self._center, self._planes) > 0
+        return (bits * self._bit_weights).sum(axis=2)
+
+
+_histogram_index = None
+
+
+def get_histogram_index() -> Optional[HistogramIndex]:
+    """ Returns index shared within the process, or None if HISTOGRAM_INDEX_DIR isn't set. """
+    global _histogram_index
+    if _histogram_index is None and HISTOGRAM_INDEX_DIR is not None:
+        _histogram_index = HistogramIndex(index_dir=HISTOGRAM_INDEX_DIR)
+    return _histogram_index
@@ -0,0 +1,138 @@
+import fcntl
+import logging
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL.Image import Image
+
+from flat_crawler.constants import THUMBNAIL_IMG_POS, THUMBNAIL_SIZE, IMAGE_ATLAS_DIR
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.img_utils import bytes_to_images
+
+logger = logging.getLogger(__name__)
+
+# rows x columns x RGB channels of every image kept in the atlas
+ATLAS_IMG_SHAPE = (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3)
+THUMBNAIL_POS = 'T'
+
+
+class ImageAtlas(object):
+    """ Append-only, memory-mapped array of decoded images.
+
+    Images are stored as uint8 rows of shape ATLAS_IMG_SHAPE in a single flat file,
+    with a tab separated index file mapping (post id, img_pos) to a row.
+    Index entries are written after image data, so readers in other processes
+    never see a row which isn't fully written. Every process maps the same file
+    read-only, so the decoded images are shared through the page cache.
+    """
+    DATA_FILENAME = 'images.u8'
+    INDEX_FILENAME = 'index.tsv'
+    LOCK_FILENAME = 'atlas.lock'
+
+    def __init__(self, atlas_dir):
+        self._dir = Path(atlas_dir)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._data_path = self._dir / self.DATA_FILENAME
+        self._index_path = self._dir / self.INDEX_FILENAME
+        self._lock_path = self._dir / self.LOCK_FILENAME
+        self._data_path.touch(exist_ok=True)
+        self._index_path.touch(exist_ok=True)
+
+        self._row_size = int(np.prod(ATLAS_IMG_SHAPE))
+        self._index = {}
+        self._index_offset = 0
+        self._array = None
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return self.get_row(*key) is not None
+
+    @property
+    def array(self) -> np.array:
+        """ Memory-mapped array of all images, shape (N, *ATLAS_IMG_SHAPE). """
+        self._refresh()
+        return self._array
+
+    def get_row(self, flat_post_id: str, img_pos: int) -> Optional[int]:
+        key = self._get_key(flat_post_id=flat_post_id, img_pos=img_pos)
+        if key not in self._index:
+            # Other process might have added the image since last refresh.
+            self._refresh()
+        return self._index.get(key)
+
+    def get(self, flat_post_id: str, img_pos: int) -> Optional[np.array]:
+        """ Returns read-only view on the image array, or None if image isn't in the atlas. """
+        row = self.get_row(flat_post_id=flat_post_id, img_pos=img_pos)
+        if row is not None:
+            return self._array[row]
+
+    def get_many(self, keys: Iterable[Tuple[str, int]]) -> np.array:
+        """ Returns stacked images for (post id, img_pos) keys, all of them must be present. """
+        rows = [self.get_row(flat_post_id, img_pos) for flat_post_id, img_pos in keys]
+        return self._array[rows]
+
+    def add(self, flat_post_id: str, img_pos: int, image: Image) -> Optional[int]:
+        """ Adds image to the atlas if it isn't there yet. Returns its row. """
+        row = self.get_row(flat_post_id=flat_post_id, img_pos=img_pos)
+        if row is not None:
+            return row
+        if image.mode != 'RGB' or image.size != THUMBNAIL_SIZE:
+            logger.warning(
+                f"Image {flat_post_id}:{img_pos} not added to atlas, {image.mode} {image.size}"
+            )
+            return None
+        img_arr = np.asarray(image, dtype=np.uint8)
+        key = self._get_key(flat_post_id=flat_post_id, img_pos=img_pos)
+        with open(self._lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self._data_path, 'ab') as data_file:
+                row = data_file.tell() // self._row_size
+                data_file.write(img_arr.tobytes())
+            with open(self._index_path, 'a') as index_file:
+                index_file.write(f"{key[0]}\t{key[1]}\t{row}\n")
+        self._refresh()
+        return row
+
+    def add_post(self, post: FlatPost) -> List[Optional[int]]:
+        return [
+            self.add(flat_post_id=post.id, img_pos=img_pos, image=image)
+            for img_pos, image in enumerate(bytes_to_images(post.photos_bytes))
+        ]
+
+    def _get_key(self, flat_post_id: str, img_pos: int) -> Tuple[str, str]:
+        return str(flat_post_id), THUMBNAIL_POS if img_pos == THUMBNAIL_IMG_POS else str(img_pos)
+
+    def _refresh(self) -> None:
+        with open(self._index_path, 'rb') as index_file:
+            index_file.seek(self._index_offset)
+            for line in index_file:
+                if not line.endswith(b'\n'):
+                    # Entry still being written
+                    break
+                flat_post_id, img_pos, row = line.decode().rstrip('\n').split('\t')
+                self._index[(flat_post_id, img_pos)] = int(row)
+                self._index_offset += len(line)
+
+        num_rows = self._data_path.stat().st_size // self._row_size
+        if self._array is None or len(self._array) != num_rows:
+            if num_rows == 0:
+                self._array = np.empty((0, ) + ATLAS_IMG_SHAPE, dtype=np.uint8)
+            else:
+                self._array = np.memmap(
+                    self._data_path, dtype=np.uint8, mode='r', shape=(num_rows, ) + ATLAS_IMG_SHAPE
+                )
+
+
+_image_atlas = None
+
+
+def get_image_atlas() -> Optional[ImageAtlas]:
+    """ Returns atlas shared within the process, or None if IMAGE_ATLAS_DIR isn't set. """
+    global _image_atlas
+    if _image_atlas is None and IMAGE_ATLAS_DIR is not None:
+        _image_atlas = ImageAtlas(atlas_dir=IMAGE_ATLAS_DIR)
+    return _image_atlas
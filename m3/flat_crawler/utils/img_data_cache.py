@@ -0,0 +1,91 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def get_nbytes(img_data) -> int:
+    """ Memory taken by numpy arrays of ImageData. """
+    return sum(array.nbytes for array in img_data.arrays())
+
+
+class ImageDataCache(object):
+    """ LRU cache of ImageData bounded by the size of their arrays.
+
+    Entries of the pinned post are never evicted, so images of the post being
+    matched stay in memory while its candidates are iterated.
+    """
+
+    def __init__(self, max_mb: Optional[float], on_evict: Optional[Callable[[Any], None]] = None):
+        """
+        Args:
+            max_mb: Memory budget in MB, None means unbounded.
+            on_evict: Called with post id of each evicted entry.
+        """
+        self._max_bytes = max_mb * 2 ** 20 if max_mb is not None else None
+        self._on_evict = on_evict
+        # key -> (post_id, img_data, nbytes)
+        self._entries = OrderedDict()
+        self._pinned_post_id = None
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, post_id: Any, img_data) -> None:
+        if key in self._entries:
+            self.num_bytes -= self._entries.pop(key)[2]
+        nbytes = get_nbytes(img_data)
+        self._entries[key] = (post_id, img_data, nbytes)
+        self.num_bytes += nbytes
+        self._evict()
+
+    def pin_post(self, post_id: Any) -> None:
+        """ Pins entries of the post, unpinning previously pinned post. """
+        self._pinned_post_id = post_id
+        self._evict()
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'size_mb': round(self.num_bytes / 2 ** 20, 2),
+        }
+
+    def _evict(self) -> None:
+        if self._max_bytes is None or self.num_bytes <= self._max_bytes:
+            return
+        pinned = []
+        while self.num_bytes > self._max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            post_id, _, nbytes = entry
+            if post_id == self._pinned_post_id:
+                pinned.append((key, entry))
+                continue
+            self.num_bytes -= nbytes
+            self.evictions += 1
+            if self._on_evict is not None:
+                self._on_evict(post_id)
+        # Pinned entries are in use, move them to the most recently used end.
+        self._entries.update(pinned)
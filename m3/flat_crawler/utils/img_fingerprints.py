@@ -0,0 +1,47 @@
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL.Image import Image
+
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.feature_store import bytes_to_features, features_to_bytes
+from flat_crawler.utils.histogram_index import get_image_histogram
+from flat_crawler.utils.img_hash import dhash
+from flat_crawler.utils.img_matching import get_img_coarse
+
+logger = logging.getLogger(__name__)
+
+
+def add_image_fingerprints(post: FlatPost, images: List[Image]) -> None:
+    """ Sets fingerprints of post photos, computed by the crawler while it holds the decoded photos.
+
+    Images have to be decoded from the stored photos_bytes, not the downloaded ones
+    before JPEG compression, so fingerprints are the same as of photos seen by matching.
+
+    dHash of each photo goes to image_hashes, see img_hash.py. Colour histograms (see
+    histogram_index.py) and coarse grayscale images (see img_matching.get_img_coarse)
+    are stored in image_fingerprints, one row per photo.
+    """
+    if not images:
+        return
+    post.image_hashes = [dhash(image) for image in images]
+    post.image_fingerprints = features_to_bytes({
+        'histograms': np.array([get_image_histogram(image) for image in images]),
+        'coarse': np.array([get_img_coarse(image) for image in images]),
+    })
+
+
+def load_image_fingerprints(post: FlatPost, num_images: Optional[int] = None) -> Optional[Dict[str, np.array]]:
+    """ Fingerprints of post photos, None if the post was crawled without them.
+
+    Args:
+        num_images: Expected number of photos, fingerprints of other number are ignored.
+    """
+    if post.image_fingerprints is None:
+        return None
+    fingerprints = bytes_to_features(bytes(post.image_fingerprints))
+    if num_images is not None and len(fingerprints['histograms']) != num_images:
+        logger.warning(f"Fingerprints of {post} don't match its {num_images} photos, ignoring them")
+        return None
+    return fingerprints
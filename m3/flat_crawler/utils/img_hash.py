@@ -0,0 +1,117 @@
+import logging
+from itertools import combinations
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from flat_crawler.models import FlatPost
+from flat_crawler.utils.db_writer import get_db_writer
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """ Difference hash, bits tell if pixel is brighter than its right neighbour. """
+    pixels = np.asarray(
+        image.convert('L').resize((hash_size + 1, hash_size), Image.ANTIALIAS), dtype=int
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_1: int, hash_2: int) -> int:
+    return bin(hash_1 ^ hash_2).count('1')
+
+
+class BKTree(object):
+    """ Burkhard-Keller tree of hashes, for lookups within hamming distance radius.
+
+    Children of a node are keyed by their distance to the node, so by the triangle
+    inequality only children with key within [dist - radius, dist + radius] are visited.
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, Any]] = ()):
+        # node: (hash, items with that hash, children dict)
+        self._root = None
+        self._size = 0
+        for img_hash, item in items:
+            self.add(img_hash, item)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, img_hash: int, item: Any) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = (img_hash, [item], {})
+            return
+        node = self._root
+        while True:
+            node_hash, node_items, children = node
+            dist = hamming_distance(img_hash, node_hash)
+            if dist == 0:
+                node_items.append(item)
+                return
+            if dist not in children:
+                children[dist] = (img_hash, [item], {})
+                return
+            node = children[dist]
+
+    def find(self, img_hash: int, radius: int) -> List[Tuple[int, Any]]:
+        """ Returns (distance, item) of all items within radius from img_hash. """
+        found = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_hash, node_items, children = nodes.pop()
+            dist = hamming_distance(img_hash, node_hash)
+            if dist <= radius:
+                found.extend((dist, item) for item in node_items)
+            nodes.extend(
+                child for child_dist, child in children.items()
+                if dist - radius <= child_dist <= dist + radius
+            )
+        return found
+
+
+def get_post_image_hashes(
+    post: FlatPost, images: Optional[Iterable[Image.Image]] = None, dry: bool = False
+) -> List[int]:
+    """ Returns hashes of post photos, computes and saves them if missing.
+
+    Args:
+        images: Decoded post photos, to avoid decoding them again. Iterated only if hashes are missing.
+        dry: Don't save computed hashes, they are only set on the post object.
+    """
+    if post.image_hashes is None:
+        if images is None:
+            images = post.images
+        post.image_hashes = [dhash(image) for image in images]
+        if not dry:
+            get_db_writer().run(
+                FlatPost.objects.filter(id=post.id).update, image_hashes=post.image_hashes
+            )
+    return post.image_hashes
+
+
+def get_prefilter_recall(engine, images: List[Image.Image], radius: int) -> Tuple[float, int]:
+    """ Recall of hash prefilter against comparers of the engine, on pairs of images.
+
+    Pair is relevant if it would count as a match in ImageMatcher: at least one comparer
+    confirmed it, or all comparers suggest a match.
+    Returns: recall and number of relevant pairs.
+    """
+    hashes = [dhash(image) for image in images]
+    num_relevant, num_found = 0, 0
+    for (hash_1, img_1), (hash_2, img_2) in combinations(zip(hashes, images), 2):
+        if img_1.size != img_2.size:
+            continue
+        maybe, confirmed, _ = engine.compare_images(img_1, img_2)
+        if confirmed > 0 or maybe == engine.num_comparers:
+            num_relevant += 1
+            num_found += hamming_distance(hash_1, hash_2) <= radius
+    recall = num_found / num_relevant if num_relevant else 1.0
+    logger.info(f"Hash prefilter recall within radius {radius}: {recall:.3f} ({num_relevant} pairs)")
+    return recall, num_relevant
@@ -1,44 +1,149 @@
 import json
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import NamedTuple, Tuple, Optional, Dict
-from types import SimpleNamespace
+from collections import defaultdict
+from io import BytesIO
+from typing import Tuple, Optional, Dict, List
 
 import numpy as np
-from PIL.Image import Image
-from skimage import img_as_float
-from skimage.metrics import structural_similarity
+from django.db.models import Q
+from PIL.Image import BOX, Image, fromarray, open as open_image
+from skimage import img_as_float32
 
+from flat_crawler.constants import IMAGE_COMPARERS_BACKEND, IMAGE_DATA_CACHE_MB, THUMBNAIL_IMG_POS
 from flat_crawler.models import FlatPost, ImageMatch
+from flat_crawler.utils.compute_backends import NumpyBackend, get_backend, ssim_many
+from flat_crawler.utils.db_writer import get_db_writer
+from flat_crawler.utils.img_data_cache import ImageDataCache
+from flat_crawler.utils.parallel_matching import ParallelScorer
+from flat_crawler.utils.pixel_stats import CHANNEL_HIST, color_hist_spec, get_channel_moments
 
 logger = logging.getLogger(__name__)
 
 COLOR_MAX = 255
+# Size of grayscale images scored first in pyramid mode, see BaseComparer.score_many
+COARSE_SIZE = (19, 13)
+
+
+class FlatPostImage(object):
+    """ Image of a post, given either as an image or as its encoded bytes.
+
+    Bytes are opened on first access to image, which only parses the header. Pixels
+    are decoded when features are computed, i.e. on a miss of the engine feature cache.
+    """
+    __slots__ = ('flat_post', 'img_pos', 'img_coarse', '_image', '_img_bytes')
+
+    def __init__(
+        self,
+        flat_post: FlatPost,
+        image: Optional[Image] = None,
+        img_pos: int = THUMBNAIL_IMG_POS,
+        img_bytes: Optional[bytes] = None,
+        img_coarse: Optional[np.array] = None,
+    ):
+        """
+        Args:
+            img_coarse: Coarse image computed when the post was crawled, see get_img_coarse.
+        """
+        assert image is not None or img_bytes is not None, "Image or its bytes are required"
+        self.flat_post = flat_post
+        # position of image on photos_bytes list, THUMBNAIL_IMG_POS means it is thumbnail
+        self.img_pos = img_pos
+        self.img_coarse = img_coarse
+        self._image = image
+        self._img_bytes = img_bytes
 
-
-class FlatPostImage(NamedTuple):
-    flat_post: FlatPost
-    image: Image
-    # position of image on photos_bytes list
-    img_pos: Optional[int] = None # none means it is thumbnail
-
-
-class ImageData(SimpleNamespace):
-    size: Optional[int] = None
-    img_arr: Optional[np.array] = None
-    img_arr_norm: Optional[np.array] = None
-    img_as_float: Optional[np.array] = None
-    img_arr_mean: Optional[np.array] = None
-    img_arr_std: Optional[np.array] = None
-    hist_norm: Optional[np.array] = None
-    hist_std: Optional[float] = None
-
+    @property
+    def image(self) -> Image:
+        if self._image is None:
+            self._image = open_image(BytesIO(self._img_bytes))
+        return self._image
+
+
+class ImageData(object):
+    """ Image features shared by comparers.
+
+    img_arr is (num pixels, channels) uint8 view of the image, derived features are float32.
+    """
+    __slots__ = (
+        'size',
+        'img_arr',
+        'img_as_float',
+        'img_arr_mean',
+        'img_arr_std',
+        'hist_norm',
+        'hist_std',
+        # stacked features, see BaseComparer.stack
+        'hist_centered',
+        'img_arr_centered',
+        # (height, width) float32 grayscale image of COARSE_SIZE
+        'img_coarse',
+        # statistics shared by comparers while features are computed, see get_pixel_stats
+        'pixel_stats',
+    )
+
+    def __init__(self, **features):
+        for name in self.__slots__:
+            setattr(self, name, features.pop(name, None))
+        if features:
+            raise TypeError(f"Unknown ImageData features: {', '.join(features)}")
+
+    def arrays(self) -> List[np.array]:
+        values = (getattr(self, name) for name in self.__slots__)
+        return [value for value in values if isinstance(value, np.ndarray)]
+
+
+def _add_img_arr(img_data: ImageData, image: Image) -> ImageData:
+    """ Pixels straight from the PIL buffer, computed once for all comparers. """
+    if img_data.img_arr is None:
+        width, height = image.size
+        img_data.img_arr = np.asarray(image).reshape(width * height, -1)
+    return img_data
+
+
+def get_img_coarse(image: Image) -> np.array:
+    """ Heavily downsampled grayscale uint8 image. """
+    return np.asarray(image.convert('L').resize(COARSE_SIZE, BOX))
+
+
+def _add_img_coarse(img_data: ImageData, image: Image) -> ImageData:
+    """ Coarse image as float, computed once for all comparers. """
+    if img_data.img_coarse is None:
+        img_data.img_coarse = get_img_coarse(image).astype(np.float32) / COLOR_MAX
+    return img_data
 
 
 class BaseComparer(ABC):
     COMPARER_ID = None
     FIRST_THRESHOLD = None
     CONFIDENT_THRESHOLD = None
+    # Score below which images are surely different, used by the cascade mode.
+    REJECT_THRESHOLD = None
+    # Bump when add_image_data changes, so stored features get recomputed.
+    VERSION = 2
+    # ImageData attributes set by add_image_data, persisted in the feature store. Only compact
+    # ones, pixel arrays are many times larger than the JPEG they are decoded from.
+    FEATURES = ()
+    # ImageData attributes set by add_pixel_data, recomputed from the image instead of stored.
+    PIXEL_FEATURES = ()
+    # Features stacked by stack(), set by comparers with vectorized score_many.
+    STACKED_FEATURES = ()
+    # Pixel statistics used by add_image_data, gathered in a single pass for all comparers.
+    PIXEL_STATS = ()
+    # Set by comparers supporting pyramid mode, pairs with coarse score below it are rejected
+    # without the full resolution score. Not above REJECT_THRESHOLD, so the coarse score
+    # rejects the pair in the cascade as well.
+    COARSE_REJECT_THRESHOLD = None
+
+    def __init__(self, backend: Optional[NumpyBackend] = None, pyramid: bool = False, **kwargs):
+        """
+        Args:
+            backend: Compute backend, see compute_backends. Defaults to IMAGE_COMPARERS_BACKEND.
+            pyramid: Score pairs on coarse images first, see score_many.
+        """
+        self._backend = backend or get_backend(IMAGE_COMPARERS_BACKEND)
+        self._pyramid = pyramid
 
     @abstractmethod
     def get_match_score(img1: ImageData, img2: ImageData):
@@ -48,85 +153,195 @@ class BaseComparer(ABC):
     def add_image_data(img_data: ImageData, image: Image) -> ImageData:
         pass
 
+    def add_pixel_data(self, img_data: ImageData, image: Image) -> ImageData:
+        """ Sets PIXEL_FEATURES, e.g. of features loaded from the store. """
+        return img_data
+
+    @property
+    def feature_key(self) -> str:
+        """ Identifies features computed by this comparer, e.g. SimpleHistComparer:v1:bins=20 """
+        params = ','.join(f"{name}={val}" for name, val in sorted(self._get_params().items()))
+        return f"{self.COMPARER_ID}:v{self.VERSION}:{params}"
+
+    def dump_features(self, img_data: ImageData) -> Dict[str, np.array]:
+        return {name: np.asarray(getattr(img_data, name)) for name in self.FEATURES}
+
+    def load_features(self, img_data: ImageData, features: Dict[str, np.array]) -> ImageData:
+        for name in self.FEATURES:
+            value = features[name]
+            setattr(img_data, name, value.item() if value.ndim == 0 else value)
+        return img_data
+
+    def stack(self, img_datas: List[ImageData]):
+        """ Stacks features of images, to score them at once with score_many. """
+        if not self.STACKED_FEATURES:
+            return list(img_datas)
+        return ImageData(**{
+            name: np.stack([self._get_stacked_feature(img_data, name) for img_data in img_datas])
+            for name in self.STACKED_FEATURES
+        })
+
+    def take(self, stacked, indices: np.array):
+        """ Selects images with given indices from stacked features. """
+        if not self.STACKED_FEATURES:
+            return [stacked[ind] for ind in indices]
+        return ImageData(**{name: getattr(stacked, name)[indices] for name in self.STACKED_FEATURES})
+
+    def score_many(self, query: ImageData, stacked) -> np.array:
+        """ Returns match scores of query image with each of the stacked images.
+
+        In pyramid mode pairs are scored on coarse images first, and only pairs scoring
+        at least COARSE_REJECT_THRESHOLD get the full resolution score.
+        """
+        if not self._pyramid or self.COARSE_REJECT_THRESHOLD is None:
+            return self._score_many(query, stacked)
+        scores = self._score_coarse_many(query, stacked).astype(np.float64)
+        survivors = np.flatnonzero(scores >= self.COARSE_REJECT_THRESHOLD)
+        if len(survivors) > 0:
+            scores[survivors] = self._score_many(query, self.take(stacked, survivors))
+        return scores
+
+    def _score_many(self, query: ImageData, stacked) -> np.array:
+        return np.array([self.get_match_score(query, img_data) for img_data in stacked])
+
+    def _score_coarse_many(self, query: ImageData, stacked) -> np.array:
+        raise NotImplementedError
+
+    def get_pixel_stats_specs(self) -> Tuple:
+        return self.PIXEL_STATS
+
+    def _get_stacked_feature(self, img_data: ImageData, name: str) -> np.array:
+        return getattr(img_data, name)
+
+    def _get_pixel_stat(self, img_data: ImageData, spec: Tuple) -> np.array:
+        """ Statistic gathered by the engine, computed for this comparer alone if missing. """
+        if img_data.pixel_stats is None or spec not in img_data.pixel_stats:
+            img_data.pixel_stats = {
+                **(img_data.pixel_stats or {}), **self._backend.get_pixel_stats(img_data.img_arr, [spec])
+            }
+        return img_data.pixel_stats[spec]
+
+    def _get_params(self) -> Dict:
+        return {}
+
 
 class SimpleHistComparer(BaseComparer):
     COMPARER_ID = 'SimpleHistComparer'
     FIRST_THRESHOLD = 0.9
     CONFIDENT_THRESHOLD = 0.95
+    REJECT_THRESHOLD = 0.5
     DEFAULT_BINS = 20
+    FEATURES = ('hist_norm', 'hist_std')
+    STACKED_FEATURES = ('hist_norm', 'hist_std')
+    PIXEL_STATS = (CHANNEL_HIST, )
 
     def __init__(self, bins=None, **kwargs):
+        super().__init__(**kwargs)
         self._bins = bins or self.DEFAULT_BINS
+        # Bin of each 8-bit value, same as np.histogram with range (0, 255)
+        edges = np.linspace(0, COLOR_MAX, self._bins + 1)
+        self._value_bins = np.minimum(
+            np.searchsorted(edges, np.arange(COLOR_MAX + 1), side='right') - 1, self._bins - 1
+        )
 
-    def _get_norm_hist(self, arr: np.array, c_ind: int) -> np.array:
-        h = np.histogram(arr[..., c_ind], bins=self._bins, density=True, range=(0, 255))[0]
-        return h / np.sum(h)
+    def _get_params(self) -> Dict:
+        return {'bins': self._bins}
 
-    def _get_hist(self, arr: np.array) -> np.array:
-        return np.array([self._get_norm_hist(arr, i) for i in range(3)]).T
+    def _get_hist(self, channel_hist: np.array) -> np.array:
+        """ Normalized histogram of each of 3 channels, shape (bins, 3). """
+        hist = np.stack([
+            np.bincount(self._value_bins, weights=channel_hist[c_ind], minlength=self._bins) for c_ind in range(3)
+        ], axis=1)
+        # Contiguous, so scores don't depend on where features come from (store, shared memory)
+        return np.ascontiguousarray(hist / np.sum(hist, axis=0), dtype=np.float32)
 
     def add_image_data(self, img_data: ImageData, image: Image) -> ImageData:
-        if img_data.img_arr is None:
-            img_data.img_arr = np.array(image.getdata())
-        hist = self._get_hist(arr=img_data.img_arr)
+        img_data = _add_img_arr(img_data, image)
+        hist = self._get_hist(channel_hist=self._get_pixel_stat(img_data, CHANNEL_HIST))
         img_data.hist_norm = hist - np.mean(hist, axis=0)
         img_data.hist_std = np.std(hist, axis=0)
         return img_data
 
     def get_match_score(self, img1: ImageData, img2: ImageData) -> float:
         """ Computes cross correlation between image histograms. """
-        denom = self._bins * img1.hist_std * img2.hist_std
-        scores = np.sum(img1.hist_norm * img2.hist_norm, axis=0) / denom
-        return min(scores)
+        return min(self._backend.hist_correlation(img1.hist_norm, img2.hist_norm))
+
+    def _score_many(self, query: ImageData, stacked: ImageData) -> np.array:
+        denom = self._bins * query.hist_std * stacked.hist_std
+        scores = np.einsum('bc,kbc->kc', query.hist_norm, stacked.hist_norm) / denom
+        return np.min(scores, axis=1)
 
 
 class HistComparer(BaseComparer):
     COMPARER_ID = 'HistComparer'
     FIRST_THRESHOLD = 0.9
     CONFIDENT_THRESHOLD = 0.95
+    REJECT_THRESHOLD = 0.5
+    FEATURES = ('hist_norm', 'hist_std')
+    STACKED_FEATURES = ('hist_centered', 'hist_std')
 
     def __init__(self, color_bins=6, **kwargs):
+        super().__init__(**kwargs)
         self._cbins =  color_bins
-        self._cbins2 =  color_bins ** 2
         self._cbins3 = color_bins ** 3
-        self._bin_div = (COLOR_MAX / color_bins) + 0.0001
         self._hist_len = color_bins ** 3
 
-    def _get_hist(self, image_arr: np.array) -> np.array:
-        arr = (image_arr / self._bin_div).astype(int)
-        col_arr = arr[..., 0] + arr[..., 1] * self._cbins + arr[..., 2] * self._cbins2
-        return np.histogram(col_arr, bins=self._cbins3, range=(0, self._cbins3 - 1))[0]
+    def _get_params(self) -> Dict:
+        return {'color_bins': self._cbins}
+
+    def get_pixel_stats_specs(self) -> Tuple:
+        return (color_hist_spec(self._cbins), )
 
     def add_image_data(self, img_data: ImageData, image: Image) -> ImageData:
-        if img_data.img_arr is None:
-            img_data.img_arr = np.array(image.getdata())
-        hist = self._get_hist(image_arr=img_data.img_arr)
+        img_data = _add_img_arr(img_data, image)
+        hist = self._get_pixel_stat(img_data, color_hist_spec(self._cbins)).astype(np.float32)
         img_data.hist_norm = hist / np.sum(hist)
         img_data.hist_std = np.std(img_data.hist_norm)
         return img_data
 
     def get_match_score(self, img1: ImageData, img2: ImageData) -> float:
         """ Computes cross correlation between image histograms. """
-        # (hist length - 1) * std1 * std2
-        denom = (self._cbins3 - 1) * img1.hist_std * img2.hist_std
-        return np.sum(
-            (img1.hist_norm - np.mean(img1.hist_norm)) * (img2.hist_norm - np.mean(img2.hist_norm))) / denom
+        # Normalized by (hist length - 1) * std1 * std2, as in score_many
+        correlation = self._backend.hist_correlation(img1.hist_norm, img2.hist_norm)
+        return correlation * self._cbins3 / (self._cbins3 - 1)
+
+    def _score_many(self, query: ImageData, stacked: ImageData) -> np.array:
+        denom = (self._cbins3 - 1) * query.hist_std * stacked.hist_std
+        return stacked.hist_centered @ (query.hist_norm - np.mean(query.hist_norm)) / denom
+
+    def _get_stacked_feature(self, img_data: ImageData, name: str) -> np.array:
+        if name == 'hist_centered':
+            return img_data.hist_norm - np.mean(img_data.hist_norm)
+        return super()._get_stacked_feature(img_data, name)
 
 
 class StructSimComparer(BaseComparer):
     COMPARER_ID = 'SsimComparer'
     FIRST_THRESHOLD = 0.5
     CONFIDENT_THRESHOLD = 0.9
+    REJECT_THRESHOLD = 0.3
+    # Lowest coarse score of pairs scoring at least REJECT_THRESHOLD on benchmark_matching corpus is 0.27
+    COARSE_REJECT_THRESHOLD = 0.2
+    VERSION = 4
+    PIXEL_FEATURES = ('img_arr', 'img_as_float', 'img_coarse')
 
     def add_image_data(self, img_data: ImageData, image: Image) -> ImageData:
-        img_data.img_arr = np.array(image.getdata())
+        return self.add_pixel_data(img_data, image)
+
+    def add_pixel_data(self, img_data: ImageData, image: Image) -> ImageData:
+        img_data = _add_img_arr(img_data, image)
+        img_data = _add_img_coarse(img_data, image)
         if img_data.img_as_float is None:
-            img_data.img_as_float = img_as_float(image)
+            width, height = image.size
+            img_data.img_as_float = img_as_float32(img_data.img_arr.reshape(height, width, -1))
         return img_data
 
+    def _score_coarse_many(self, query: ImageData, stacked: List[ImageData]) -> np.array:
+        return ssim_many(query.img_coarse, np.stack([img_data.img_coarse for img_data in stacked]))
+
     def get_match_score(self, img1: ImageData, img2: ImageData) -> float:
         try:
-            return structural_similarity(img1.img_as_float, img2.img_as_float, multichannel=True)
+            return self._backend.ssim(img1.img_as_float, img2.img_as_float)
         except ValueError as exc:
             logger.error(
                 f"Error in SsimComparer:\n"
@@ -140,15 +355,26 @@ class CrossCorrComparer(BaseComparer):
     COMPARER_ID = 'CrossCorrComparer'
     FIRST_THRESHOLD = 0.6
     CONFIDENT_THRESHOLD = 0.9
+    REJECT_THRESHOLD = 0.3
+    # Lowest coarse score of pairs scoring at least REJECT_THRESHOLD on benchmark_matching corpus is 0.49
+    COARSE_REJECT_THRESHOLD = 0.3
+    VERSION = 4
+    FEATURES = ('size', 'img_arr_mean', 'img_arr_std')
+    PIXEL_FEATURES = ('img_arr', 'img_coarse')
+    STACKED_FEATURES = ('img_arr_centered', 'img_arr_std', 'img_coarse')
+    PIXEL_STATS = (CHANNEL_HIST, )
 
     def add_image_data(self, img_data: ImageData, image: Image) -> ImageData:
-        if img_data.img_arr is None:
-            img_data.img_arr = np.array(image.getdata())
+        img_data = self.add_pixel_data(img_data, image)
         img_data.size = len(img_data.img_arr)
-        img_data.img_arr_mean = np.mean(img_data.img_arr, axis=0)
-        img_data.img_arr_std = np.std(img_data.img_arr, axis=0)
+        img_data.img_arr_mean, img_data.img_arr_std = get_channel_moments(
+            self._get_pixel_stat(img_data, CHANNEL_HIST)
+        )
         return img_data
 
+    def add_pixel_data(self, img_data: ImageData, image: Image) -> ImageData:
+        return _add_img_coarse(_add_img_arr(img_data, image), image)
+
     def get_match_score(self, img1: ImageData, img2: ImageData) -> float:
         try:
             denom = (img1.size - 1) * img1.img_arr_std * img2.img_arr_std
@@ -157,11 +383,73 @@ class CrossCorrComparer(BaseComparer):
         except ValueError as exc:
             logger.error(
                 f"Error in CrossCorrComparer:\n"
-                f"\timg1_arr_norm.shape {img1.img_arr_norm.shape}\n"
-                f"\timg2_arr_norm.shape {img2.img_arr_norm.shape}\n"
+                f"\timg1_arr.shape {img1.img_arr.shape}\n"
+                f"\timg2_arr.shape {img2.img_arr.shape}\n"
             )
             raise
 
+    def _score_many(self, query: ImageData, stacked: ImageData) -> np.array:
+        denom = (query.size - 1) * query.img_arr_std * stacked.img_arr_std
+        scores = np.einsum(
+            'nc,knc->kc', query.img_arr - query.img_arr_mean, stacked.img_arr_centered
+        ) / denom
+        return np.min(scores, axis=1)
+
+    def _score_coarse_many(self, query: ImageData, stacked: ImageData) -> np.array:
+        """ Correlation of coarse grayscale images. """
+        query_centered = (query.img_coarse - np.mean(query.img_coarse)).ravel()
+        stacked_coarse = stacked.img_coarse.reshape(len(stacked.img_coarse), -1)
+        stacked_centered = stacked_coarse - np.mean(stacked_coarse, axis=1, keepdims=True)
+        denom = np.linalg.norm(query_centered) * np.linalg.norm(stacked_centered, axis=1)
+        return stacked_centered @ query_centered / denom
+
+    def _get_stacked_feature(self, img_data: ImageData, name: str) -> np.array:
+        if name == 'img_arr_centered':
+            return img_data.img_arr - img_data.img_arr_mean
+        return super()._get_stacked_feature(img_data, name)
+
+
+def _get_match_key(match: ImageMatch) -> Tuple:
+    return match.post_1_id, match.img_pos_1, match.post_2_id, match.img_pos_2
+
+
+class ComparerStats(object):
+    """ Runtime cost and rejection rate of a comparer, for ordering of the cascade. """
+
+    def __init__(self):
+        self.num_pairs = 0
+        self.num_rejected = 0
+        self.seconds = 0.0
+
+    def add(self, num_pairs: int, num_rejected: int, seconds: float) -> None:
+        self.num_pairs += num_pairs
+        self.num_rejected += num_rejected
+        self.seconds += seconds
+
+    @property
+    def cost_per_pair(self) -> float:
+        return self.seconds / self.num_pairs if self.num_pairs else 0.0
+
+    @property
+    def rejection_rate(self) -> float:
+        # Smoothed, so comparers without stats are not ruled out
+        return (self.num_rejected + 1) / (self.num_pairs + 2)
+
+    @property
+    def expected_cost_to_reject(self) -> float:
+        return self.cost_per_pair / self.rejection_rate
+
+    def to_tuple(self) -> Tuple[int, int, float]:
+        """ Arguments of add() """
+        return self.num_pairs, self.num_rejected, self.seconds
+
+    def to_dict(self) -> Dict:
+        return {
+            'num_pairs': self.num_pairs,
+            'num_rejected': self.num_rejected,
+            'ms_per_pair': round(1000 * self.cost_per_pair, 4),
+        }
+
 
 class ImageMatchingEngine(object):
 
@@ -171,15 +459,129 @@ class ImageMatchingEngine(object):
         StructSimComparer,
     ]
 
-    def __init__(self, stop_early: bool = False):
-        self._comparers = [Comparer() for Comparer in self.COMPARERS]
-        self._image_data_dict = dict()
+    def __init__(
+        self,
+        stop_early: bool = False,
+        feature_store=None,
+        image_atlas=None,
+        cache_mb: Optional[float] = IMAGE_DATA_CACHE_MB,
+        cascade: bool = False,
+        num_workers: Optional[int] = None,
+        backend: str = IMAGE_COMPARERS_BACKEND,
+        pyramid: bool = False,
+    ):
+        """
+        Args:
+            stop_early: Pair doesn't match if any comparer scores it below FIRST_THRESHOLD.
+            feature_store: ImageFeatureStore persisting image features between runs.
+                If None, features are kept only in memory.
+            image_atlas: ImageAtlas with decoded images. Images missing from it are added.
+            cache_mb: Memory budget of cached image features, None means unbounded.
+            cascade: Run comparers in order of expected cost to reject a pair, measured at
+                runtime, and stop on a rejection (score below REJECT_THRESHOLD, or
+                FIRST_THRESHOLD with stop_early). Pairs that are not rejected get the same
+                result as without cascade.
+            num_workers: Size of the process pool scoring candidates in parallel, see
+                get_image_matches_many. None scores in this process.
+            backend: Name of compute backend of the comparers, see compute_backends.
+            pyramid: Comparers reject pairs by scores of coarse images, before computing
+                full resolution scores, see BaseComparer.score_many. Only with stop_early
+                or cascade, which drop scores of rejected pairs, otherwise all scores end
+                up in ImageMatch details and have to be full resolution ones.
+        """
+        self._backend = get_backend(backend)
+        pyramid = pyramid and (stop_early or cascade)
+        self._comparers = [Comparer(backend=self._backend, pyramid=pyramid) for Comparer in self.COMPARERS]
+        self._pixel_stats_specs = set().union(*(comparer.get_pixel_stats_specs() for comparer in self._comparers))
+        self._comparer_stats = [ComparerStats() for _ in self._comparers]
+        self._cascade = cascade
+        self._parallel_scorer = None
+        if num_workers is not None and num_workers > 1:
+            self._parallel_scorer = ParallelScorer(
+                num_workers=num_workers,
+                engine_kwargs={
+                    'stop_early': stop_early,
+                    'cascade': cascade,
+                    'cache_mb': None,
+                    'backend': backend,
+                    'pyramid': pyramid,
+                },
+            )
+        # Number of image pairs scored by _get_comparers_info_many
+        self._num_pairs = 0
+        self._image_data_cache = ImageDataCache(
+            max_mb=cache_mb, on_evict=self._on_post_evicted
+        )
         self._stop_early = stop_early
+        self._feature_store = feature_store
+        self._image_atlas = image_atlas
+        # Posts whose stored features were already loaded to _image_data_cache
+        self._posts_loaded_from_store = set()
+        # post id -> img_pos -> (size, mode), see _get_image_info
+        self._image_infos = {}
+        # See preload_image_matches
+        self._preloaded_matches = {}
+        self._preloaded_post_pairs = set()
+        self._pending_matches = []
 
     @property
     def num_comparers(self) -> int:
         return len(self.COMPARERS)
 
+    @property
+    def cache_stats(self) -> Dict:
+        return self._image_data_cache.stats
+
+    @property
+    def comparer_stats(self) -> List[ComparerStats]:
+        return self._comparer_stats
+
+    @property
+    def cascade_stats(self) -> Dict:
+        """ Number of pairs scored, and cost and rejections of each comparer. """
+        return {
+            'num_pairs': self._num_pairs,
+            'comparers': {
+                comparer.COMPARER_ID: stats.to_dict()
+                for comparer, stats in zip(self._comparers, self._comparer_stats)
+            },
+        }
+
+    def pin_post(self, flat_post_id: str) -> None:
+        """ Keeps features of the post cached while its candidates are matched. """
+        self._image_data_cache.pin_post(flat_post_id)
+
+    def preload_image_matches(self, flat_post_id: str, candidate_ids: List[str]) -> None:
+        """ Loads saved ImageMatch-es of the post with its candidates in a single query.
+
+        Until flush_image_matches, saved matches of these posts are looked up in memory
+        and new ones are buffered.
+        """
+        image_matches = ImageMatch.objects.filter(
+            Q(post_1=flat_post_id, post_2__in=candidate_ids) |
+            Q(post_2=flat_post_id, post_1__in=candidate_ids)
+        )
+        for match in image_matches:
+            key = _get_match_key(match)
+            assert key not in self._preloaded_matches, (
+                f"Multiple ImageMatch objects for the same image pair: {key}"
+            )
+            self._preloaded_matches[key] = match
+        for candidate_id in candidate_ids:
+            self._preloaded_post_pairs.add(
+                (min(flat_post_id, candidate_id), max(flat_post_id, candidate_id))
+            )
+
+    def flush_image_matches(self) -> None:
+        """ Saves buffered matches with a single bulk_create and drops preloaded ones. """
+        if self._pending_matches:
+            get_db_writer().run(
+                ImageMatch.objects.bulk_create, self._pending_matches, ignore_conflicts=True
+            )
+        self._pending_matches = []
+        self._preloaded_matches = {}
+        self._preloaded_post_pairs = set()
+
     def get_image_match(
         self, fp_image_1: FlatPostImage, fp_image_2: FlatPostImage, dry: bool = False
     ) -> Optional[ImageMatch]:
@@ -188,42 +590,163 @@ class ImageMatchingEngine(object):
             dry: If true, don't save ImageMatch objects.
         Returns: ImageMatch object if there's a match, None otherwise.
         """
-        if self._imgs_not_comparable(fp_image_1.image, fp_image_2.image):
-            return None
-        if not dry:
-            assert fp_image_1.flat_post != fp_image_2.flat_post, (
-                "Don't try to compare images from the same flat. If you really want to do it, "
-                "set dry=True (dry run doesn't save any objects"
-            )
+        return self.get_image_matches([fp_image_1], [fp_image_2], dry=dry)[0]
+
+    def get_image_matches(
+        self,
+        fp_images_1: List[FlatPostImage],
+        fp_images_2: List[FlatPostImage],
+        dry: bool = False,
+        pairs: Optional[List[Tuple[int, int]]] = None,
+    ) -> List[Optional[ImageMatch]]:
+        """ get_image_match for every pair of images from the two lists.
+
+        Features of fp_images_2 are stacked once and each image of fp_images_1
+        is scored against all of them with a single call of each comparer.
+        Args:
+            pairs: (index in fp_images_1, index in fp_images_2) pairs to compare,
+                all pairs if None.
+        Returns: ImageMatch or None for every pair, in order of pairs.
+        """
+        return self.get_image_matches_many(fp_images_1, [fp_images_2], dry=dry, cands_pairs=[pairs])[0]
+
+    def get_image_matches_many(
+        self,
+        fp_images_1: List[FlatPostImage],
+        cands_fp_images: List[List[FlatPostImage]],
+        dry: bool = False,
+        cands_pairs: Optional[List[Optional[List[Tuple[int, int]]]]] = None,
+    ) -> List[List[Optional[ImageMatch]]]:
+        """ get_image_matches of fp_images_1 with images of each candidate.
+
+        With num_workers, candidates are scored in parallel by the process pool.
+        Features are computed, and matches looked up and saved, in this process.
+        """
+        if cands_pairs is None:
+            cands_pairs = [None] * len(cands_fp_images)
+        plans = [
+            self._plan_image_matches(fp_images_1, fp_images_2, dry=dry, pairs=pairs)
+            for fp_images_2, pairs in zip(cands_fp_images, cands_pairs)
+        ]
+        to_score = [
+            (cand_ind, self._get_scoring_input(fp_images_1, cands_fp_images[cand_ind], to_compare))
+            for cand_ind, (_, _, to_compare) in enumerate(plans) if to_compare
+        ]
+        if self._parallel_scorer is not None and len(to_score) > 1:
+            results = self._parallel_scorer.score([scoring_input for _, scoring_input in to_score])
+            for _, stats_delta in results:
+                for stats, delta in zip(self._comparer_stats, stats_delta):
+                    stats.add(*delta)
+            scores = [cand_scores for cand_scores, _ in results]
+            self._num_pairs += sum(len(cand_scores) for cand_scores in scores)
+        else:
+            scores = [
+                self._score_candidate(fp_images_1, cands_fp_images[cand_ind], scoring_input)
+                for cand_ind, scoring_input in to_score
+            ]
+
+        for (cand_ind, _), cand_scores in zip(to_score, scores):
+            _, matches, _ = plans[cand_ind]
+            for (ind_1, ind_2), comparers_info in cand_scores.items():
+                match = self._create_image_match(
+                    fp_images_1[ind_1], cands_fp_images[cand_ind][ind_2], *comparers_info
+                )
+                if not dry and match is not None:
+                    self._save_image_match(match)
+                matches[ind_1, ind_2] = match
+        return [[matches[pair] for pair in pairs] for pairs, matches, _ in plans]
 
-        # Keep order to avoid saving the same matching twice
-        if fp_image_1.flat_post.id > fp_image_2.flat_post.id:
-            fp_image_1, fp_image_2 = fp_image_2, fp_image_1
+    def score_image_groups(
+        self, img_datas_1: Dict[int, ImageData], img_datas_2: Dict[int, ImageData], groups: List
+    ) -> Dict[Tuple[int, int], Tuple[int, int, Dict]]:
+        """ _get_comparers_info for pairs of images of a post and a candidate.
 
-        image_match_q = ImageMatch.objects.filter(
-            post_1=fp_image_1.flat_post,
-            img_pos_1=fp_image_1.img_pos,
-            post_2=fp_image_2.flat_post,
-            img_pos_2=fp_image_2.img_pos,
-        )
-        assert len(image_match_q) <= 1, (
-            f"Multiple ({len(image_match_q)}) ImageMatch objects for the same image pair: "
-            f"{fp_image_1.flat_post}:{fp_image_1.img_pos}-{fp_image_2.flat_post}:{fp_image_2.img_pos}"
-        )
-        match = image_match_q.first()
-        if match is None:
-            try:
-                match = self._get_image_match(fp_image_1, fp_image_2)
-            except Exception as exc:
-                logger.exception(
-                    f"Exception while matching images:\n"
-                    f"\t{fp_image_1.flat_post.id}:{fp_image_1.img_pos} - "
-                    f"{fp_image_2.flat_post.id}:{fp_image_2.img_pos}"
+        Doesn't touch the database, it's run by workers in parallel mode.
+        Args:
+            groups: (indices of images 2 of the same size, [(image 1 index, image 2 indices)]).
+                Images 2 of a group are stacked once.
+        Returns: Comparers info of each pair of images.
+        """
+        results = {}
+        for stacked_inds_2, queries in groups:
+            img_datas = [img_datas_2[ind_2] for ind_2 in stacked_inds_2]
+            stacked = [comparer.stack(img_datas) for comparer in self._comparers]
+            for ind_1, inds_2 in queries:
+                comparers_infos = self._get_comparers_info_many(
+                    img_data_1=img_datas_1[ind_1],
+                    stacked=stacked,
+                    indices=np.searchsorted(stacked_inds_2, inds_2),
                 )
-                raise
-            if not dry and match is not None:
-                match.save()
-        return match
+                results.update(zip(((ind_1, ind_2) for ind_2 in inds_2), comparers_infos))
+        return results
+
+    def close(self) -> None:
+        if self._parallel_scorer is not None:
+            self._parallel_scorer.close()
+
+    def _plan_image_matches(
+        self,
+        fp_images_1: List[FlatPostImage],
+        fp_images_2: List[FlatPostImage],
+        dry: bool,
+        pairs: Optional[List[Tuple[int, int]]],
+    ) -> Tuple[List[Tuple[int, int]], Dict, Dict[int, List[int]]]:
+        """ Returns pairs, already known matches and img_2 indices to compare with each img_1. """
+        if pairs is None:
+            pairs = [(ind_1, ind_2) for ind_1 in range(len(fp_images_1)) for ind_2 in range(len(fp_images_2))]
+        matches = {}
+        # img_1 index -> indices of img_2 to compare with
+        to_compare = defaultdict(list)
+        for ind_1, ind_2 in pairs:
+            fp_image_1, fp_image_2 = fp_images_1[ind_1], fp_images_2[ind_2]
+            if self._infos_not_comparable(self._get_image_info(fp_image_1), self._get_image_info(fp_image_2)):
+                matches[ind_1, ind_2] = None
+                continue
+            if not dry:
+                assert fp_image_1.flat_post != fp_image_2.flat_post, (
+                    "Don't try to compare images from the same flat. If you really want to do it, "
+                    "set dry=True (dry run doesn't save any objects"
+                )
+            match = self._get_saved_image_match(fp_image_1, fp_image_2)
+            if match is None:
+                to_compare[ind_1].append(ind_2)
+            else:
+                matches[ind_1, ind_2] = match
+        return pairs, matches, to_compare
+
+    def _get_scoring_input(
+        self,
+        fp_images_1: List[FlatPostImage],
+        fp_images_2: List[FlatPostImage],
+        to_compare: Dict[int, List[int]],
+    ) -> Tuple[Dict, Dict, List]:
+        """ Arguments of score_image_groups. """
+        # Comparable images have the same size, stack them separately for each size.
+        groups_by_size = {}
+        for ind_2 in sorted(set().union(*to_compare.values())):
+            size, _ = self._get_image_info(fp_images_2[ind_2])
+            groups_by_size.setdefault(size, ([], []))[0].append(ind_2)
+        for ind_1, inds_2 in to_compare.items():
+            size, _ = self._get_image_info(fp_images_1[ind_1])
+            groups_by_size[size][1].append((ind_1, inds_2))
+        img_datas_1 = {ind_1: self._get_img_data(fp_images_1[ind_1]) for ind_1 in to_compare}
+        img_datas_2 = {
+            ind_2: self._get_img_data(fp_images_2[ind_2])
+            for stacked_inds_2, _ in groups_by_size.values() for ind_2 in stacked_inds_2
+        }
+        return img_datas_1, img_datas_2, list(groups_by_size.values())
+
+    def _score_candidate(
+        self, fp_images_1: List[FlatPostImage], fp_images_2: List[FlatPostImage], scoring_input: Tuple
+    ) -> Dict[Tuple[int, int], Tuple[int, int, Dict]]:
+        try:
+            return self.score_image_groups(*scoring_input)
+        except Exception as exc:
+            logger.exception(
+                f"Exception while matching images:\n"
+                f"\t{fp_images_1[0].flat_post.id} - {fp_images_2[0].flat_post.id}"
+            )
+            raise
 
     def compare_images(self, img_1: Image, img_2: Image) -> Tuple[int, int, Dict]:
         """ Returns (num_maybe_matched, num_confirmed, details_dict) for pair of images. """
@@ -233,25 +756,109 @@ class ImageMatchingEngine(object):
         img_data_2 = self._get_img_data_for_image(img_2)
         return self._get_comparers_info(img_data_1, img_data_2)
 
+    def are_comparable(self, fp_image_1: FlatPostImage, fp_image_2: FlatPostImage) -> bool:
+        return not self._infos_not_comparable(self._get_image_info(fp_image_1), self._get_image_info(fp_image_2))
+
     def _imgs_not_comparable(self, img_1: Image, img_2: Image) -> bool:
-        if img_1.size != img_2.size:
-            logger.warning(f"Image sizes differ. {img_1.size} vs {img_2.size}")
+        return self._infos_not_comparable((img_1.size, img_1.mode), (img_2.size, img_2.mode))
+
+    def _infos_not_comparable(self, info_1: Tuple, info_2: Tuple) -> bool:
+        (size_1, mode_1), (size_2, mode_2) = info_1, info_2
+        if size_1 != size_2:
+            logger.warning(f"Image sizes differ. {size_1} vs {size_2}")
             return True
-        if img_1.mode != 'RGB' or img_2.mode != 'RGB':
+        if mode_1 != 'RGB' or mode_2 != 'RGB':
             return True
         return False
 
-    def _get_img_data_for_image(self, img: Image) -> ImageData:
-        img_data = ImageData()
+    def _get_image_info(self, fp_image: FlatPostImage) -> Tuple[Tuple[int, int], str]:
+        """ Size and mode of the image, its bytes are opened once until features of the post are evicted. """
+        post_infos = self._image_infos.setdefault(fp_image.flat_post.id, {})
+        info = post_infos.get(fp_image.img_pos)
+        if info is None:
+            info = post_infos[fp_image.img_pos] = (fp_image.image.size, fp_image.image.mode)
+        return info
+
+    def _get_img_data_for_image(self, img: Image, img_coarse: Optional[np.array] = None) -> ImageData:
+        """
+        Args:
+            img_coarse: Precomputed uint8 coarse image, see get_img_coarse.
+        """
+        img_data = _add_img_arr(ImageData(), img)
+        if img_coarse is not None:
+            img_data.img_coarse = img_coarse.astype(np.float32) / COLOR_MAX
+        img_data.pixel_stats = self._backend.get_pixel_stats(img_data.img_arr, specs=self._pixel_stats_specs)
         for comparer in self._comparers:
             img_data = comparer.add_image_data(img_data=img_data, image=img)
+        # Needed only while features are computed
+        img_data.pixel_stats = None
+        return img_data
+
+    def _add_pixel_data(self, img_data: ImageData, img: Image, img_coarse: Optional[np.array] = None) -> ImageData:
+        """ Completes features loaded from the store with pixel features, see BaseComparer.PIXEL_FEATURES. """
+        if img_coarse is not None and img_data.img_coarse is None:
+            img_data.img_coarse = img_coarse.astype(np.float32) / COLOR_MAX
+        for comparer in self._comparers:
+            img_data = comparer.add_pixel_data(img_data=img_data, image=img)
         return img_data
 
+    def _has_pixel_data(self, img_data: ImageData) -> bool:
+        return all(
+            getattr(img_data, name) is not None for comparer in self._comparers for name in comparer.PIXEL_FEATURES
+        )
+
     def _get_img_data(self, fp_image: FlatPostImage):
-        img_id = self._get_image_id(flat_post_id=fp_image.flat_post.id, img_pos=fp_image.img_pos)
-        if not img_id in self._image_data_dict:
-            self._image_data_dict[img_id] = self._get_img_data_for_image(img=fp_image.image)
-        return self._image_data_dict[img_id]
+        post_id = fp_image.flat_post.id
+        img_id = self._get_image_id(flat_post_id=post_id, img_pos=fp_image.img_pos)
+        img_data = self._image_data_cache.get(img_id)
+        if img_data is None:
+            self._load_stored_img_data(flat_post_id=post_id)
+            img_data = self._image_data_cache.get(img_id)
+        if img_data is None:
+            img_data = self._get_img_data_for_image(img=self._get_image(fp_image), img_coarse=fp_image.img_coarse)
+            self._image_data_cache.put(img_id, post_id=post_id, img_data=img_data)
+            if self._feature_store is not None:
+                self._feature_store.save_img_data(
+                    flat_post_id=post_id,
+                    img_pos=fp_image.img_pos,
+                    img_data=img_data,
+                    comparers=self._comparers,
+                )
+        elif not self._has_pixel_data(img_data):
+            # Decoding the image is cheaper than storing its pixels
+            img_data = self._add_pixel_data(
+                img_data=img_data, img=self._get_image(fp_image), img_coarse=fp_image.img_coarse
+            )
+            self._image_data_cache.put(img_id, post_id=post_id, img_data=img_data)
+        return img_data
+
+    def _get_image(self, fp_image: FlatPostImage) -> Image:
+        """ Takes already decoded image from the atlas if possible. """
+        if self._image_atlas is None:
+            return fp_image.image
+        post_id, img_pos = fp_image.flat_post.id, fp_image.img_pos
+        img_arr = self._image_atlas.get(flat_post_id=post_id, img_pos=img_pos)
+        if img_arr is None:
+            self._image_atlas.add(flat_post_id=post_id, img_pos=img_pos, image=fp_image.image)
+            return fp_image.image
+        return fromarray(img_arr)
+
+    def _load_stored_img_data(self, flat_post_id: str) -> None:
+        """ Loads all stored features of the post with a single query. """
+        if self._feature_store is None or flat_post_id in self._posts_loaded_from_store:
+            return
+        self._posts_loaded_from_store.add(flat_post_id)
+        stored = self._feature_store.load_post_img_data(
+            flat_post_id=flat_post_id, comparers=self._comparers
+        )
+        for img_pos, img_data in stored.items():
+            img_id = self._get_image_id(flat_post_id=flat_post_id, img_pos=img_pos)
+            self._image_data_cache.put(img_id, post_id=flat_post_id, img_data=img_data)
+
+    def _on_post_evicted(self, flat_post_id: str) -> None:
+        # Evicted features are loaded from the store again when needed.
+        self._posts_loaded_from_store.discard(flat_post_id)
+        self._image_infos.pop(flat_post_id, None)
 
     def _get_comparers_info(self, img_data_1: ImageData, img_data_2: ImageData):
         maybe_matched, confirmed = 0, 0
@@ -264,19 +871,119 @@ class ImageMatchingEngine(object):
                 maybe_matched += 1
             elif self._stop_early:
                 return 0, 0, {}
-            details_dict[comparer.COMPARER_ID] = match_score
+            details_dict[comparer.COMPARER_ID] = float(match_score)
         return maybe_matched, confirmed, details_dict
 
-    def _get_image_match(
+    def _get_comparers_info_many(
+        self, img_data_1: ImageData, stacked: List, indices: np.array
+    ) -> List[Tuple[int, int, Dict]]:
+        """ _get_comparers_info for img_data_1 and stacked images with given indices.
+
+        Args:
+            stacked: Stacked image features, for each comparer.
+        """
+        maybe_matched = np.zeros(len(indices), dtype=int)
+        confirmed = np.zeros(len(indices), dtype=int)
+        # Scores of each comparer, nan if pair was rejected before
+        scores_all = np.full((len(self._comparers), len(indices)), np.nan)
+        rejected = np.zeros(len(indices), dtype=bool)
+        # Positions of images still compared
+        compared = np.arange(len(indices))
+        self._num_pairs += len(indices)
+        for comp_ind in self._get_comparers_order():
+            if len(compared) == 0:
+                break
+            comparer, stats = self._comparers[comp_ind], self._comparer_stats[comp_ind]
+            start = time.perf_counter()
+            scores = comparer.score_many(img_data_1, comparer.take(stacked[comp_ind], indices[compared]))
+            is_confident = scores >= comparer.CONFIDENT_THRESHOLD
+            is_maybe = ~is_confident & (scores >= comparer.FIRST_THRESHOLD)
+            confirmed[compared[is_confident]] += 1
+            maybe_matched[compared[is_maybe]] += 1
+            scores_all[comp_ind, compared] = scores
+            is_rejected = scores < self._get_reject_threshold(comparer)
+            stats.add(
+                num_pairs=len(compared),
+                num_rejected=int(np.sum(is_rejected)),
+                seconds=time.perf_counter() - start,
+            )
+            if self._stop_early or self._cascade:
+                rejected[compared[is_rejected]] = True
+                compared = compared[~is_rejected]
+
+        results = []
+        for pos in range(len(indices)):
+            if rejected[pos]:
+                results.append((0, 0, {}))
+                continue
+            # Keep order of comparers in details regardless of the cascade order
+            details_dict = {
+                comparer.COMPARER_ID: float(scores_all[comp_ind, pos])
+                for comp_ind, comparer in enumerate(self._comparers)
+            }
+            results.append((int(maybe_matched[pos]), int(confirmed[pos]), details_dict))
+        return results
+
+    def _get_comparers_order(self) -> List[int]:
+        if not self._cascade:
+            return list(range(len(self._comparers)))
+        # Stable, comparers without stats keep order of COMPARERS
+        return sorted(
+            range(len(self._comparers)),
+            key=lambda comp_ind: self._comparer_stats[comp_ind].expected_cost_to_reject,
+        )
+
+    def _get_reject_threshold(self, comparer: BaseComparer) -> float:
+        return comparer.FIRST_THRESHOLD if self._stop_early else comparer.REJECT_THRESHOLD
+
+    def _get_saved_image_match(
         self, fp_image_1: FlatPostImage, fp_image_2: FlatPostImage
     ) -> Optional[ImageMatch]:
-        img_data_1, img_data_2 = self._get_img_data(fp_image_1), self._get_img_data(fp_image_2)
-        maybe_matched, confirmed, details_dict = self._get_comparers_info(img_data_1, img_data_2)
+        # Keep order to avoid saving the same matching twice
+        if fp_image_1.flat_post.id > fp_image_2.flat_post.id:
+            fp_image_1, fp_image_2 = fp_image_2, fp_image_1
+
+        post_id_1, post_id_2 = fp_image_1.flat_post.id, fp_image_2.flat_post.id
+        if (post_id_1, post_id_2) in self._preloaded_post_pairs:
+            return self._preloaded_matches.get(
+                (post_id_1, fp_image_1.img_pos, post_id_2, fp_image_2.img_pos)
+            )
 
+        image_matches = list(ImageMatch.objects.filter(
+            post_1=fp_image_1.flat_post,
+            img_pos_1=fp_image_1.img_pos,
+            post_2=fp_image_2.flat_post,
+            img_pos_2=fp_image_2.img_pos,
+        )[:2])
+        assert len(image_matches) <= 1, (
+            f"Multiple ImageMatch objects for the same image pair: "
+            f"{fp_image_1.flat_post}:{fp_image_1.img_pos}-{fp_image_2.flat_post}:{fp_image_2.img_pos}"
+        )
+        return image_matches[0] if image_matches else None
+
+    def _save_image_match(self, match: ImageMatch) -> None:
+        if (match.post_1_id, match.post_2_id) in self._preloaded_post_pairs:
+            self._preloaded_matches[_get_match_key(match)] = match
+            self._pending_matches.append(match)
+        else:
+            get_db_writer().save(match)
+
+    def _create_image_match(
+        self,
+        fp_image_1: FlatPostImage,
+        fp_image_2: FlatPostImage,
+        maybe_matched: int,
+        confirmed: int,
+        details_dict: Dict,
+    ) -> Optional[ImageMatch]:
         # none of the comparers suggested match
         if maybe_matched + confirmed == 0:
             return None
 
+        # Keep order to avoid saving the same matching twice
+        if fp_image_1.flat_post.id > fp_image_2.flat_post.id:
+            fp_image_1, fp_image_2 = fp_image_2, fp_image_1
+
         return ImageMatch(
             post_1=fp_image_1.flat_post,
             img_pos_1=fp_image_1.img_pos,
@@ -288,6 +995,6 @@ class ImageMatchingEngine(object):
             details_json=json.dumps(details_dict),
         )
 
-    def _get_image_id(self, flat_post_id: str, img_pos: Optional[int] = None) -> str:
-        pos_str = str(img_pos) if img_pos else 'T'
+    def _get_image_id(self, flat_post_id: str, img_pos: int = THUMBNAIL_IMG_POS) -> str:
+        pos_str = 'T' if img_pos == THUMBNAIL_IMG_POS else str(img_pos)
         return f"{flat_post_id}:{pos_str}"
@@ -30,24 +30,40 @@ def get_img_from_url(img_url, resize=THUMBNAIL_SIZE):
 
 def get_img_bytes_from_url(img_url: str, resize=THUMBNAIL_SIZE) -> bytes:
     img = get_img_from_url(img_url=img_url, resize=resize)
+    return img_to_bytes(img)
+
+
+def img_to_bytes(img: Image.Image) -> bytes:
     img_bytes = BytesIO()
     img.save(img_bytes, format="JPEG", optimize=True, quality=40)
     return img_bytes.getvalue()
 
 
-def img_urls_to_bytes(img_urls: List[str]) -> Optional[bytes]:
+def img_urls_to_bytes(img_urls: List[str], images: Optional[List[Image.Image]] = None) -> Optional[bytes]:
+    """
+    Args:
+        images: Filled with kept images decoded back from their JPEG bytes, i.e. as they
+            are read from the database, e.g. to compute their fingerprints.
+    """
     img_bytes_list = []
     for img_url in img_urls:
         try:
-            img_bytes = get_img_bytes_from_url(img_url=img_url)
+            img = get_img_from_url(img_url=img_url, resize=THUMBNAIL_SIZE)
+            img_bytes = img_to_bytes(img)
             img_bytes_list.append(img_bytes)
+            if images is not None:
+                images.append(Image.open(BytesIO(img_bytes)))
         except exceptions.URLFailedToLoadException as exc:
             logger.warning(f"loading image from {img_url} failed, do not add to img bytes.")
     if img_bytes_list:
         return IMG_BYTES_DELIM.join(img_bytes_list)
 
 
-def bytes_to_images(img_list_bytes: Optional[bytes]) -> List:
+def split_img_bytes(img_list_bytes: Optional[bytes]) -> List[bytes]:
     if img_list_bytes is None:
         return []
-    return [Image.open(BytesIO(bts)) for bts in img_list_bytes.split(IMG_BYTES_DELIM)]
+    return img_list_bytes.split(IMG_BYTES_DELIM)
+
+
+def bytes_to_images(img_list_bytes: Optional[bytes]) -> List:
+    return [Image.open(BytesIO(bts)) for bts in split_img_bytes(img_list_bytes)]
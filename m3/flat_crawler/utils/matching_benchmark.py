@@ -0,0 +1,283 @@
+import random
+import time
+from collections import Counter
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from flat_crawler.constants import THUMBNAIL_SIZE
+from flat_crawler.utils.compute_backends import BACKENDS, get_backend
+from flat_crawler.models import FlatPost, ImageMatch
+from flat_crawler.utils.flat_post_matcher import ImageMatcher
+from flat_crawler.utils.img_matching import FlatPostImage, ImageData, ImageMatchingEngine, _add_img_arr
+from flat_crawler.utils.img_utils import IMG_BYTES_DELIM
+from flat_crawler.utils.pixel_stats import get_pixel_stats
+
+TEST_IMAGES_DIR = Path('static/test_data/images')
+# Source images showing the same photo, see utils/test_img_matching.py
+SAME_PHOTOS = [('img_0_a', 'img_0_b'), ('img_1_a', 'img_1_b')]
+
+
+class SyntheticImage(NamedTuple):
+    # Images with the same photo_id should match
+    photo_id: str
+    # original, crop, logo or brightness
+    kind: str
+    image: Image.Image
+
+
+def _crop(image: Image.Image, rnd: random.Random) -> Image.Image:
+    width, height = image.size
+    ratio = rnd.uniform(0.05, 0.15)
+    left, top = int(rnd.uniform(0, ratio) * width), int(rnd.uniform(0, ratio) * height)
+    box = (left, top, left + int((1 - ratio) * width), top + int((1 - ratio) * height))
+    return image.crop(box).resize(image.size, Image.ANTIALIAS)
+
+
+def _add_logo(image: Image.Image, rnd: random.Random) -> Image.Image:
+    image = image.copy()
+    width, height = image.size
+    logo_w, logo_h = int(width * rnd.uniform(0.1, 0.25)), int(height * rnd.uniform(0.1, 0.2))
+    left, top = rnd.randrange(width - logo_w), rnd.randrange(height - logo_h)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((left, top, left + logo_w, top + logo_h), fill=(255, 255, 255))
+    draw.text((left + 2, top + 2), 'LOGO', fill=(200, 0, 0))
+    return image
+
+
+def _shift_brightness(image: Image.Image, rnd: random.Random) -> Image.Image:
+    return ImageEnhance.Brightness(image).enhance(rnd.uniform(0.8, 1.2))
+
+
+TRANSFORMS = {
+    'crop': _crop,
+    'logo': _add_logo,
+    'brightness': _shift_brightness,
+}
+
+
+def build_corpus(
+    images_dir=TEST_IMAGES_DIR, num_variants: int = 2, img_size=THUMBNAIL_SIZE, seed: int = 0
+) -> List[SyntheticImage]:
+    """ Source images and num_variants of each transformation of every source image. """
+    rnd = random.Random(seed)
+    photo_ids = {img_id: img_id for img_id in sum(map(list, SAME_PHOTOS), [])}
+    photo_ids.update({img_2: img_1 for img_1, img_2 in SAME_PHOTOS})
+    corpus = []
+    for path in sorted(Path(images_dir).glob('*.jpg')):
+        image = Image.open(path).convert('RGB').resize(img_size, Image.ANTIALIAS)
+        photo_id = photo_ids.get(path.stem, path.stem)
+        corpus.append(SyntheticImage(photo_id=photo_id, kind='original', image=image))
+        for kind, transform in TRANSFORMS.items():
+            for _ in range(num_variants):
+                corpus.append(SyntheticImage(photo_id=photo_id, kind=kind, image=transform(image, rnd)))
+    return corpus
+
+
+def _counts_as_match(engine: ImageMatchingEngine, match: Optional[ImageMatch]) -> bool:
+    """ Whether ImageMatcher counts the match towards its thresholds. """
+    return match is not None and (
+        match.num_comparers_confirmed > 0 or
+        match.num_comparers_maybe_matched == engine.num_comparers
+    )
+
+
+def _precision_recall(predicted: List[bool], expected: List[bool]) -> Dict:
+    true_positives = sum(pred and exp for pred, exp in zip(predicted, expected))
+    return {
+        'precision': round(true_positives / max(sum(predicted), 1), 3),
+        'recall': round(true_positives / max(sum(expected), 1), 3),
+    }
+
+
+def benchmark_featurize(engine: ImageMatchingEngine, corpus: List[SyntheticImage]) -> Dict:
+    """ Milliseconds per image for building pixel array, pixel statistics and features of each comparer. """
+    times = {'img_arr': 0.0, 'pixel_stats': 0.0}
+    times.update({comparer.COMPARER_ID: 0.0 for comparer in engine._comparers})
+    for synthetic in corpus:
+        start = time.perf_counter()
+        img_data = _add_img_arr(ImageData(), synthetic.image)
+        times['img_arr'] += time.perf_counter() - start
+        start = time.perf_counter()
+        img_data.pixel_stats = get_pixel_stats(img_data.img_arr, specs=engine._pixel_stats_specs)
+        times['pixel_stats'] += time.perf_counter() - start
+        for comparer in engine._comparers:
+            start = time.perf_counter()
+            comparer.add_image_data(img_data=img_data, image=synthetic.image)
+            times[comparer.COMPARER_ID] += time.perf_counter() - start
+    return {name: round(1000 * seconds / len(corpus), 4) for name, seconds in times.items()}
+
+
+def benchmark_pair_scores(engine: ImageMatchingEngine, corpus: List[SyntheticImage]) -> Dict:
+    """ Microseconds per pair of each comparer, one pair at a time and one vs many. """
+    img_datas = [engine._get_img_data_for_image(synthetic.image) for synthetic in corpus]
+    num_pairs = len(img_datas) ** 2
+    results = {}
+    for comparer in engine._comparers:
+        start = time.perf_counter()
+        for img_data_1 in img_datas:
+            for img_data_2 in img_datas:
+                comparer.get_match_score(img_data_1, img_data_2)
+        single_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stacked = comparer.stack(img_datas)
+        for img_data_1 in img_datas:
+            comparer.score_many(img_data_1, stacked)
+        many_seconds = time.perf_counter() - start
+        results[comparer.COMPARER_ID] = {
+            'pair_us': round(1e6 * single_seconds / num_pairs, 2),
+            'score_many_us': round(1e6 * many_seconds / num_pairs, 2),
+        }
+    return results
+
+
+def benchmark_backends(engine: ImageMatchingEngine, corpus: List[SyntheticImage], num_pairs: int = 100) -> Dict:
+    """ Milliseconds per image of pixel statistics and microseconds per pair of scores, for each backend. """
+    img_datas = [engine._get_img_data_for_image(synthetic.image) for synthetic in corpus]
+    rnd = random.Random(0)
+    pairs = [(rnd.choice(img_datas), rnd.choice(img_datas)) for _ in range(num_pairs)]
+    results = {}
+    for name in sorted(BACKENDS):
+        backend = get_backend(name)
+        start = time.perf_counter()
+        for img_data in img_datas:
+            backend.get_pixel_stats(img_data.img_arr, specs=engine._pixel_stats_specs)
+        stats_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for img_data_1, img_data_2 in pairs:
+            backend.ssim(img_data_1.img_as_float, img_data_2.img_as_float)
+        ssim_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for img_data_1, img_data_2 in pairs:
+            backend.hist_correlation(img_data_1.hist_norm, img_data_2.hist_norm)
+        hist_seconds = time.perf_counter() - start
+        results[name] = {
+            'pixel_stats_ms': round(1000 * stats_seconds / len(img_datas), 4),
+            'ssim_us': round(1e6 * ssim_seconds / num_pairs, 2),
+            'hist_correlation_us': round(1e6 * hist_seconds / num_pairs, 2),
+        }
+    return results
+
+
+def benchmark_engine(engine: ImageMatchingEngine, corpus: List[SyntheticImage]) -> Dict:
+    """ Pairs per second of get_image_matches, with features already computed. """
+    posts = [FlatPost(heading='benchmark_1'), FlatPost(heading='benchmark_2')]
+    fp_images_1, fp_images_2 = [
+        [FlatPostImage(flat_post=post, image=synthetic.image, img_pos=pos) for pos, synthetic in enumerate(corpus)]
+        for post in posts
+    ]
+    engine.preload_image_matches(posts[0].id, candidate_ids=[posts[1].id])
+    for fp_image in fp_images_1 + fp_images_2:
+        engine._get_img_data(fp_image)
+
+    start = time.perf_counter()
+    matches = engine.get_image_matches(fp_images_1, fp_images_2, dry=True)
+    seconds = time.perf_counter() - start
+    engine.flush_image_matches()
+
+    pairs = [(ind_1, ind_2) for ind_1 in range(len(corpus)) for ind_2 in range(len(corpus))]
+    # Image matching itself is not interesting
+    selected = [num for num, (ind_1, ind_2) in enumerate(pairs) if ind_1 != ind_2]
+    results = {'pairs_per_sec': round(len(pairs) / seconds, 1)}
+    results.update(_precision_recall(
+        predicted=[_counts_as_match(engine, matches[num]) for num in selected],
+        expected=[corpus[pairs[num][0]].photo_id == corpus[pairs[num][1]].photo_id for num in selected],
+    ))
+    return results
+
+
+def _images_to_bytes(images: List[Image.Image]) -> bytes:
+    images_bytes = []
+    for image in images:
+        img_bytes = BytesIO()
+        image.save(img_bytes, format="JPEG", optimize=True, quality=40)
+        images_bytes.append(img_bytes.getvalue())
+    return IMG_BYTES_DELIM.join(images_bytes)
+
+
+def build_posts(corpus: List[SyntheticImage], photos_per_post: int = 2) -> Tuple[List[FlatPost], List[str]]:
+    """ Unsaved posts of listings, each listing shows its own photos of the corpus.
+
+    Listing is posted once with original photos and once with each kind of variants.
+    Returns: posts and their listing ids, posts with the same listing id should match.
+    """
+    by_kind = {}
+    for synthetic in corpus:
+        by_kind.setdefault(synthetic.kind, {}).setdefault(synthetic.photo_id, []).append(synthetic.image)
+    photo_ids = sorted(by_kind['original'])
+    posts, listing_ids = [], []
+    for start in range(0, len(photo_ids) - photos_per_post + 1, photos_per_post):
+        listing_photos = photo_ids[start:start + photos_per_post]
+        for kind, images_by_photo in sorted(by_kind.items()):
+            images = [images_by_photo[photo_id][0] for photo_id in listing_photos]
+            posts.append(FlatPost(
+                heading=f'listing_{start}_{kind}',
+                price=100000 + 1000 * len(posts),
+                # Corpus images are thumbnail sized already
+                thumbnail=_images_to_bytes(images[:1]),
+                photos_bytes=_images_to_bytes(images),
+            ))
+            listing_ids.append(','.join(listing_photos))
+    return posts, listing_ids
+
+
+def benchmark_matcher(
+    engine: ImageMatchingEngine, corpus: List[SyntheticImage], photos_per_post: int = 2, exhaustive: bool = False
+) -> Dict:
+    """ End-to-end ImageMatcher, each post matched against all the others. """
+    posts, listing_ids = build_posts(corpus=corpus, photos_per_post=photos_per_post)
+    predicted, expected = [], []
+    gate_stats = Counter()
+    num_pairs = engine.cascade_stats['num_pairs']
+    start = time.perf_counter()
+    for num, post in enumerate(posts):
+        candidates = posts[:num] + posts[num + 1:]
+        matcher = ImageMatcher(
+            post=post, matching_engine=engine, dry=True, exhaustive=exhaustive, gate_stats=gate_stats
+        )
+        matched_ids = set(cand.id for cand in matcher._match_candidates(candidates))
+        predicted.extend(cand.id in matched_ids for cand in candidates)
+        expected.extend(
+            listing_ids[num] == listing_ids[cand_num] for cand_num in range(len(posts)) if cand_num != num
+        )
+    seconds = time.perf_counter() - start
+    results = {
+        'posts_per_sec': round(len(posts) / seconds, 2),
+        'candidates_per_sec': round(len(predicted) / seconds, 1),
+        'gate': dict(gate_stats),
+        'pairs_scored': engine.cascade_stats['num_pairs'] - num_pairs,
+    }
+    results.update(_precision_recall(predicted=predicted, expected=expected))
+    return results
+
+
+def run_benchmark(
+    num_variants: int = 2,
+    img_size=THUMBNAIL_SIZE,
+    photos_per_post: int = 2,
+    engine_kwargs: Optional[Dict] = None,
+    exhaustive: bool = False,
+) -> Dict:
+    engine_kwargs = engine_kwargs or {'stop_early': True, 'cascade': True, 'pyramid': True}
+    corpus = build_corpus(num_variants=num_variants, img_size=img_size)
+    results = {
+        'num_images': len(corpus),
+        'featurize_ms': benchmark_featurize(ImageMatchingEngine(**engine_kwargs), corpus),
+        'pair_score': benchmark_pair_scores(ImageMatchingEngine(**engine_kwargs), corpus),
+        'backends': benchmark_backends(ImageMatchingEngine(**engine_kwargs), corpus),
+        'engine': benchmark_engine(ImageMatchingEngine(**engine_kwargs), corpus),
+    }
+    engine = ImageMatchingEngine(**engine_kwargs)
+    try:
+        results['matcher'] = benchmark_matcher(
+            engine, corpus, photos_per_post=photos_per_post, exhaustive=exhaustive
+        )
+    finally:
+        engine.close()
+    results['cascade'] = engine.cascade_stats
+    return results
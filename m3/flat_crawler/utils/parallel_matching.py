@@ -0,0 +1,167 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Offsets of arrays in the shared block are aligned to this many bytes.
+ALIGNMENT = 64
+
+# Engine of the worker process, see _init_worker
+_worker_engine = None
+
+
+class SharedImageData(object):
+    """ Arrays of many ImageData in a single shared memory block.
+
+    Workers attach to the block by name and build ImageData with views of the
+    arrays, so features are not pickled. The block is reused by consecutive writes
+    and replaced by one twice as large only when the arrays don't fit.
+    """
+
+    def __init__(self):
+        # key -> {feature name: ('array', offset, shape, dtype) or ('value', value)}
+        self.layout = {}
+        self._shm = None
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def write(self, img_datas: Dict[Hashable, 'ImageData']) -> None:
+        """ Replaces arrays in the block, workers must not be using the previous ones. """
+        layout = {}
+        size = 0
+        for key, img_data in img_datas.items():
+            features = {}
+            for name in img_data.__slots__:
+                value = getattr(img_data, name)
+                if isinstance(value, np.ndarray):
+                    features[name] = ('array', size, value.shape, value.dtype.str)
+                    size += -(-value.nbytes // ALIGNMENT) * ALIGNMENT
+                elif value is not None:
+                    features[name] = ('value', value)
+            layout[key] = features
+        if self._shm is None or self._shm.size < size:
+            new_size = max(size, 1) if self._shm is None else max(size, 2 * self._shm.size)
+            self.close()
+            self._shm = SharedMemory(create=True, size=new_size)
+        self.layout = layout
+        for key, features in self.layout.items():
+            for name, feature in features.items():
+                if feature[0] == 'array':
+                    _get_array(self._shm, *feature[1:])[...] = getattr(img_datas[key], name)
+
+    def close(self) -> None:
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def _get_array(shm: SharedMemory, offset: int, shape: Tuple, dtype: str) -> np.array:
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+
+def _attach_img_datas(shm: SharedMemory, layout: Dict) -> Dict[Hashable, 'ImageData']:
+    from flat_crawler.utils.img_matching import ImageData
+
+    img_datas = {}
+    for key, features in layout.items():
+        img_datas[key] = ImageData(**{
+            name: _get_array(shm, *feature[1:]) if feature[0] == 'array' else feature[1]
+            for name, feature in features.items()
+        })
+    return img_datas
+
+
+def _init_worker(engine_kwargs: Dict) -> None:
+    import django
+    django.setup()
+    from flat_crawler.utils.img_matching import ImageMatchingEngine
+
+    global _worker_engine
+    _worker_engine = ImageMatchingEngine(**engine_kwargs)
+
+
+def _score_image_groups(shm: SharedMemory, layout_1: Dict, layout_2: Dict, groups: List) -> Dict:
+    return _worker_engine.score_image_groups(
+        img_datas_1=_attach_img_datas(shm, layout_1),
+        img_datas_2=_attach_img_datas(shm, layout_2),
+        groups=groups,
+    )
+
+
+def _score_in_worker(shm_name: str, layout_1: Dict, layout_2: Dict, groups: List) -> Tuple[Dict, List]:
+    stats_before = [stats.to_tuple() for stats in _worker_engine.comparer_stats]
+    shm = SharedMemory(name=shm_name)
+    try:
+        # Views of the shared block must not outlive it, they are dropped with the frame.
+        results = _score_image_groups(shm, layout_1, layout_2, groups)
+    finally:
+        shm.close()
+    stats_delta = [
+        tuple(after - before for after, before in zip(stats.to_tuple(), stats_tuple))
+        for stats, stats_tuple in zip(_worker_engine.comparer_stats, stats_before)
+    ]
+    return results, stats_delta
+
+
+class ParallelScorer(object):
+    """ Scores images of candidates in a pool of worker processes.
+
+    Pool and shared memory are created on first use and released by close, the
+    scorer can be used again afterwards.
+    """
+
+    def __init__(self, num_workers: int, engine_kwargs: Dict):
+        """
+        Args:
+            engine_kwargs: Config of ImageMatchingEngine of the workers.
+        """
+        self._num_workers = num_workers
+        self._engine_kwargs = engine_kwargs
+        self._pool = None
+        self._shared = None
+
+    def score(self, cands_img_datas: List[Tuple[Dict, Dict, List]]) -> List[Tuple[Dict, List]]:
+        """ ImageMatchingEngine.score_image_groups for each candidate, in parallel.
+
+        Args:
+            cands_img_datas: img_datas_1, img_datas_2 and groups of each candidate.
+        Returns: Results and comparer stats increments of each candidate.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._num_workers, initializer=_init_worker, initargs=(self._engine_kwargs, )
+            )
+        img_datas = {}
+        for cand_ind, (img_datas_1, img_datas_2, _) in enumerate(cands_img_datas):
+            img_datas.update({(None, ind_1): img_data for ind_1, img_data in img_datas_1.items()})
+            img_datas.update({(cand_ind, ind_2): img_data for ind_2, img_data in img_datas_2.items()})
+        if self._shared is None:
+            self._shared = SharedImageData()
+        self._shared.write(img_datas)
+        futures = []
+        for cand_ind, (img_datas_1, img_datas_2, groups) in enumerate(cands_img_datas):
+            layout_1 = {ind_1: self._shared.layout[None, ind_1] for ind_1 in img_datas_1}
+            layout_2 = {ind_2: self._shared.layout[cand_ind, ind_2] for ind_2 in img_datas_2}
+            futures.append(self._pool.submit(_score_in_worker, self._shared.name, layout_1, layout_2, groups))
+        try:
+            return [future.result() for future in futures]
+        finally:
+            # Block is written by the next call only after all workers are done with it
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
@@ -0,0 +1,100 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from flat_crawler.constants import IMAGE_FEATURES_JIT
+
+logger = logging.getLogger(__name__)
+
+COLOR_MAX = 255
+NUM_VALUES = COLOR_MAX + 1
+
+# Statistics are identified by hashable specs, comparers declare the ones they need,
+# see BaseComparer.get_pixel_stats_specs.
+# Count of each 8-bit value in each channel, shape (channels, 256).
+CHANNEL_HIST = ('channel_hist', )
+
+
+def color_hist_spec(color_bins: int) -> Tuple[str, int]:
+    """ Joint histogram of colours quantized to color_bins levels per channel, shape (color_bins ** 3, ). """
+    return ('color_hist', color_bins)
+
+
+def get_color_levels(color_bins: int) -> np.array:
+    """ Quantized level of each 8-bit value. """
+    return (np.arange(NUM_VALUES) / ((COLOR_MAX / color_bins) + 0.0001)).astype(np.int64)
+
+
+def get_channel_moments(channel_hist: np.array) -> Tuple[np.array, np.array]:
+    """ Mean and std of each channel, from exact integer sums of its histogram. """
+    num_pixels = channel_hist[0].sum()
+    values = np.arange(channel_hist.shape[1], dtype=np.int64)
+    mean = (channel_hist @ values) / num_pixels
+    var = (channel_hist @ values ** 2) / num_pixels - mean ** 2
+    return mean.astype(np.float32), np.sqrt(np.maximum(var, 0)).astype(np.float32)
+
+
+def _gather_pixel_stats(img_arr, color_levels, color_bins, channel_hist, color_hists):
+    """ Single pass over pixels, compiled with numba if IMAGE_FEATURES_JIT is set. """
+    for row in range(img_arr.shape[0]):
+        for channel in range(img_arr.shape[1]):
+            channel_hist[channel, img_arr[row, channel]] += 1
+        for ind in range(color_levels.shape[0]):
+            bins = color_bins[ind]
+            levels = color_levels[ind]
+            color = levels[img_arr[row, 0]] + levels[img_arr[row, 1]] * bins + levels[img_arr[row, 2]] * bins * bins
+            color_hists[ind, color] += 1
+
+
+_jit_gather_pixel_stats = None
+if IMAGE_FEATURES_JIT:
+    try:
+        import numba
+        _jit_gather_pixel_stats = numba.njit(cache=True, nogil=True)(_gather_pixel_stats)
+    except ImportError:
+        logger.warning("numba is not installed, pixel statistics are gathered with numpy")
+
+
+def get_pixel_stats(img_arr: np.array, specs: Iterable[Tuple]) -> Dict[Tuple, np.array]:
+    """ Gathers statistics of (num pixels, channels) uint8 array for all specs at once. """
+    specs = set(specs)
+    all_color_bins = sorted(spec[1] for spec in specs if spec[0] == 'color_hist')
+    if _jit_gather_pixel_stats is not None:
+        return _get_pixel_stats_jit(img_arr, specs=specs, all_color_bins=all_color_bins)
+
+    stats = {}
+    if CHANNEL_HIST in specs:
+        num_channels = img_arr.shape[1]
+        # Channels get disjoint ranges of codes, so a single bincount counts all of them
+        codes = img_arr + np.arange(0, num_channels * NUM_VALUES, NUM_VALUES)
+        stats[CHANNEL_HIST] = np.bincount(codes.ravel(), minlength=num_channels * NUM_VALUES).reshape(
+            num_channels, NUM_VALUES
+        )
+    for color_bins in all_color_bins:
+        levels = get_color_levels(color_bins)
+        colors = levels[img_arr[:, 0]] + levels[img_arr[:, 1]] * color_bins + levels[img_arr[:, 2]] * color_bins ** 2
+        stats[color_hist_spec(color_bins)] = np.bincount(colors, minlength=color_bins ** 3)
+    return stats
+
+
+def _get_pixel_stats_jit(img_arr: np.array, specs: set, all_color_bins: list) -> Dict[Tuple, np.array]:
+    max_colors = max((color_bins ** 3 for color_bins in all_color_bins), default=0)
+    channel_hist = np.zeros((img_arr.shape[1], NUM_VALUES), dtype=np.int64)
+    color_hists = np.zeros((len(all_color_bins), max_colors), dtype=np.int64)
+    _jit_gather_pixel_stats(
+        np.ascontiguousarray(img_arr),
+        np.array([get_color_levels(color_bins) for color_bins in all_color_bins], dtype=np.int64).reshape(
+            -1, NUM_VALUES
+        ),
+        np.array(all_color_bins, dtype=np.int64),
+        channel_hist,
+        color_hists,
+    )
+    stats = {
+        color_hist_spec(color_bins): color_hists[ind, :color_bins ** 3]
+        for ind, color_bins in enumerate(all_color_bins)
+    }
+    if CHANNEL_HIST in specs:
+        stats[CHANNEL_HIST] = channel_hist
+    return stats
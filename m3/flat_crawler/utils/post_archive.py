@@ -0,0 +1,106 @@
+import datetime
+import logging
+import sqlite3
+import uuid
+import zlib
+from typing import List, Optional
+
+from django.core import serializers
+from django.db import transaction
+
+from flat_crawler.constants import POST_ARCHIVE_PATH
+from flat_crawler.models import Flat, FlatPost, FlatSummary, ImageFeatures
+
+logger = logging.getLogger(__name__)
+
+# Large FlatPost fields moved to the archive, stub keeps the rest.
+BLOB_FIELDS = ['thumbnail', 'photos_bytes', 'image_fingerprints', 'post_soup', 'post_detailed_soup']
+
+
+def _to_key(post_id) -> str:
+    return str(uuid.UUID(str(post_id)))
+
+
+class PostArchive(object):
+    """ Cold storage of broken posts, in a separate sqlite file.
+
+    Each post is stored as zlib compressed Django json serialization of the full row
+    (including locations and areas). In the main database post is either kept as
+    a stub without blobs (archived=True), or deleted if no Flat needs it. Stubs are
+    not matching candidates, as they have no photos to compare.
+    """
+
+    def __init__(self, archive_path=POST_ARCHIVE_PATH):
+        self._conn = sqlite3.connect(str(archive_path))
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS archived_post ('
+            'id TEXT PRIMARY KEY, post_data BLOB NOT NULL, archived_at TEXT NOT NULL)'
+        )
+
+    def __contains__(self, post_id) -> bool:
+        return self._get_post_data(post_id=post_id) is not None
+
+    def __len__(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM archived_post').fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def archive_post(self, post: FlatPost, delete_row: bool = False) -> None:
+        """ Moves post blobs to the archive.
+
+        Args:
+            delete_row: Delete post from the main database, unless it's original post of a Flat.
+        """
+        post_data = zlib.compress(serializers.serialize('json', [post]).encode())
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO archived_post (id, post_data, archived_at) VALUES (?, ?, ?)',
+                (_to_key(post.id), post_data, datetime.datetime.now().isoformat()),
+            )
+        with transaction.atomic():
+            ImageFeatures.objects.filter(post=post).delete()
+            if delete_row and not Flat.objects.filter(original_post=post).exists():
+                post.delete()
+            else:
+                for field in BLOB_FIELDS:
+                    setattr(post, field, None)
+                post.archived = True
+                post.save(update_fields=BLOB_FIELDS + ['archived'])
+            FlatSummary.refresh_for_post(post)
+
+    def restore_post(self, post_id) -> Optional[FlatPost]:
+        """ Brings archived post back to the main database and removes it from the archive. """
+        post_data = self._get_post_data(post_id=post_id)
+        if post_data is None:
+            logger.warning(f"Post {post_id} not found in the archive")
+            return None
+        deserialized = next(serializers.deserialize('json', zlib.decompress(post_data).decode()))
+        archived_post = deserialized.object
+        with transaction.atomic():
+            post = FlatPost.objects.filter(id=archived_post.id).first()
+            if post is not None:
+                # Stub might have been updated since (e.g. merged to other flat), keep that.
+                for field in BLOB_FIELDS:
+                    setattr(post, field, getattr(archived_post, field))
+                post.archived = False
+                post.save(update_fields=BLOB_FIELDS + ['archived'])
+            else:
+                if not Flat.objects.filter(id=archived_post.flat_id).exists():
+                    archived_post.flat = None
+                archived_post.archived = False
+                deserialized.save()
+                post = archived_post
+            FlatSummary.refresh_for_post(post)
+        with self._conn:
+            self._conn.execute('DELETE FROM archived_post WHERE id = ?', (_to_key(post_id), ))
+        return post
+
+    def get_archived_ids(self) -> List[str]:
+        return [row[0] for row in self._conn.execute('SELECT id FROM archived_post')]
+
+    def _get_post_data(self, post_id) -> Optional[bytes]:
+        row = self._conn.execute(
+            'SELECT post_data FROM archived_post WHERE id = ?', (_to_key(post_id), )
+        ).fetchone()
+        return row[0] if row is not None else None
@@ -0,0 +1,152 @@
+import datetime
+import hashlib
+import logging
+import math
+import struct
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from flat_crawler.constants import POST_HASH_BLOOM_DIR
+from flat_crawler.models import PostHash
+from flat_crawler.utils.db_writer import get_db_writer
+
+logger = logging.getLogger(__name__)
+
+MIN_BLOOM_CAPACITY = 10000
+BLOOM_ERROR_RATE = 0.001
+
+
+class BloomFilter(object):
+    """ Set membership with false positives, but without false negatives. """
+    # num_bits, num_hashes, number of added keys, id of last added PostHash
+    HEADER = struct.Struct('<QIQQ')
+
+    def __init__(self, num_bits: int, num_hashes: int):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.num_keys = 0
+        self.last_id = 0
+        self._bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = BLOOM_ERROR_RATE) -> 'BloomFilter':
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits=num_bits, num_hashes=num_hashes)
+
+    @property
+    def capacity(self) -> int:
+        return int(self.num_bits * math.log(2) / self.num_hashes)
+
+    def add(self, key: str) -> None:
+        positions = self._get_positions(key)
+        # ufunc.at, as several positions might fall into the same byte
+        np.bitwise_or.at(self._bits, positions // 8, (1 << (positions % 8)).astype(np.uint8))
+        self.num_keys += 1
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._get_positions(key)
+        return bool(np.all(self._bits[positions // 8] & (1 << (positions % 8))))
+
+    def to_bytes(self) -> bytes:
+        header = self.HEADER.pack(self.num_bits, self.num_hashes, self.num_keys, self.last_id)
+        return header + self._bits.tobytes()
+
+    @classmethod
+    def from_bytes(cls, bloom_bytes: bytes) -> 'BloomFilter':
+        num_bits, num_hashes, num_keys, last_id = cls.HEADER.unpack_from(bloom_bytes)
+        bloom = cls(num_bits=num_bits, num_hashes=num_hashes)
+        bloom.num_keys, bloom.last_id = num_keys, last_id
+        bloom._bits = np.frombuffer(bloom_bytes, dtype=np.uint8, offset=cls.HEADER.size).copy()
+        return bloom
+
+    def _get_positions(self, key: str) -> np.array:
+        # Double hashing, i-th position is h1 + i * h2
+        digest = hashlib.md5(key.encode()).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        hashes = np.arange(self.num_hashes, dtype=np.uint64) * np.uint64(h2 | 1) + np.uint64(h1)
+        return (hashes % np.uint64(self.num_bits)).astype(np.int64)
+
+
+class PostHashIndex(object):
+    """ Membership of PostHash-es of a single source.
+
+    Bloom filter answers most lookups (new posts) from memory. Positives are
+    confirmed in the database, which also applies max_age_days. Filter is built
+    incrementally from PostHash rows added since it was last persisted.
+    """
+
+    def __init__(self, source: str, max_age_days: Optional[int] = None, bloom_dir=POST_HASH_BLOOM_DIR):
+        self._source = source
+        self._max_age_days = max_age_days
+        self._bloom_path = Path(bloom_dir) / f"{source}.bloom" if bloom_dir is not None else None
+        self._db_writer = get_db_writer()
+        # Hashes added in this process, possibly not written to the database yet.
+        self._pending = set()
+        self._bloom = self._load_bloom()
+        self._update_bloom()
+
+    def __contains__(self, post_hash: str) -> bool:
+        if post_hash not in self._bloom:
+            return False
+        if post_hash in self._pending:
+            return True
+        post_hashes = PostHash.objects.filter(source=self._source, post_hash=post_hash)
+        if self._max_age_days is not None:
+            post_hashes = post_hashes.filter(created__gte=self._get_min_created())
+        return post_hashes.exists()
+
+    def add(self, post_hash: str) -> None:
+        self._bloom.add(post_hash)
+        self._pending.add(post_hash)
+        self._db_writer.run(self._save_post_hash, post_hash=post_hash)
+
+    def flush(self) -> None:
+        """ Waits until added hashes are written and persists the filter. """
+        self._db_writer.flush()
+        self._pending.clear()
+        self._update_bloom()
+        if self._bloom_path is not None:
+            self._bloom_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._bloom_path.with_suffix('.tmp')
+            tmp_path.write_bytes(self._bloom.to_bytes())
+            tmp_path.replace(self._bloom_path)
+
+    def _save_post_hash(self, post_hash: str) -> None:
+        # Hash might be present, but aged out
+        updated = PostHash.objects.filter(source=self._source, post_hash=post_hash).update(created=datetime.datetime.now())
+        if not updated:
+            PostHash(source=self._source, post_hash=post_hash).save()
+
+    def _get_min_created(self) -> datetime.datetime:
+        return datetime.datetime.now() - datetime.timedelta(days=self._max_age_days)
+
+    def _load_bloom(self) -> BloomFilter:
+        if self._bloom_path is not None and self._bloom_path.exists():
+            bloom = BloomFilter.from_bytes(self._bloom_path.read_bytes())
+            if PostHash.objects.filter(source=self._source).count() <= bloom.capacity:
+                return bloom
+            logger.info(f"Bloom filter of {self._source} post hashes is full, rebuilding.")
+        capacity = max(MIN_BLOOM_CAPACITY, 2 * PostHash.objects.filter(source=self._source).count())
+        return BloomFilter.for_capacity(capacity=capacity)
+
+    def _update_bloom(self) -> None:
+        new_hashes = PostHash.objects.filter(
+            source=self._source, id__gt=self._bloom.last_id
+        ).order_by('id').values_list('id', 'post_hash')
+        for hash_id, post_hash in new_hashes.iterator():
+            self._bloom.add(post_hash)
+            self._bloom.last_id = hash_id
+
+
+_post_hash_indexes = {}
+
+
+def get_post_hash_index(source: str, max_age_days: Optional[int] = None) -> PostHashIndex:
+    """ Returns index shared by all crawlers of the source within the process. """
+    key = (source, max_age_days)
+    if key not in _post_hash_indexes:
+        _post_hash_indexes[key] = PostHashIndex(source=source, max_age_days=max_age_days)
+    return _post_hash_indexes[key]
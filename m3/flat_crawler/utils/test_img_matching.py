@@ -1,12 +1,16 @@
 
+import json
+import numpy as np
 import pytest
 from itertools import combinations
+from unittest.mock import patch
 
 from PIL import Image
 
 from flat_crawler.utils.img_matching import ImageMatchingEngine, FlatPostImage
 from flat_crawler.utils.img_utils import bytes_to_images
-from flat_crawler.models import FlatPost, ImageMatch
+from flat_crawler.utils.feature_store import ImageFeatureStore
+from flat_crawler.models import FlatPost, ImageMatch, ImageFeatures
 
 
 def _load_img(img_id):
@@ -89,3 +93,225 @@ def test_compare_images():
         maybe, confirmed, details = engine.compare_images(img1, img2)
         print(details)
         assert maybe + confirmed == 0
+
+
+@pytest.mark.django_db
+def test_stored_features():
+    fp_1 = FlatPost(heading='fp_1')
+    fp_1.save()
+    fp_2 = FlatPost(heading='fp_2')
+    fp_2.save()
+
+    fp_img_1 = FlatPostImage(flat_post=fp_1, image=IMAGES[2], img_pos=0)
+    fp_img_2 = FlatPostImage(flat_post=fp_2, image=IMAGES[3], img_pos=0)
+
+    engine = ImageMatchingEngine(feature_store=ImageFeatureStore())
+    match = engine.get_image_match(fp_img_1, fp_img_2, dry=True)
+    stored_comparers = [comparer for comparer in engine._comparers if comparer.FEATURES]
+    assert ImageFeatures.objects.count() == 2 * len(stored_comparers)
+    # Only compact features are stored, pixels are decoded again
+    assert all(len(features) < 2048 for features in ImageFeatures.objects.values_list('features', flat=True))
+
+    # New engine should not need to compute features again
+    engine = ImageMatchingEngine(feature_store=ImageFeatureStore())
+    with patch.object(ImageMatchingEngine, '_get_img_data_for_image', side_effect=AssertionError):
+        stored_match = engine.get_image_match(fp_img_1, fp_img_2, dry=True)
+
+    assert ImageFeatures.objects.count() == 2 * len(stored_comparers)
+    assert stored_match.num_comparers_confirmed == match.num_comparers_confirmed
+    assert stored_match.num_comparers_maybe_matched == match.num_comparers_maybe_matched
+    assert stored_match.details_json == match.details_json
+
+
+def test_score_many():
+    engine = ImageMatchingEngine()
+    img_datas = [engine._get_img_data_for_image(image.resize(IMAGES[0].size)) for image in IMAGES]
+    for comparer in engine._comparers:
+        stacked = comparer.stack(img_datas)
+        for query in img_datas:
+            scores = comparer.score_many(query, comparer.take(stacked, [1, 3, 5]))
+            expected = [comparer.get_match_score(query, img_datas[ind]) for ind in [1, 3, 5]]
+            assert scores == pytest.approx(expected)
+
+
+@pytest.mark.django_db
+def test_get_image_matches():
+    fp_1 = FlatPost(heading='fp_1')
+    fp_1.save()
+    fp_2 = FlatPost(heading='fp_2')
+    fp_2.save()
+
+    fp_images_1 = [FlatPostImage(flat_post=fp_1, image=image, img_pos=pos) for pos, image in enumerate(IMAGES[::2])]
+    fp_images_2 = [FlatPostImage(flat_post=fp_2, image=image, img_pos=pos) for pos, image in enumerate(IMAGES[1::2])]
+
+    engine = ImageMatchingEngine(stop_early=True)
+    matches = engine.get_image_matches(fp_images_1, fp_images_2, dry=True)
+    pairs = [(fp_img_1, fp_img_2) for fp_img_1 in fp_images_1 for fp_img_2 in fp_images_2]
+    assert len(matches) == len(pairs)
+    for match, (fp_img_1, fp_img_2) in zip(matches, pairs):
+        if engine._imgs_not_comparable(fp_img_1.image, fp_img_2.image):
+            assert match is None
+            continue
+        maybe, confirmed, _ = engine.compare_images(fp_img_1.image, fp_img_2.image)
+        if maybe + confirmed == 0:
+            assert match is None
+        else:
+            assert match.num_comparers_maybe_matched == maybe
+            assert match.num_comparers_confirmed == confirmed
+    assert matches[0] is not None
+
+
+def test_image_data_compact():
+    engine = ImageMatchingEngine()
+    img_data = engine._get_img_data_for_image(IMAGES[0])
+    width, height = IMAGES[0].size
+    assert img_data.img_arr.dtype == np.uint8
+    assert img_data.img_arr.shape == (width * height, 3)
+    for array in img_data.arrays():
+        assert array.dtype in (np.uint8, np.float32)
+    with pytest.raises(AttributeError):
+        img_data.unknown_feature = 1
+
+
+@pytest.mark.django_db
+def test_cascade():
+    fp_1 = FlatPost(heading='fp_1')
+    fp_1.save()
+    fp_2 = FlatPost(heading='fp_2')
+    fp_2.save()
+    fp_images_1 = [FlatPostImage(flat_post=fp_1, image=image, img_pos=pos) for pos, image in enumerate(IMAGES)]
+    fp_images_2 = [FlatPostImage(flat_post=fp_2, image=image, img_pos=pos) for pos, image in enumerate(IMAGES)]
+
+    for stop_early in [False, True]:
+        engine = ImageMatchingEngine(stop_early=stop_early)
+        cascade_engine = ImageMatchingEngine(stop_early=stop_early, cascade=True)
+        matches = engine.get_image_matches(fp_images_1, fp_images_2, dry=True)
+        for _ in range(3):
+            cascade_matches = cascade_engine.get_image_matches(fp_images_1, fp_images_2, dry=True)
+            for match, cascade_match in zip(matches, cascade_matches):
+                if cascade_match is not None:
+                    assert cascade_match.details_json == match.details_json
+                    assert cascade_match.num_comparers_confirmed == match.num_comparers_confirmed
+
+        stats = cascade_engine.cascade_stats
+        assert stats['num_pairs'] == 3 * len(IMAGES) ** 2
+        ssim_pairs = stats['comparers']['SsimComparer']['num_pairs']
+        # Most pairs of different photos are rejected before SSIM is needed
+        assert ssim_pairs < stats['num_pairs'] / 2
+
+
+@pytest.mark.django_db
+def test_preloaded_image_matches(django_assert_num_queries):
+    posts = [FlatPost(heading=f'fp_{num}') for num in range(3)]
+    for post in posts:
+        post.save()
+    fp_images = [
+        [FlatPostImage(flat_post=post, image=image, img_pos=pos) for pos, image in enumerate(IMAGES)]
+        for post in posts
+    ]
+    engine = ImageMatchingEngine()
+    engine.preload_image_matches(posts[0].id, candidate_ids=[posts[1].id, posts[2].id])
+    with django_assert_num_queries(0):
+        for cand_images in fp_images[1:]:
+            engine.get_image_matches(fp_images[0], cand_images)
+    assert ImageMatch.objects.count() == 0
+
+    with django_assert_num_queries(1):
+        engine.flush_image_matches()
+    num_matches = ImageMatch.objects.count()
+    assert num_matches > 0
+
+    # Saved matches are loaded with a single query
+    with django_assert_num_queries(1):
+        engine.preload_image_matches(posts[0].id, candidate_ids=[posts[1].id, posts[2].id])
+    with django_assert_num_queries(0):
+        matches = engine.get_image_matches(fp_images[0], fp_images[1])
+    assert all(match.pk is not None for match in matches if match is not None)
+    engine.flush_image_matches()
+    assert ImageMatch.objects.count() == num_matches
+
+
+@pytest.mark.django_db
+def test_parallel_image_matches():
+    posts = [FlatPost(heading=f'fp_{num}') for num in range(4)]
+    for post in posts:
+        post.save()
+    fp_images = [
+        [FlatPostImage(flat_post=post, image=image, img_pos=pos) for pos, image in enumerate(IMAGES)]
+        for post in posts
+    ]
+    engine = ImageMatchingEngine(stop_early=True, cascade=True)
+    parallel_engine = ImageMatchingEngine(stop_early=True, cascade=True, num_workers=2)
+    try:
+        parallel_engine.get_image_matches_many(fp_images[0], fp_images[1:], dry=True)
+        shm_name = parallel_engine._parallel_scorer._shared.name
+        parallel_matches = parallel_engine.get_image_matches_many(fp_images[0], fp_images[1:], dry=True)
+        # Shared memory is reused by the next call
+        assert parallel_engine._parallel_scorer._shared.name == shm_name
+    finally:
+        parallel_engine.close()
+    assert parallel_engine._parallel_scorer._shared is None
+    expected = engine.get_image_matches_many(fp_images[0], fp_images[1:], dry=True)
+
+    for cand_matches, cand_expected in zip(parallel_matches, expected):
+        assert len(cand_matches) == len(cand_expected)
+        for match, expected_match in zip(cand_matches, cand_expected):
+            assert (match is None) == (expected_match is None)
+            if match is not None:
+                assert match.details_json == expected_match.details_json
+    # Pairs of both calls
+    assert parallel_engine.cascade_stats['num_pairs'] == 2 * engine.cascade_stats['num_pairs']
+
+
+@pytest.mark.django_db
+def test_lazy_image_decoding():
+    posts = [FlatPost(heading=f'fp_{num}') for num in range(2)]
+    img_bytes = [
+        open(f'static/test_data/images/{img_id}.jpg', 'rb').read() for img_id in ['img_0_a', 'img_0_b', 'img_2_a']
+    ]
+
+    def get_fp_images(post):
+        return [FlatPostImage(flat_post=post, img_bytes=bts, img_pos=pos) for pos, bts in enumerate(img_bytes)]
+
+    engine = ImageMatchingEngine()
+    expected = engine.get_image_matches(get_fp_images(posts[0]), get_fp_images(posts[1]), dry=True)
+
+    # Features are cached, images are neither decoded nor opened again
+    fp_images_1, fp_images_2 = get_fp_images(posts[0]), get_fp_images(posts[1])
+    matches = engine.get_image_matches(fp_images_1, fp_images_2, dry=True)
+    assert all(fp_image._image is None for fp_image in fp_images_1 + fp_images_2)
+    assert [match and match.details_json for match in matches] == [match and match.details_json for match in expected]
+
+
+@pytest.mark.django_db
+def test_pyramid():
+    posts = [FlatPost(heading=f'fp_{num}') for num in range(2)]
+    fp_images = [
+        [FlatPostImage(flat_post=post, image=image, img_pos=pos) for pos, image in enumerate(IMAGES)]
+        for post in posts
+    ]
+    engine = ImageMatchingEngine(cascade=True)
+    pyramid_engine = ImageMatchingEngine(pyramid=True, cascade=True)
+    comparers = pyramid_engine._comparers
+    ssim_comparer = next(comparer for comparer in comparers if comparer.COMPARER_ID == 'SsimComparer')
+    with patch.object(ssim_comparer, 'get_match_score', wraps=ssim_comparer.get_match_score) as get_match_score:
+        matches = pyramid_engine.get_image_matches(fp_images[0], fp_images[1], dry=True)
+    # Unrelated pairs are rejected on coarse images
+    assert get_match_score.call_count < len(IMAGES) ** 2
+    expected = engine.get_image_matches(fp_images[0], fp_images[1], dry=True)
+
+    for match, expected_match in zip(matches, expected):
+        assert (match is None) == (expected_match is None)
+        if match is None:
+            continue
+        assert match.num_comparers_confirmed == expected_match.num_comparers_confirmed
+        assert match.num_comparers_maybe_matched == expected_match.num_comparers_maybe_matched
+        scores, expected_scores = json.loads(match.details_json), json.loads(expected_match.details_json)
+        for comparer in comparers:
+            score, expected_score = scores[comparer.COMPARER_ID], expected_scores[comparer.COMPARER_ID]
+            assert score == pytest.approx(expected_score)
+
+    # Without cascade scores of all pairs are saved, coarse scores are not used
+    matches = ImageMatchingEngine(pyramid=True).get_image_matches(fp_images[0], fp_images[1], dry=True)
+    expected = ImageMatchingEngine().get_image_matches(fp_images[0], fp_images[1], dry=True)
+    assert [match and match.details_json for match in matches] == [match and match.details_json for match in expected]
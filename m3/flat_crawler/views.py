@@ -3,13 +3,12 @@ import django_filters
 from django.shortcuts import render
 from django.views.generic.list import ListView
 from django.http import JsonResponse
-from django.db.models import Count
 
 from rest_framework.generics import ListAPIView
-from flat_crawler.serializers import FlatSerializers
+from flat_crawler.serializers import FlatSummarySerializers
 from flat_crawler.pagination import StandardResultsSetPagination
 
-from flat_crawler.models import Flat, FlatPost
+from flat_crawler.models import Flat, FlatSummary
 from flat_crawler.constants import SELECTED_DISTRICTS, DEVELOPER_KEY
 
 
@@ -18,7 +17,7 @@ def FlatList(request):
 
 class FlatView(ListAPIView):
     pagination_class = StandardResultsSetPagination
-    serializer_class = FlatSerializers
+    serializer_class = FlatSummarySerializers
 
     def get_queryset(self):
         show_rejected = self.request.query_params.get('show_rejected', None)
@@ -32,17 +31,10 @@ class FlatView(ListAPIView):
         min_price = self.request.query_params.get('min_price', None)
         max_price = self.request.query_params.get('max_price', None)
 
-        posts = FlatPost.objects.annotate(
-            num_areas=Count('areas'),
-            num_locations=Count('locations')
-        ).exclude(num_locations__gt=0, num_areas=0)
-
-        posts = posts.exclude(keywords__contains=DEVELOPER_KEY)
-
-        queryset = Flat.objects.filter(
-            original_post__district__in=SELECTED_DISTRICTS,
-            original_post__in=posts
-        )
+        queryset = FlatSummary.objects.filter(
+            district__in=SELECTED_DISTRICTS,
+            outside_search_areas=False,
+        ).exclude(keywords__contains=DEVELOPER_KEY)
 
         if not show_rejected == 'true':
             queryset = queryset.filter(rejected=False)
@@ -53,11 +45,11 @@ class FlatView(ListAPIView):
         if not show_unseen == 'true':
             queryset = queryset.exclude(starred=False, hearted=False, rejected=False)
         if district:
-            queryset = queryset.filter(original_post__district=district)
+            queryset = queryset.filter(district=district)
         if min_size:
-            queryset = queryset.filter(original_post__size_m2__gte=int(min_size))
+            queryset = queryset.filter(size_m2__gte=int(min_size))
         if max_size:
-            queryset = queryset.filter(original_post__size_m2__lte=int(max_size))
+            queryset = queryset.filter(size_m2__lte=int(max_size))
         if min_price:
             queryset = queryset.filter(min_price__gte=int(min_price))
         if max_price:
@@ -66,11 +58,21 @@ class FlatView(ListAPIView):
         if sort_by == 'price':
             queryset = queryset.order_by('min_price')
         elif sort_by == 'dt_posted':
-            queryset = queryset.order_by('-original_post__dt_posted')
+            queryset = queryset.order_by('-dt_posted')
         else:
-            queryset = queryset.order_by('-original_post__dt_posted')
+            queryset = queryset.order_by('-dt_posted')
         return queryset
 
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # Photos of the page's original posts only, in a query reading no other post columns
+        photos_bytes = dict(Flat.objects.filter(
+            id__in=[summary.flat_id for summary in page]
+        ).values_list('id', 'original_post__photos_bytes'))
+        for summary in page:
+            summary.photos = Flat.encode_photos(photos_bytes[summary.flat_id])
+        return page
+
 
 def get_districts(request):
     if request.method == 'GET' and request.is_ajax():
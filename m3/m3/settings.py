@@ -0,0 +1,2 @@
+SECRET_KEY = 'dev'
+from m3.settings_defaults import *
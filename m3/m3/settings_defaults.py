@@ -167,4 +167,61 @@ IGNORED_DISTRICTS = [
 ]
 
 DEFAULT_MIN_PRICE = 200000
-DEFAULT_MAX_PRICE = 1000000
\ No newline at end of file
+DEFAULT_MAX_PRICE = 1000000
+
+# Directory of memory-mapped atlas of decoded post images, None disables the atlas.
+IMAGE_ATLAS_DIR = None
+
+# Enables WAL journal and tuned pragmas on sqlite connections and routes crawler
+# and matcher writes through a single writer thread, so the web UI can be used
+# while posts are being crawled and matched.
+SQLITE_CONCURRENT_MODE = False
+# Max number of writes executed by the writer thread in a single transaction.
+DB_WRITER_BATCH_SIZE = 200
+
+# Directory of persisted bloom filters of crawled post hashes. If None, filters
+# are built from the database once per process.
+POST_HASH_BLOOM_DIR = None
+
+# Sqlite file storing archived broken posts, see archive_posts command.
+POST_ARCHIVE_PATH = BASE_DIR / 'archive.sqlite3'
+
+# Max hamming distance of 64 bit dHash-es of two images compared by ImageMatcher.
+# None compares all pairs of images.
+IMAGE_HASH_RADIUS = 10
+
+# Memory budget of image features cached by the image matching engine, None is unbounded.
+IMAGE_DATA_CACHE_MB = 512
+
+# Number of processes scoring candidate images in parallel, None matches in a single process.
+IMAGE_MATCHING_WORKERS = None
+
+# Directory of the approximate nearest neighbour index of image histograms. Flats with
+# images similar to images of a new post are its candidates, regardless of size and price.
+# None disables the index.
+HISTOGRAM_INDEX_DIR = None
+# Max number of similar posts taken from the index, and min Bhattacharyya coefficient of
+# their histograms.
+HISTOGRAM_INDEX_TOP_K = 10
+HISTOGRAM_INDEX_MIN_SIMILARITY = 0.95
+
+# Compile the single pass over pixels gathering statistics for image comparers with
+# numba, if it's installed. Otherwise the statistics are gathered with numpy.
+IMAGE_FEATURES_JIT = False
+
+# Compute backend of image comparers: 'numpy', 'opencv' or 'skimage'. Scores agree up to
+# floating point errors, see benchmark_matching for their speed.
+IMAGE_COMPARERS_BACKEND = 'numpy'
+
+# Compare all pairs of gallery images of a candidate post, instead of stopping as soon as
+# the image matcher is decided. Decisions are the same, it's meant for auditing matches.
+IMAGE_MATCHING_EXHAUSTIVE = False
+
+# consolidate_flats merges flats of posts with at least CONSOLIDATION_MIN_IMAGE_MATCHES
+# image matches of at least CONSOLIDATION_MIN_IMAGE_SCORE avg_score.
+CONSOLIDATION_MIN_IMAGE_SCORE = 0.9
+CONSOLIDATION_MIN_IMAGE_MATCHES = 2
+
+# Find candidates of posts in an in-memory index of original posts sorted by size and
+# price, loaded once per matching run, instead of a range query for each post.
+MATCHING_BLOCKING_INDEX = True
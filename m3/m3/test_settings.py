@@ -0,0 +1,3 @@
+# Settings of the test suite, see pytest.ini. Developers' m3/settings.py isn't tracked.
+SECRET_KEY = 'test'
+from m3.settings_defaults import *